@@ -1,13 +1,31 @@
 from flask import Flask, request, jsonify, Response, send_from_directory
 from flask_cors import CORS
+import asyncio
 import json
-from threading import Thread, Event
+import os
+from threading import Thread, Event, Condition
 import time
-from queue import Queue
+import uuid
 import logging
 from llm_summarizer import *
 from html_extractor import *
 from page_scraper import *
+from browser_pool import get_browser_pool
+from llm_client import get_llm_client
+from llm_cache import get_llm_cache
+from selector_cache import get_selector_cache
+from widget_extractors import extraction_path_stats
+from review_dedup import ReviewDedupIndex
+from job_scheduler import JobScheduler, QUEUED, COMPLETE, ERROR, STOPPED
+from result_store import get_result_store
+from json_stream import parse_review_array
+from bulk_jobs import get_bulk_manager, BULK_MAX_URLS
+from html_pool import get_html_pool
+from metrics import ACTIVE_JOBS, REVIEWS, metrics_response
+from compact_html import compaction_stats
+
+SSE_KEEPALIVE = float(os.environ.get("SSE_KEEPALIVE", 15))  # Seconds between keep-alive comments of idle streams
+BACKGROUND_PRIORITY = 100  # Refreshes of stale stored reviews start after the jobs clients wait for
 
 app = Flask(__name__, static_folder="../review_api/build", static_url_path = "/")
 CORS(app, resources={
@@ -18,16 +36,16 @@ CORS(app, resources={
 })
 logging.basicConfig(level=logging.INFO)
 
-# Store active review managers and their results
-active_processes = {}
-
 class ProcessManager:
-    def __init__(self, url, review_manager, queue):
+    def __init__(self, url, review_manager):
         self.url = url
         self.manager = review_manager
-        self.queue = queue
         self.stop_event = Event()
         self.thread = None
+        # Set by the job scheduler
+        self.status = QUEUED
+        self.error = None
+        self.on_finish = None
 
     def start(self):
         """Start the background processor thread."""
@@ -35,8 +53,11 @@ class ProcessManager:
         self.thread.daemon = True
         self.thread.start()
 
-    def stop(self):
-        """Stop the background processor thread and the scraping process."""
+    def stop(self, wait=True):
+        """
+        Stop the background processor thread and the scraping process. Without wait the job
+        is only signalled, it finishes the page it is on and calls on_finish by itself.
+        """
         logging.info(f"Stopping processing for {self.url}")
 
         # Signal the stop event
@@ -48,6 +69,8 @@ class ProcessManager:
             logging.info(f"Scraping process for {self.url} stopped successfully.")
         except Exception as e:
             logging.error(f"Error stopping the scraping process: {e}")
+        if not wait:
+            return
 
         # Wait for the background thread to finish
         if self.thread and self.thread.is_alive():
@@ -60,49 +83,292 @@ class ProcessManager:
         except Exception as e:
             logging.error(f"Error finalizing generator: {e}")
 
+    def _record_outcome(self, success):
+        if self.stop_event.is_set():
+            self.status = STOPPED
+        elif success:
+            self.status = COMPLETE
+        else:
+            self.error = "Failed to process reviews"
+            self.status = ERROR
+
+    def _record_error(self, e):
+        logging.error(f"Error processing reviews: {str(e)}")
+        self.error = str(e)
+        self.status = ERROR
+
+    def _finished(self):
+        self.manager.finish_run(self.status)
+        # Wake the streams so they send the final status
+        self.manager.notify_update()
+        if self.on_finish:
+            self.on_finish(self)
+
     def background_processor(self):
         """Background thread to process reviews."""
         try:
             logging.info(f"Starting review processing for {self.url}")
-            success = self.manager.add_reviews(stop_event=self.stop_event)
-            if success and not self.stop_event.is_set():
-                self.queue.put(("complete", None))
-            else:
-                self.queue.put(("error", "Failed to process reviews"))
+            self._record_outcome(self.manager.add_reviews(stop_event=self.stop_event))
         except Exception as e:
-            logging.error(f"Error processing reviews: {str(e)}")
-            self.queue.put(("error", str(e)))
+            self._record_error(e)
+        finally:
+            self._finished()
 
 
-def generate_updates(url, process_manager):
-    """Generator for SSE events"""
-    last_result = None
-    
-    while not process_manager.stop_event.is_set():
-        if not process_manager.queue.empty():
-            status, error = process_manager.queue.get()
-            if status == "error":
-                yield f"data: {json.dumps({'error': error})}\n\n"
-                break
-            elif status == "complete":
-                yield f"data: {json.dumps({'status': 'complete'})}\n\n"
+def create_job(url, result_order=None):
+    return ProcessManager(url, ReviewManager(url=url, result_order=result_order))
+
+
+# Jobs of all requested URLs, a limited number of them runs at a time
+scheduler = JobScheduler(create_job)
+ACTIVE_JOBS.set_function(lambda: scheduler.stats()["running"])
+
+
+def sse_event(event, data, event_id=None):
+    """Format one server-sent event"""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def opening_events(url, process_manager, last_event_id, job_scheduler):
+    """
+    Events sent when a client subscribes to a job, and the number of reviews they cover.
+
+    A new subscriber gets a "snapshot" event with the reviews collected so far, a client
+    reconnecting with Last-Event-ID continues after the reviews it already received.
+    """
+    events = []
+    manager = process_manager.manager
+    if process_manager.status == QUEUED:
+        events.append(sse_event("status", {"status": "queued", "position": job_scheduler.queue_position(url)}))
+    if last_event_id is None or last_event_id > manager.result["reviews_count"]:
+        reviews = manager.reviews_since(0)
+        events.append(sse_event("snapshot", {"reviews_count": len(reviews), "reviews": reviews}, len(reviews)))
+        return events, len(reviews)
+    return events, last_event_id
+
+
+def update_events(process_manager, sent):
+    """
+    Events for the reviews added after the first `sent` ones and for the outcome of the job.
+
+    Returns:
+        tuple: (events, number of reviews sent, whether the stream is done)
+    """
+    events = []
+    # Read the status before the reviews so that the last reviews are sent before "complete"
+    status = process_manager.status
+    reviews = process_manager.manager.reviews_since(sent)
+    if reviews:
+        sent += len(reviews)
+        events.append(sse_event("reviews", {"reviews_count": sent, "reviews": reviews}, sent))
+
+    if status == ERROR:
+        events.append(sse_event("status", {"status": "error", "error": process_manager.error}))
+    elif status == COMPLETE:
+        events.append(sse_event("status", {"status": "complete"}))
+    elif status == STOPPED:
+        # Clients close their EventSource on it, otherwise they reconnect and start the job again
+        events.append(sse_event("status", {"status": "stopped"}))
+    return events, sent, status in (ERROR, COMPLETE, STOPPED)
+
+
+def generate_updates(url, process_manager, last_event_id=None):
+    """
+    Generator for SSE events.
+
+    After the opening events, a "reviews" event with only the new reviews is sent whenever
+    the job adds some. Event ids are the number of reviews sent, so a client reconnecting
+    with Last-Event-ID gets only the reviews it missed. The outcome of the job is sent as
+    a "status" event.
+    """
+    manager = process_manager.manager
+    scheduler.subscribe(url)
+    try:
+        version = manager.version
+        events, sent = opening_events(url, process_manager, last_event_id, scheduler)
+        yield from events
+
+        while True:
+            events, sent, done = update_events(process_manager, sent)
+            yield from events
+            if done:
                 break
 
-        current_result = process_manager.manager.get_reviews()
-        if current_result and current_result != last_result:
-            yield f"data: {json.dumps(current_result)}\n\n"
-            last_result = current_result.copy()
-            
-        time.sleep(1)
+            new_version = manager.wait_for_update(version, timeout=SSE_KEEPALIVE)
+            if new_version == version:
+                # Comments keep proxies from closing the connection and detect gone clients
+                yield ": keep-alive\n\n"
+            version = new_version
+    finally:
+        scheduler.unsubscribe(url)
+
+
+def normalize_url(url):
+    if "https://" not in url:
+        url="https://"+url
+    return url
+
+
+def parse_review_request(args, headers):
+    """
+    Validated parameters of a /api/reviews request.
+
+    Returns:
+        tuple: (url, result order, priority, last event id, whether stored reviews may be served)
+
+    Raises:
+        ValueError: with the message for the client
+    """
+    url = args.get('page')
+    if not url:
+        raise ValueError("URL parameter is required")
+    url = normalize_url(url)
+
+    # Reviews are streamed in page order unless "completion" order is requested
+    result_order = args.get('order')
+    if result_order not in (None, "page", "completion"):
+        raise ValueError("order must be 'page' or 'completion'")
+
+    try:
+        priority = int(args.get('priority', 0))
+    except ValueError:
+        raise ValueError("priority must be an integer")
+
+    # Reconnecting EventSource clients send the id of the last event they received
+    try:
+        last_event_id = max(0, int(headers.get('Last-Event-ID', '')))
+    except ValueError:
+        last_event_id = None
+
+    # "refresh=1" skips the result store and scrapes the page again
+    use_store = args.get('refresh', '0').lower() not in ('1', 'true', 'yes')
+
+    return url, result_order, priority, last_event_id, use_store
+
+
+def stored_events(url, result_order, job_scheduler):
+    """
+    Events answering a request from the result store, None if it has no reviews of url.
+
+    Stale reviews are still served, a refresh job is queued in the background for the
+    next request.
+    """
+    store = get_result_store()
+    if store is None:
+        return None
+    stored = store.latest(url)
+    if stored is None:
+        return None
+    if not stored.fresh:
+        logging.info(f"Stored reviews of {url} are {stored.age:.0f}s old, refreshing them in the background")
+        job_scheduler.submit(url, priority=BACKGROUND_PRIORITY, background=True, refresh=True, result_order=result_order)
+    return [
+        sse_event("snapshot", {"reviews_count": len(stored.reviews), "reviews": stored.reviews}, len(stored.reviews)),
+        sse_event("status", {"status": "complete", "cached": True, "age": round(stored.age), "refreshing": not stored.fresh})
+    ]
+
+
+def parse_bulk_request(body):
+    """
+    Validated parameters of a /api/bulk request, a JSON object with a list of urls and an optional order.
+
+    Raises:
+        ValueError: with the message for the client
+    """
+    if not isinstance(body, dict):
+        raise ValueError("JSON body with a list of urls is required")
+    urls = body.get('urls')
+    if not isinstance(urls, list) or not urls or not all(isinstance(url, str) and url for url in urls):
+        raise ValueError("urls must be a non-empty list of URLs")
+    if len(urls) > BULK_MAX_URLS:
+        raise ValueError(f"At most {BULK_MAX_URLS} urls can be submitted at once")
+    result_order = body.get('order')
+    if result_order not in (None, "page", "completion"):
+        raise ValueError("order must be 'page' or 'completion'")
+    return [normalize_url(url) for url in urls], result_order
+
+
+def submit_bulk(body):
+    """Queue the jobs of a bulk request, returns the response and its status code"""
+    try:
+        urls, result_order = parse_bulk_request(body)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    jobs = get_bulk_manager().submit(urls, result_order=result_order)
+    return {"jobs": [job.as_dict() for job in jobs]}, 202
+
+
+def bulk_status(job_id):
+    job = get_bulk_manager().get(job_id)
+    if job is None:
+        return {"error": "Unknown job"}, 404
+    return job.as_dict(), 200
+
+
+def bulk_result(job_id):
+    """Reviews of a finished bulk job; its status while it is queued or running"""
+    job = get_bulk_manager().get(job_id)
+    if job is None:
+        return {"error": "Unknown job"}, 404
+    if job.status == ERROR:
+        return job.as_dict(), 500
+    if job.status != COMPLETE:
+        return job.as_dict(), 202
+    reviews = job.result.get("reviews")
+    if reviews is None:
+        # The worker wrote the reviews to the result store, a newer run of the URL replaces them
+        store = get_result_store()
+        stored = store and (store.run(job.result["run_id"]) or store.latest(job.url))
+        if not stored:
+            return dict(job.as_dict(), error="The reviews of this job are no longer stored"), 410
+        reviews = stored.reviews
+    return dict(job.as_dict(), reviews=reviews, stats=job.result["stats"]), 200
+
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no'
+}
+
+
+def service_stats(job_scheduler):
+    """Counters of the jobs, bulk jobs, shared LLM client, response cache, extraction paths, LLM input compaction, HTML parse pool, selector cache and browser pool"""
+    llm_cache = get_llm_cache()
+    result_store = get_result_store()
+    return {
+        "scheduler": job_scheduler.stats(),
+        "jobs": [dict(job.manager.job_stats(), status=job.status) for job in job_scheduler.jobs()],
+        "llm": get_llm_client().stats.as_dict(),
+        "llm_cache": llm_cache.stats() if llm_cache else None,
+        "result_store": result_store.stats() if result_store else None,
+        "bulk": get_bulk_manager().stats(),
+        "extraction_paths": extraction_path_stats.as_dict(),
+        "llm_input": compaction_stats.as_dict(),
+        "html_pool": get_html_pool().stats(),
+        "selector_cache": get_selector_cache().stats(),
+        "browser_pool": get_browser_pool().stats()
+    }
 
 class ReviewManager(OutputGenerator):
-    def __init__(self, url):
-        super().__init__(url=url)
+    def __init__(self, url, result_order=None, dedup_mode=None):
+        super().__init__(url=url, result_order=result_order)
         self.result = {
             "reviews_count": 0,
             "reviews": []
         }
         self.generator_running = False
+        self.dedup_index = ReviewDedupIndex(mode=dedup_mode) if dedup_mode else ReviewDedupIndex()
+        self._updated = Condition()
+        self.version = 0  # Incremented whenever reviews are added or the job ends
+        self._listeners = []  # Callbacks of the asyncio streams, called on every update
+        self.store = get_result_store()
+        self.on_reviews = self.add_page_reviews
+        self.run_id = uuid.uuid4().hex
         
     def initialize_selector(self):
         """Initialize the selector before processing reviews"""
@@ -121,7 +387,7 @@ class ReviewManager(OutputGenerator):
     def stop_scraping(self):
         """Stop the scraping process."""
         logging.info("Stopping the scraping process...")
-        super().stop_scraping()  # Assumes stop_scraping is implemented in page_scraper.py
+        super().stop_scraping()
 
     def finalize_generator(self):
         """Ensure the generator is fully consumed and stopped."""
@@ -133,6 +399,8 @@ class ReviewManager(OutputGenerator):
 
     def add_reviews(self, stop_event=None):
         """Process reviews and add them to the result."""
+        self.stop_event = stop_event
+        self.begin_run()
         try:
             if not self.initialize_selector():
                 return False
@@ -145,7 +413,6 @@ class ReviewManager(OutputGenerator):
                 return False
 
             self.generator_running = True
-            reviews_processed = False
 
             for val in gen:
                 if stop_event and stop_event.is_set():
@@ -155,85 +422,195 @@ class ReviewManager(OutputGenerator):
                     logging.warning("Empty value from generator, skipping...")
                     continue
 
-                try:
-                    new_reviews = json.loads(val)
-                    formatted_reviews = [
-                        {
-                            "title": review.get("title", "No Title"),
-                            "body": review.get("body", "No Body"),
-                            "rating": review.get("rating", 0),
-                            "reviewer": review.get("reviewer", "Anonymous")
-                        }
-                        for review in new_reviews if isinstance(review, dict)
-                    ]
-                    if formatted_reviews:
-                        self.result["reviews"].extend(formatted_reviews)
-                        self.result["reviews_count"] += len(formatted_reviews)
-                        reviews_processed = True
-                        logging.info(f"Added {len(formatted_reviews)} reviews. Total: {self.result['reviews_count']}")
-                except json.JSONDecodeError as e:
-                    logging.error(f"JSON decode error: {e}")
-                    continue
-                except Exception as e:
-                    logging.error(f"Error processing review: {e}")
-                    continue
+                self._add_output(val)
 
             self.generator_running = False
-            return reviews_processed
+            return self.result["reviews_count"] > 0
 
         except Exception as e:
             logging.error(f"Error in add_reviews: {e}")
             self.generator_running = False
             return False
 
+    async def aadd_reviews(self, stop_event=None):
+        """Async version of add_reviews, consuming agenerateReviews on the event loop."""
+        loop = asyncio.get_running_loop()
+        self.stop_event = stop_event
+        self.begin_run()
+        try:
+            # Finding the pagination selector drives Selenium, which blocks
+            if not await loop.run_in_executor(None, self.initialize_selector):
+                return False
+
+            logging.info("Starting review generation...")
+            self.generator_running = True
+            gen = self.agenerateReviews()
+            try:
+                async for val in gen:
+                    if stop_event and stop_event.is_set():
+                        logging.info("Stop event received. Halting generator processing.")
+                        break
+                    if not val:
+                        logging.warning("Empty value from generator, skipping...")
+                        continue
+                    self._add_output(val)
+            finally:
+                await gen.aclose()
+            return self.result["reviews_count"] > 0
+
+        except Exception as e:
+            logging.error(f"Error in aadd_reviews: {e}")
+            return False
+        finally:
+            self.generator_running = False
+
+    def _add_output(self, val):
+        """Parse the output of one page and add its new reviews to the result, returns the number added."""
+        # Reviews completed before a truncation or malformed tail are kept
+        return self.add_page_reviews(self.last_page, parse_review_array(val))
+
+    def add_page_reviews(self, page, new_reviews):
+        """
+        Add the new reviews extracted from a page to the result, returns the number added.
+        Also called from the extraction workers with reviews streamed from the LLM.
+        """
+        try:
+            formatted_reviews = [
+                {
+                    "title": review.get("title", "No Title"),
+                    "body": review.get("body", "No Body"),
+                    "rating": review.get("rating", 0),
+                    "reviewer": review.get("reviewer", "Anonymous")
+                }
+                for review in new_reviews if isinstance(review, dict)
+            ]
+            received = len(formatted_reviews)
+            formatted_reviews = self.dedup_index.filter(formatted_reviews)
+            if received > len(formatted_reviews):
+                logging.info(f"Dropped {received - len(formatted_reviews)} duplicate reviews")
+            if formatted_reviews:
+                with self._updated:
+                    self.result["reviews"].extend(formatted_reviews)
+                    self.result["reviews_count"] += len(formatted_reviews)
+                    if self.store:
+                        self.store.add(self.run_id, page, formatted_reviews)
+                self.notify_update()
+                REVIEWS.inc(len(formatted_reviews))
+                logging.info(f"Added {len(formatted_reviews)} reviews. Total: {self.result['reviews_count']}")
+            return len(formatted_reviews)
+        except Exception as e:
+            logging.error(f"Error processing review: {e}")
+        return 0
+
+    def begin_run(self):
+        if self.store:
+            self.store.begin(self.run_id, self.url)
+
+    def finish_run(self, status):
+        """Keep the reviews of a completed job in the result store, drop those of a failed one"""
+        if self.store:
+            self.store.finish(self.run_id, self.url, status)
+
     def get_reviews(self):
         return self.result
 
+    def reviews_since(self, index):
+        """Reviews added after the first `index` ones"""
+        with self._updated:
+            return self.result["reviews"][index:]
+
+    def notify_update(self):
+        with self._updated:
+            self.version += 1
+            self._updated.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def add_listener(self, callback):
+        """Call `callback()` from the updating thread whenever reviews are added or the job ends"""
+        with self._updated:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._updated:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def wait_for_update(self, version, timeout=None):
+        """Block until the version differs from `version` or the timeout passed, returns the current version"""
+        with self._updated:
+            self._updated.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def job_stats(self):
+        """Counters of this job"""
+        return {
+            "url": self.url,
+            "reviews_count": self.result["reviews_count"],
+            "duplicate_reviews": self.dedup_index.duplicates,
+            "duplicate_pages": self.scraper.duplicate_pages if self.scraper else 0,
+            "dedup_mode": self.dedup_index.mode
+        }
+
 
 @app.route('/api/reviews', methods=['GET'])
 def reviews():
-    url = request.args.get('page')
-    if not url:
-        return jsonify({"error": "URL parameter is required"}), 400
-    
-    if "https://" not in url:
-        url="https://"+url
+    try:
+        url, result_order, priority, last_event_id, use_store = parse_review_request(request.args, request.headers)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # Stop any existing processes before starting a new one
-    for existing_url, process in list(active_processes.items()):
-        if existing_url != url:
-            logging.info(f"Stopping existing process for {existing_url}")
-            process.stop()
-            del active_processes[existing_url]
+    # Reviews extracted earlier are answered at once
+    events = stored_events(url, result_order, scheduler) if use_store else None
+    if events:
+        return Response("".join(events), mimetype='text/event-stream', headers=SSE_HEADERS)
 
-    # Create new process if it doesn't exist
-    if url not in active_processes:
-        try:
-            review_manager = ReviewManager(url=url)
-            queue = Queue()
-            
-            process_manager = ProcessManager(url, review_manager, queue)
-            active_processes[url] = process_manager
-            process_manager.start()
-            
-            logging.info(f"Started processing for {url}")
-        except Exception as e:
-            logging.error(f"Error initializing review manager: {str(e)}")
-            return jsonify({"error": str(e)}), 500
+    # Requests for a URL that is already queued or running share its job
+    try:
+        process_manager = scheduler.submit(url, priority=priority, refresh=not use_store, result_order=result_order)
+    except Exception as e:
+        logging.error(f"Error initializing review manager: {str(e)}")
+        return jsonify({"error": str(e)}), 500
 
     return Response(
-        generate_updates(url, active_processes[url]),
+        generate_updates(url, process_manager, last_event_id=last_event_id),
         mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'X-Accel-Buffering': 'no'
-        }
+        headers=SSE_HEADERS
     )
     
+@app.route('/api/bulk', methods=['POST'])
+def bulk_submit():
+    payload, status = submit_bulk(request.get_json(silent=True))
+    return jsonify(payload), status
+
+@app.route('/api/bulk/<job_id>', methods=['GET'])
+def bulk_job_status(job_id):
+    payload, status = bulk_status(job_id)
+    return jsonify(payload), status
+
+@app.route('/api/bulk/<job_id>/reviews', methods=['GET'])
+def bulk_job_reviews(job_id):
+    payload, status = bulk_result(job_id)
+    return jsonify(payload), status
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    return jsonify(service_stats(scheduler))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    body, content_type = metrics_response()
+    return Response(body, content_type=content_type)
+
 @app.route('/')
 def homepage():
     return send_from_directory(app.static_folder, "index.html")
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    debug = True
+    # Start browsers ahead of the first job so that it doesn't pay Chrome startup. With debug on, the
+    # reloader parent only watches files, the reloaded child serving the jobs warms up its own pool
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        get_browser_pool().warm_up()
+    app.run(debug=debug)
\ No newline at end of file
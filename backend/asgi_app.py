@@ -0,0 +1,192 @@
+"""
+Asyncio serving mode of the reviews API.
+
+Same routes and event format as app.py, but every SSE stream is a coroutine waiting on
+an asyncio queue fed by its job instead of a thread, so one process holds thousands of
+idle streams. Jobs run on the event loop and call the LLM through the async client,
+Selenium and HTML parsing are offloaded to executor threads.
+
+Run with: uvicorn asgi_app:app --port 5000
+"""
+import asyncio
+import logging
+
+from quart import Quart, request, jsonify, Response, send_from_directory
+from quart_cors import cors
+
+from app import (ProcessManager, ReviewManager, SSE_HEADERS, SSE_KEEPALIVE, opening_events, update_events,
+                 parse_review_request, stored_events, service_stats, submit_bulk, bulk_status, bulk_result)
+from browser_pool import get_browser_pool
+from job_scheduler import JobScheduler
+from metrics import ACTIVE_JOBS, metrics_response
+
+app = Quart(__name__, static_folder="../review_api/build", static_url_path="/")
+app = cors(app, allow_origin=["http://localhost:5000", "http://127.0.0.1:5000"], allow_credentials=True)
+logging.basicConfig(level=logging.INFO)
+
+
+class AsyncProcessManager(ProcessManager):
+    """ProcessManager running its job as a task on the event loop instead of a thread."""
+
+    def __init__(self, url, review_manager, loop):
+        super().__init__(url, review_manager)
+        self.loop = loop
+        self.task = None
+
+    def start(self):
+        # The scheduler starts jobs from request handlers, finishing jobs and its reaper thread
+        self.loop.call_soon_threadsafe(self._create_task)
+
+    def _create_task(self):
+        self.task = self.loop.create_task(self.background_processor())
+
+    def stop(self, wait=True):
+        # The task is cancelled on the loop, stopping never blocks the caller
+        logging.info(f"Stopping processing for {self.url}")
+        self.stop_event.set()
+        try:
+            self.manager.stop_scraping()
+        except Exception as e:
+            logging.error(f"Error stopping the scraping process: {e}")
+        if self.task:
+            self.loop.call_soon_threadsafe(self.task.cancel)
+
+    async def background_processor(self):
+        """Task processing the reviews of the job."""
+        try:
+            logging.info(f"Starting review processing for {self.url}")
+            self._record_outcome(await self.manager.aadd_reviews(stop_event=self.stop_event))
+        except asyncio.CancelledError:
+            # Only stop() cancels the task, it already stopped the scraper
+            self._record_outcome(False)
+        except Exception as e:
+            self._record_error(e)
+        finally:
+            self._finished()
+
+
+scheduler = None
+
+
+@app.before_serving
+async def start_scheduler():
+    global scheduler
+    loop = asyncio.get_running_loop()
+
+    def create_job(url, result_order=None):
+        return AsyncProcessManager(url, ReviewManager(url=url, result_order=result_order), loop)
+
+    scheduler = JobScheduler(create_job)
+    ACTIVE_JOBS.set_function(lambda: scheduler.stats()["running"])
+    # Start browsers ahead of the first job so that it doesn't pay Chrome startup, off the event loop
+    await loop.run_in_executor(None, lambda: get_browser_pool().warm_up())
+
+
+@app.after_serving
+async def stop_jobs():
+    await asyncio.get_running_loop().run_in_executor(None, scheduler.stop_all)
+
+
+async def stream_updates(url, process_manager, last_event_id=None):
+    """Async generator of the SSE events of generate_updates in app.py."""
+    loop = asyncio.get_running_loop()
+    manager = process_manager.manager
+    updates = asyncio.Queue()
+
+    def notify():
+        loop.call_soon_threadsafe(updates.put_nowait, None)
+
+    manager.add_listener(notify)
+    scheduler.subscribe(url)
+    try:
+        events, sent = opening_events(url, process_manager, last_event_id, scheduler)
+        for event in events:
+            yield event
+
+        while True:
+            events, sent, done = update_events(process_manager, sent)
+            for event in events:
+                yield event
+            if done:
+                break
+
+            try:
+                await asyncio.wait_for(updates.get(), timeout=SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # Comments keep proxies from closing the connection and detect gone clients
+                yield ": keep-alive\n\n"
+                continue
+            # Several updates may have arrived, one pass sends all of them
+            while not updates.empty():
+                updates.get_nowait()
+    finally:
+        manager.remove_listener(notify)
+        scheduler.unsubscribe(url)
+
+
+@app.route('/api/reviews', methods=['GET'])
+async def reviews():
+    try:
+        url, result_order, priority, last_event_id, use_store = parse_review_request(request.args, request.headers)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Reviews extracted earlier are answered at once
+    events = stored_events(url, result_order, scheduler) if use_store else None
+    if events:
+        return Response("".join(events), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+    # Requests for a URL that is already queued or running share its job
+    try:
+        process_manager = scheduler.submit(url, priority=priority, refresh=not use_store, result_order=result_order)
+    except Exception as e:
+        logging.error(f"Error initializing review manager: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+    response = Response(
+        stream_updates(url, process_manager, last_event_id=last_event_id),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS
+    )
+    # Streams are open for the whole job
+    response.timeout = None
+    return response
+
+
+@app.route('/api/bulk', methods=['POST'])
+async def bulk_submit():
+    payload, status = submit_bulk(await request.get_json(silent=True))
+    return jsonify(payload), status
+
+
+@app.route('/api/bulk/<job_id>', methods=['GET'])
+async def bulk_job_status(job_id):
+    payload, status = bulk_status(job_id)
+    return jsonify(payload), status
+
+
+@app.route('/api/bulk/<job_id>/reviews', methods=['GET'])
+async def bulk_job_reviews(job_id):
+    # The reviews are read from the result store
+    payload, status = await asyncio.get_running_loop().run_in_executor(None, bulk_result, job_id)
+    return jsonify(payload), status
+
+
+@app.route('/api/stats', methods=['GET'])
+async def stats():
+    return jsonify(service_stats(scheduler))
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    body, content_type = metrics_response()
+    return Response(body, content_type=content_type)
+
+
+@app.route('/')
+async def homepage():
+    return await send_from_directory(app.static_folder, "index.html")
+
+
+if __name__ == '__main__':
+    app.run(port=5000)
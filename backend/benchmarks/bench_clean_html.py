@@ -0,0 +1,194 @@
+"""
+Benchmarks the single-pass clean_html against the original multi-traversal implementation.
+
+Usage:
+    python benchmarks/bench_clean_html.py saved_page.html [more pages or directories...] [--repeat N]
+
+Every page is cleaned with both implementations; the timings, the speedup and whether
+the outputs are identical (with the same parser backend) are reported per page.
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from html_extractor import clean_html, HTML_PARSER  # noqa: E402
+
+
+def clean_html_reference(html_content, parser='html.parser'):
+    """The original multi-traversal clean_html, kept as the benchmark baseline."""
+    soup = BeautifulSoup(html_content, parser)
+    
+    #Remove all images and related elements
+    for element in soup.find_all(["script", "footer","style", "meta", "link", "header","img", "picture", "svg", "figure", "iframe"]):
+        element.decompose()
+        
+    #Remove elements with "overlay" in class name
+    for element in soup.find_all(True):
+        if element.attrs and 'class' in element.attrs:  # Check if attrs is not None and contains 'class'
+            class_names = element.attrs['class']
+            if any("overlay" in cls.lower() for cls in class_names):
+                element.decompose()
+        
+    unnecessary_attrs = [
+        'style',
+        'onclick',
+        'onload',  # accessibility attributes if not needed  # data attributes
+        'src',     # since we removed images
+        'href',    # remove links,      # usually not needed for extraction (the comma was missing originally)
+        'alt',
+        'tabindex',
+        'target',
+        'rel',
+        'width',
+        'height',
+        'data-type'
+    ]
+    
+    for tag in soup.find_all(True):
+        for attr in list(tag.attrs):
+            if any(attr.startswith(x.replace('*', '')) for x in unnecessary_attrs):
+                del tag[attr]
+    
+    #Remove empty elements
+    for element in soup.find_all():
+        if len(element.get_text(strip=True)) == 0 and not element.find_all():
+            element.decompose()
+    
+    #Remove uneccessary classname containing the following substrings 
+    tooltip_patterns = [
+        'tooltip', 
+        'popover', 
+        'hover-content',
+        'tippy',
+        'hint',
+        'bubble',
+        'popup-text',
+        'helptext',
+        'help-text',
+        'title-tip',
+        'slider',
+        'flex',
+        'media',
+        'image',
+        'margin',
+        'dropup',
+        'dropdown',
+        'dropupdown',
+        'padding',
+        'align'
+        'inline'
+    ]
+    
+    for element in soup.find_all(True):
+        try:
+            if hasattr(element, 'attrs') and element.attrs is not None:
+                # Remove all attributes that contain 'tooltip' in their name
+                attrs_to_remove = [
+                    attr for attr in element.attrs.keys()
+                    if 'tooltip' in attr.lower()
+                ]
+                for attr in attrs_to_remove:
+                    del element[attr]
+                
+                # Handle regular tooltip attributes
+                for attr in ['data-tooltip']:
+                    if attr in element.attrs:
+                        del element[attr]
+                
+                # Handle r-tooltip and related attributes
+                r_tooltip_attrs = [
+                    attr for attr in element.attrs.keys()
+                    if attr.startswith('r-tooltip')
+                ]
+                for attr in r_tooltip_attrs:
+                    del element[attr]
+                
+                # Handle multiple class names
+                if 'class' in element.attrs and element.attrs['class']:
+                    classes = element.attrs['class']
+                    cleaned_classes = [
+                        cls for cls in classes 
+                        if not any(tip in cls.lower() for tip in tooltip_patterns)
+                    ]
+                    
+                    if cleaned_classes:
+                        element.attrs['class'] = cleaned_classes
+                    else:
+                        del element.attrs['class']
+                        
+                # Check for tooltip-related IDs
+                if 'id' in element.attrs and element.attrs['id']:
+                    id_str = element.attrs['id'].lower()
+                    if any(tip in id_str for tip in tooltip_patterns):
+                        del element.attrs['id']
+                        
+        except (AttributeError, TypeError):
+            continue
+    
+    
+    html = str(soup)
+    html = re.sub(r'\n\s*\n', '\n', html)
+    html = re.sub(r'\s+', ' ', html)
+    
+    return html.strip()
+
+
+def _best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+def _collect_pages(paths):
+    pages = []
+    for path in paths:
+        if os.path.isdir(path):
+            pages.extend(sorted(glob.glob(os.path.join(path, "**", "*.html"), recursive=True)))
+        else:
+            pages.append(path)
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="+", help="Saved HTML pages or directories containing them")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per page, the best time is reported")
+    args = parser.parse_args()
+
+    pages = _collect_pages(args.pages)
+    if not pages:
+        parser.error("No HTML pages found")
+
+    print(f"{'page':40} {'size':>10} {'reference':>11} {'single-pass':>12} {'+' + HTML_PARSER:>12} {'speedup':>8}  identical")
+    total_reference = total_new = 0.0
+    for path in pages:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            html = f.read()
+
+        reference_time, reference_output = _best_time(lambda: clean_html_reference(html), args.repeat)
+        same_parser_time, same_parser_output = _best_time(lambda: clean_html(html, parser="html.parser"), args.repeat)
+        new_time, _ = _best_time(lambda: clean_html(html), args.repeat)
+        total_reference += reference_time
+        total_new += new_time
+
+        print(
+            f"{os.path.basename(path)[:40]:40} {len(html):>10} {reference_time * 1000:>9.1f}ms "
+            f"{same_parser_time * 1000:>10.1f}ms {new_time * 1000:>10.1f}ms {reference_time / new_time:>7.2f}x  "
+            f"{reference_output == same_parser_output}"
+        )
+
+    print(f"Total: reference {total_reference:.3f}s, single-pass ({HTML_PARSER}) {total_new:.3f}s, speedup {total_reference / total_new:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Local HTTP server for the recorded review widget pages in benchmarks/fixtures.
+
+Every widget directory holds the pages page-1.html, page-2.html... linked by its
+pagination elements, so the scraper paginates through them as on the live shop.
+Widgets loading their pages over XHR request an endpoint with a page parameter,
+reviews.json?page=2 is served from reviews-2.json; pages past the last one are 404s.
+
+Usage:
+    python benchmarks/fixture_server.py [--port 8765] [--delay 0.05]
+"""
+import argparse
+import functools
+import os
+import posixpath
+import threading
+import time
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class _FixtureHandler(SimpleHTTPRequestHandler):
+    delay = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        # Simulated network latency of the shop
+        if self.delay:
+            time.sleep(self.delay)
+        super().do_GET()
+
+    def translate_path(self, path):
+        # Paginated endpoints, the page parameter selects the file
+        parts = urlsplit(path)
+        page = dict(parse_qsl(parts.query)).get("page")
+        if page and page.isdigit():
+            root, extension = posixpath.splitext(parts.path)
+            path = f"{root}-{page}{extension}"
+        return super().translate_path(path)
+
+
+class FixtureServer:
+    """Serves a fixtures directory from a daemon thread, started by start()."""
+
+    def __init__(self, directory=FIXTURES_DIR, delay=0.0, host="127.0.0.1", port=0):
+        self.directory = directory
+        self.delay = delay
+        self.host = host
+        self.port = port
+        self.server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.server.server_port}"
+
+    def url(self, widget, page=1):
+        return f"{self.base_url}/{widget}/page-{page}.html"
+
+    def endpoint_url(self, widget, page=1):
+        return f"{self.base_url}/{widget}/reviews.json?page={page}"
+
+    def start(self):
+        handler = type("Handler", (_FixtureHandler,), {"delay": self.delay})
+        self.server = ThreadingHTTPServer((self.host, self.port), functools.partial(handler, directory=self.directory))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="fixture-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--directory", default=FIXTURES_DIR)
+    args = parser.parse_args()
+
+    server = FixtureServer(args.directory, args.delay, port=args.port).start()
+    print(f"Serving {args.directory} on {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Offline end-to-end benchmark of the extraction pipeline.
+
+The recorded review widget pages in benchmarks/fixtures are served by a local HTTP
+server and the LLM is replaced by the stub server in stub_llm.py, so runs need neither
+live shops nor a model. Reported stages:
+
+    clean_html, extract_reviews_section, filter_reviews   per fixture page
+    extract_templates, extract_llm                        OutputGenerator._extract_page per review section
+    xhr_pagination                                        review endpoint discovery from a recorded performance
+                                                          log and fetching every page of the XHR widgets
+    review_scraper                                        ReviewScraper over every widget (needs Chrome)
+    add_reviews                                           ReviewManager.add_reviews over every widget (needs Chrome)
+
+The XHR widgets render their pages in the browser from a reviews.json?page=N endpoint,
+the HTML and extraction stages only use the widgets with static pages. Stages needing
+Chrome are skipped when it can't be started. Results can be saved as a
+baseline and later runs compared against it; a stage whose median latency grew by more
+than the tolerance, or a job that found fewer reviews, fails the comparison.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--repeat N] [--stages ...] [--save-baseline] [--compare]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+from fixture_server import FixtureServer, FIXTURES_DIR  # noqa: E402
+from stub_llm import StubLLM, add_arguments as add_stub_arguments  # noqa: E402
+
+STAGES = ("clean_html", "extract_reviews_section", "filter_reviews", "extract_templates", "extract_llm",
+          "xhr_pagination", "review_scraper", "add_reviews")
+BROWSER_STAGES = ("review_scraper", "add_reviews")
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, "baselines", "baseline.json")
+
+
+def _summary(latencies, items=None):
+    """Latency percentiles and throughput of the runs of a stage, items defaults to one per run."""
+    ordered = sorted(latencies)
+    total = sum(ordered)
+    return {
+        "runs": len(ordered),
+        "mean": total / len(ordered),
+        "p50": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))],
+        "throughput": (items if items is not None else len(ordered)) / total if total else None
+    }
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def _fixture_pages(widgets):
+    pages = []
+    for widget in widgets:
+        for page in range(1, widget["pages"] + 1):
+            with open(os.path.join(FIXTURES_DIR, widget["widget"], f"page-{page}.html"), "r", encoding="utf-8") as f:
+                pages.append((widget["widget"], page, f.read()))
+    return pages
+
+
+def bench_html(pages, repeat, stages):
+    """The HTML stages on every fixture page, each one fed the output of the one before."""
+    from html_extractor import clean_html, extract_reviews_section, filter_reviews
+
+    latencies = {stage: [] for stage in ("clean_html", "extract_reviews_section", "filter_reviews")}
+    source_bytes = 0
+    sections = {}
+    for widget, page, html in pages:
+        for _ in range(repeat):
+            source_bytes += len(html.encode("utf-8"))
+            elapsed, cleaned = _timed(clean_html, html)
+            latencies["clean_html"].append(elapsed)
+            elapsed, section = _timed(extract_reviews_section, cleaned)
+            latencies["extract_reviews_section"].append(elapsed)
+            elapsed, _ = _timed(filter_reviews, section, 2)
+            latencies["filter_reviews"].append(elapsed)
+        sections[(widget, page)] = section
+
+    results = {stage: _summary(values) for stage, values in latencies.items() if stage in stages}
+    if "clean_html" in results:
+        results["clean_html"]["mb_per_second"] = source_bytes / sum(latencies["clean_html"]) / 1e6
+    return results, sections
+
+
+def bench_extraction(sections, widgets, repeat, stages):
+    """OutputGenerator._extract_page on the review sections, with and without the widget templates."""
+    from llm_summarizer import OutputGenerator
+    from json_stream import parse_review_array
+
+    results = {}
+    for stage, use_templates in (("extract_templates", True), ("extract_llm", False)):
+        if stage not in stages:
+            continue
+        generator = OutputGenerator(url="benchmark", use_templates=use_templates, streaming=False)
+        latencies, reviews = [], 0
+        for (widget, page), section in sections.items():
+            for _ in range(repeat):
+                elapsed, output = _timed(generator._extract_page, page, section)
+                latencies.append(elapsed)
+            reviews += len(parse_review_array(output))
+        results[stage] = dict(_summary(latencies), reviews=reviews, expected_reviews=sum(w["reviews"] for w in widgets))
+    return results
+
+
+def _log_entry(method, params):
+    return {"level": "INFO", "message": json.dumps({"message": {"method": method, "params": params}}), "timestamp": 0}
+
+
+def performance_log(fixture_server, widget):
+    """Chrome performance log of loading the first page of an XHR widget, the review endpoint among the page's other requests."""
+    page_url = fixture_server.url(widget)
+    base_url = fixture_server.base_url
+    requests = (
+        ("Document", "GET", page_url, "text/html"),
+        ("Script", "GET", f"{base_url}/assets/theme.js", "application/javascript"),
+        ("XHR", "GET", f"{base_url}/cart.js", "application/json"),
+        # A page parameter without a review hint and a review request that is not a GET
+        ("XHR", "GET", "https://analytics.example.com/collect?v=2&p=1", "text/plain"),
+        ("Fetch", "POST", f"{base_url}/{widget}/reviews/track?page=1", "application/json"),
+        ("Fetch", "GET", fixture_server.endpoint_url(widget), "application/json"),
+    )
+    log = []
+    for request_id, (resource_type, method, url, mime_type) in enumerate(requests):
+        headers = {"Accept": "application/json", "X-Requested-With": "XMLHttpRequest", "Referer": page_url}
+        log.append(_log_entry("Network.requestWillBeSent", {
+            "requestId": str(request_id), "type": resource_type, "request": {"url": url, "method": method, "headers": headers}
+        }))
+        log.append(_log_entry("Network.responseReceived", {
+            "requestId": str(request_id), "type": resource_type, "response": {"url": url, "status": 200, "mimeType": mime_type}
+        }))
+    return log
+
+
+def bench_xhr(fixture_server, widgets, repeat):
+    """Review endpoint discovery and direct fetching of every page of the XHR widgets, seconds per widget."""
+    from html_pool import get_html_pool
+    from json_stream import parse_review_array
+    from llm_summarizer import OutputGenerator
+    from xhr_pagination import network_requests, find_review_endpoint, fetch_pages
+
+    latencies, pages, sections = [], [0] * repeat, []
+    for widget in widgets:
+        log = performance_log(fixture_server, widget["widget"])
+        for run in range(repeat):
+            start = time.perf_counter()
+            endpoint = find_review_endpoint(network_requests(log))
+            if endpoint is None or endpoint.url != fixture_server.endpoint_url(widget["widget"]):
+                print(f"Review endpoint of {widget['widget']} not found, got {endpoint}")
+                fetched = []
+            else:
+                fetched = [get_html_pool().fragment_section(content) for _, content in fetch_pages(endpoint, endpoint.page)]
+            latencies.append(time.perf_counter() - start)
+            pages[run] += len(fetched)
+        sections.extend(fetched)
+
+    # The fetched pages are extracted once, the reviews found show the endpoint pages reach the LLM intact
+    generator = OutputGenerator(url="benchmark", use_templates=False, streaming=False)
+    reviews = sum(len(parse_review_array(generator._extract_page(page, section))) for page, section in enumerate(sections, 1))
+    # Counts are those of the worst run, so that they don't depend on the number of runs
+    return dict(
+        _summary(latencies, items=sum(pages)),
+        pages=min(pages), expected_pages=sum(w["pages"] for w in widgets),
+        reviews=reviews, expected_reviews=sum(w["reviews"] for w in widgets)
+    )
+
+
+def browser_available():
+    from browser_pool import get_browser_pool
+
+    try:
+        driver = get_browser_pool().acquire(timeout=60)
+    except Exception as e:
+        print(f"Chrome is not available, skipping {', '.join(BROWSER_STAGES)}: {e}")
+        return False
+    get_browser_pool().release(driver)
+    return True
+
+
+def bench_scraper(fixture_server, widgets, repeat):
+    """ReviewScraper paginating through every widget, the XHR widgets through their endpoint, seconds per job."""
+    from page_scraper import ReviewScraper
+
+    latencies, pages = [], [0] * repeat
+    for widget in widgets:
+        for run in range(repeat):
+            scraper = ReviewScraper(url=fixture_server.url(widget["widget"]), pag_class=widget["selector"], use_xhr=widget.get("xhr", False))
+            start = time.perf_counter()
+            scraper.start_scraping()
+            while scraper.review_queue.get() is not None:
+                pages[run] += 1
+            scraper.scraper_thread.join()
+            latencies.append(time.perf_counter() - start)
+    return dict(_summary(latencies, items=sum(pages)), pages=min(pages), expected_pages=sum(w["pages"] for w in widgets))
+
+
+def bench_add_reviews(fixture_server, widgets, repeat):
+    """ReviewManager.add_reviews on every widget: seconds per job, time to the first review and reviews found."""
+    from app import ReviewManager
+    from selector_cache import get_selector_cache
+
+    latencies, first_reviews, reviews = [], [], [0] * repeat
+    for widget in widgets:
+        for run in range(repeat):
+            url = fixture_server.url(widget["widget"])
+            # All widgets are served from one host, every job looks up its selector again
+            get_selector_cache().invalidate(url)
+            manager = ReviewManager(url=url)
+            start = time.perf_counter()
+            first = []
+            manager.add_listener(lambda: first or first.append(time.perf_counter() - start))
+            manager.add_reviews()
+            latencies.append(time.perf_counter() - start)
+            first_reviews.extend(first)
+            reviews[run] += manager.result["reviews_count"]
+    result = dict(_summary(latencies, items=sum(reviews)), reviews=min(reviews), expected_reviews=sum(w["reviews"] for w in widgets))
+    result["throughput_unit"] = "reviews"
+    result["first_review"] = statistics.mean(first_reviews) if first_reviews else None
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of results against a baseline, as messages. Review and page counts are those of one run."""
+    regressions = []
+    for stage, base in baseline["stages"].items():
+        current = results["stages"].get(stage)
+        if current is None:
+            continue
+        if current["p50"] > base["p50"] * (1 + tolerance):
+            regressions.append(f"{stage}: median {current['p50'] * 1000:.1f}ms, baseline {base['p50'] * 1000:.1f}ms")
+        for count in ("reviews", "pages"):
+            if count in base and current.get(count, 0) < base[count]:
+                regressions.append(f"{stage}: {current.get(count)} {count}, baseline {base[count]}")
+    return regressions
+
+
+def print_results(results):
+    print(f"{'stage':24} {'runs':>5} {'mean':>10} {'p50':>10} {'p95':>10} {'throughput':>14}  notes")
+    for stage, result in results["stages"].items():
+        unit = result.get("throughput_unit", "pages")
+        throughput = f"{result['throughput']:.1f} {unit}/s" if result["throughput"] else "-"
+        notes = []
+        if "mb_per_second" in result:
+            notes.append(f"{result['mb_per_second']:.1f} MB/s")
+        if "reviews" in result:
+            notes.append(f"{result['reviews']}" + (f"/{result['expected_reviews']}" if "expected_reviews" in result else "") + " reviews")
+        if "expected_pages" in result:
+            notes.append(f"{result['pages']}/{result['expected_pages']} pages")
+        if result.get("first_review") is not None:
+            notes.append(f"first review after {result['first_review']:.2f}s")
+        print(
+            f"{stage:24} {result['runs']:>5} {result['mean'] * 1000:>8.1f}ms {result['p50'] * 1000:>8.1f}ms "
+            f"{result['p95'] * 1000:>8.1f}ms {throughput:>14}  {', '.join(notes)}"
+        )
+    llm = results["llm"]
+    print(f"Stub LLM: {llm['requests']} requests, {llm['prompt_tokens']} prompt and {llm['completion_tokens']} completion tokens")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, help="Runs per page or widget [3]")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--page-delay", type=float, help="Seconds added to every fixture page response [0]")
+    add_stub_arguments(parser)
+    # Settings left out are taken from the baseline with --compare
+    parser.set_defaults(latency=None, prompt_rate=None, token_rate=None)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="Store the results as the baseline")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, help="Compare the results against a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed growth of the median latency, 0.25 is 25%%")
+    args = parser.parse_args()
+    baseline = None
+    if args.compare:
+        if not os.path.exists(args.compare):
+            parser.error(f"no baseline at {args.compare}, store one with --save-baseline first")
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        # A run measured with other settings isn't comparable to the baseline
+        environment = dict(baseline["environment"], **baseline["environment"]["llm"])
+        for setting in ("repeat", "page_delay", "latency", "prompt_rate", "token_rate"):
+            value = getattr(args, setting)
+            if value is None:
+                setattr(args, setting, environment[setting])
+            elif value != environment[setting]:
+                parser.error(f"--{setting.replace('_', '-')} {value} differs from the baseline's {environment[setting]}")
+    for setting, default in (("repeat", 3), ("page_delay", 0.0), ("latency", 0.0), ("prompt_rate", 0.0), ("token_rate", 0.0)):
+        if getattr(args, setting) is None:
+            setattr(args, setting, default)
+
+    stub = StubLLM(args.responses, args.latency, args.prompt_rate, args.token_rate).start()
+    fixture_server = FixtureServer(delay=args.page_delay).start()
+    # Configure the pipeline before its modules are imported: the stub LLM and nothing cached between runs
+    os.environ["LLM_BASE_URL"] = stub.base_url
+    os.environ["LLM_CACHE_ENABLED"] = "false"
+    os.environ["RESULT_STORE_ENABLED"] = "false"
+    os.environ["REVIEW_CACHE_DIR"] = tempfile.mkdtemp(prefix="review-benchmark-")
+
+    with open(os.path.join(FIXTURES_DIR, "fixtures.json"), "r", encoding="utf-8") as f:
+        widgets = json.load(f)["widgets"]
+
+    from html_extractor import HTML_PARSER
+
+    stages = set(args.stages)
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "html_parser": HTML_PARSER,
+            "repeat": args.repeat,
+            "llm": {"latency": args.latency, "prompt_rate": args.prompt_rate, "token_rate": args.token_rate},
+            "page_delay": args.page_delay
+        },
+        "stages": {}
+    }
+    static_widgets = [widget for widget in widgets if not widget.get("xhr")]
+    html_results, sections = bench_html(_fixture_pages(static_widgets), args.repeat, stages)
+    results["stages"].update(html_results)
+    results["stages"].update(bench_extraction(sections, static_widgets, args.repeat, stages))
+    xhr_widgets = [widget for widget in widgets if widget.get("xhr")]
+    if "xhr_pagination" in stages and xhr_widgets:
+        results["stages"]["xhr_pagination"] = bench_xhr(fixture_server, xhr_widgets, args.repeat)
+    if stages & set(BROWSER_STAGES) and browser_available():
+        if "review_scraper" in stages:
+            results["stages"]["review_scraper"] = bench_scraper(fixture_server, widgets, args.repeat)
+        if "add_reviews" in stages:
+            results["stages"]["add_reviews"] = bench_add_reviews(fixture_server, widgets, args.repeat)
+    results["llm"] = stub.stats()
+
+    print_results(results)
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {path}")
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+    # Browsers of the pool would keep the process alive
+    from browser_pool import get_browser_pool
+    get_browser_pool().close()
+
+
+if __name__ == "__main__":
+    main()
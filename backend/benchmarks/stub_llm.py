@@ -0,0 +1,189 @@
+"""
+OpenAI compatible stub of the LLM server for offline benchmarks.
+
+Answers /v1/chat/completions, streamed or not, with canned outputs: the first entry of
+the responses file whose "match" substrings all appear in the prompt is returned (a
+list or object output is returned as JSON), otherwise the default. Latency is modelled
+as a fixed delay plus prompt processing and generation at the given tokens per second,
+with tokens estimated at four characters.
+
+Usage:
+    python benchmarks/stub_llm.py [--port 1235] [--latency 0.2] [--prompt-rate 2000] [--token-rate 50]
+"""
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_RESPONSES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "llm_responses.json")
+CHARS_PER_TOKEN = 4
+
+
+def _tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class StubLLM:
+    """The stub server, started in a daemon thread by start()."""
+
+    def __init__(self, responses_path=DEFAULT_RESPONSES, latency=0.0, prompt_rate=0.0, token_rate=0.0,
+                 host="127.0.0.1", port=0):
+        with open(responses_path, "r", encoding="utf-8") as f:
+            responses = json.load(f)
+        self.responses = responses["responses"]
+        self.default = responses.get("default", "")
+        self.latency = latency
+        self.prompt_rate = prompt_rate
+        self.token_rate = token_rate
+        self.host = host
+        self.port = port
+        self.server = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.server.server_port}/v1"
+
+    def output(self, prompt):
+        for response in self.responses:
+            match = response["match"]
+            if all(text in prompt for text in ([match] if isinstance(match, str) else match)):
+                output = response["output"]
+                return output if isinstance(output, str) else json.dumps(output)
+        return self.default
+
+    def _record(self, prompt_tokens, completion_tokens):
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens
+            }
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, data, status=200):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send_json({"object": "list", "data": [{"id": "stub", "object": "model"}]})
+                else:
+                    self._send_json({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json({"error": "not found"}, status=404)
+                    return
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                prompt = "".join(message.get("content") or "" for message in request.get("messages", []))
+                output = stub.output(prompt)
+                max_tokens = request.get("max_tokens")
+                finish_reason = "stop"
+                if max_tokens and len(output) > max_tokens * CHARS_PER_TOKEN:
+                    # Outputs are cut off at the token limit like on a real server
+                    output = output[:max_tokens * CHARS_PER_TOKEN]
+                    finish_reason = "length"
+                usage = {
+                    "prompt_tokens": _tokens(prompt),
+                    "completion_tokens": _tokens(output),
+                    "total_tokens": _tokens(prompt) + _tokens(output)
+                }
+                stub._record(usage["prompt_tokens"], usage["completion_tokens"])
+
+                delay = stub.latency
+                if stub.prompt_rate:
+                    delay += usage["prompt_tokens"] / stub.prompt_rate
+                time.sleep(delay)
+                token_delay = 1 / stub.token_rate if stub.token_rate else 0
+
+                if not request.get("stream"):
+                    time.sleep(usage["completion_tokens"] * token_delay)
+                    self._send_json({
+                        "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": "stub",
+                        "choices": [{"index": 0, "finish_reason": finish_reason, "message": {"role": "assistant", "content": output}}],
+                        "usage": usage
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": "stub"}
+                for start in range(0, len(output), CHARS_PER_TOKEN):
+                    time.sleep(token_delay)
+                    delta = dict(chunk, choices=[{"index": 0, "delta": {"content": output[start:start + CHARS_PER_TOKEN]}, "finish_reason": None}])
+                    self._send_chunk(f"data: {json.dumps(delta)}\n\n".encode())
+                last = dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": finish_reason}])
+                self._send_chunk(f"data: {json.dumps(last)}\n\n".encode())
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    self._send_chunk(f"data: {json.dumps(dict(chunk, choices=[], usage=usage))}\n\n".encode())
+                self._send_chunk(b"data: [DONE]\n\n")
+                self._send_chunk(b"")
+
+        return Handler
+
+    def start(self):
+        self.server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="stub-llm", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def add_arguments(parser):
+    parser.add_argument("--responses", default=DEFAULT_RESPONSES, help="Canned outputs of the stub LLM")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the stub LLM processes a prompt")
+    parser.add_argument("--prompt-rate", type=float, default=0.0, help="Prompt tokens per second of the stub LLM, 0 is instant")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="Completion tokens per second of the stub LLM, 0 is instant")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=1235)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    stub = StubLLM(args.responses, args.latency, args.prompt_rate, args.token_rate, port=args.port).start()
+    print(f"Stub LLM listening on {stub.base_url}, set LLM_BASE_URL to use it")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from xhr_pagination import XHR_PAGINATION
+from metrics import LIVE_BROWSERS
+
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", 4))  # Hard limit on live Chrome processes
+BROWSER_POOL_WARM = int(os.environ.get("BROWSER_POOL_WARM", 1))  # Idle instances kept ready
+BROWSER_MAX_USES = int(os.environ.get("BROWSER_MAX_USES", 20))  # Checkouts before an instance is recycled
+BROWSER_CHECKOUT_TIMEOUT = float(os.environ.get("BROWSER_CHECKOUT_TIMEOUT", 600))
+
+
+def create_driver():
+    """Start a new headless Chrome instance."""
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    if XHR_PAGINATION:
+        # Network requests are read from the performance log to find review endpoints
+        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    return webdriver.Chrome(options=chrome_options)
+
+
+class _PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.created = time.time()
+
+
+class BrowserPool:
+    """
+    Bounded pool of headless Chrome WebDrivers.
+
+    Jobs check a driver out for their duration and return it afterwards. Returned
+    drivers have their cookies and storage cleared, drivers failing a health check
+    are replaced and every driver is recycled after max_uses checkouts. At most
+    max_size Chrome processes are alive at any time, further checkouts wait.
+    """
+
+    def __init__(self, max_size=BROWSER_POOL_SIZE, warm=BROWSER_POOL_WARM, max_uses=BROWSER_MAX_USES, factory=create_driver):
+        self.max_size = max(1, max_size)
+        self.warm = min(warm, self.max_size)
+        self.max_uses = max_uses
+        self.factory = factory
+        self._available = threading.Condition()
+        self._idle = []
+        self._in_use = {}
+        self._live = 0  # Idle, checked out and starting drivers
+        self._closed = False
+        self.created = 0
+        self.recycled = 0
+        self.failed_health_checks = 0
+
+    def _start_driver(self):
+        """Create a driver for a slot that was already reserved in self._live."""
+        try:
+            entry = _PooledDriver(self.factory())
+        except Exception:
+            with self._available:
+                self._live -= 1
+                self._available.notify()
+            raise
+        with self._available:
+            self.created += 1
+        return entry
+
+    def warm_up(self, blocking=False):
+        """Start drivers until `warm` idle instances are available."""
+        def fill():
+            while True:
+                with self._available:
+                    if self._closed or len(self._idle) >= self.warm or self._live >= self.max_size:
+                        return
+                    self._live += 1
+                try:
+                    entry = self._start_driver()
+                except Exception as e:
+                    logging.error(f"Could not start a warm browser: {e}")
+                    return
+                with self._available:
+                    self._idle.append(entry)
+                    self._available.notify()
+
+        if blocking:
+            fill()
+        else:
+            threading.Thread(target=fill, daemon=True).start()
+
+    def _is_healthy(self, driver):
+        try:
+            return driver.execute_script("return 1;") == 1 and bool(driver.window_handles)
+        except Exception:
+            return False
+
+    def _visited_origins(self, driver):
+        """Origins of the frames and resources of the current page, third-party widgets included."""
+        try:
+            nodes = [driver.execute_cdp_cmd("Page.getResourceTree", {})["frameTree"]]
+        except Exception:
+            return set()
+        origins = set()
+        while nodes:
+            node = nodes.pop()
+            frame = node.get("frame", {})
+            urls = [frame.get("url")] + [resource.get("url") for resource in node.get("resources", [])]
+            for url in urls:
+                parts = urlsplit(url or "")
+                if parts.scheme in ("http", "https") and parts.netloc:
+                    origins.add(f"{parts.scheme}://{parts.netloc}")
+            nodes.extend(node.get("childFrames", []))
+        return origins
+
+    def _reset(self, driver):
+        """Clear the state a job left behind so the next job starts from a clean browser."""
+        # Storage of every origin the page used: local and session storage, IndexedDB, cache storage,
+        # service workers and cookies
+        for origin in self._visited_origins(driver):
+            try:
+                driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+            except Exception as e:
+                logging.warning(f"Could not clear the storage of {origin}: {e}")
+        driver.delete_all_cookies()
+        for command in ("Network.clearBrowserCookies", "Network.clearBrowserCache"):
+            try:
+                driver.execute_cdp_cmd(command, {})
+            except Exception:
+                pass
+        driver.get("about:blank")
+
+    def _discard(self, entry):
+        try:
+            entry.driver.quit()
+        except Exception as e:
+            logging.warning(f"Error quitting browser: {e}")
+        with self._available:
+            self._live -= 1
+            self._available.notify()
+
+    def acquire(self, timeout=BROWSER_CHECKOUT_TIMEOUT):
+        """Check a driver out of the pool, waiting up to `timeout` seconds for a free slot."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            entry = None
+            with self._available:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Browser pool is closed")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._live < self.max_size:
+                        self._live += 1
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"No browser available within {timeout} seconds")
+                    self._available.wait(remaining)
+
+            if entry is None:
+                entry = self._start_driver()
+            elif not self._is_healthy(entry.driver):
+                logging.warning("Discarding unhealthy browser")
+                self.failed_health_checks += 1
+                self._discard(entry)
+                continue
+
+            entry.uses += 1
+            with self._available:
+                self._in_use[id(entry.driver)] = entry
+            return entry.driver
+
+    def release(self, driver, discard=False):
+        """Return a driver to the pool, recycling it if it is worn out or broken."""
+        with self._available:
+            entry = self._in_use.pop(id(driver), None)
+        if entry is None:
+            return
+
+        if not discard and not self._closed and entry.uses < self.max_uses:
+            try:
+                self._reset(driver)
+            except Exception as e:
+                logging.warning(f"Error resetting browser, recycling it: {e}")
+                discard = True
+        else:
+            discard = True
+
+        if discard:
+            self.recycled += 1
+            self._discard(entry)
+            self.warm_up()
+        else:
+            with self._available:
+                self._idle.append(entry)
+                self._available.notify()
+
+    @contextmanager
+    def checkout(self, timeout=BROWSER_CHECKOUT_TIMEOUT):
+        """Context manager checking a driver out for the duration of the block."""
+        driver = self.acquire(timeout=timeout)
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def close(self):
+        """Quit all idle drivers, checked out drivers are quit when they are released."""
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._available.notify_all()
+        for entry in idle:
+            self._discard(entry)
+
+    def stats(self):
+        with self._available:
+            return {
+                "live": self._live,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "max_size": self.max_size,
+                "created": self.created,
+                "recycled": self.recycled,
+                "failed_health_checks": self.failed_health_checks
+            }
+
+
+_browser_pool = None
+_browser_pool_lock = threading.Lock()
+LIVE_BROWSERS.set_function(lambda: _browser_pool.stats()["live"] if _browser_pool else 0)
+
+
+def get_browser_pool():
+    """Return the process wide browser pool."""
+    global _browser_pool
+    with _browser_pool_lock:
+        if _browser_pool is None:
+            _browser_pool = BrowserPool()
+        return _browser_pool
@@ -0,0 +1,252 @@
+"""
+Bulk review extraction for whole catalogs.
+
+Every URL becomes a job that runs in a pool of worker processes, each with its own
+browser pool and extraction pipeline. Jobs are handed to the pool only when their
+domain is below its concurrency limit: the first job of a domain runs alone so that
+the pagination selector and the LLM responses it caches are on disk before the other
+URLs of the shop start.
+
+The reviews of a job are written to the result store by the worker, only the id of the
+run and its counters come back to this process. Finished jobs are forgotten after
+BULK_JOB_TTL seconds, or earlier once more than BULK_MAX_FINISHED_JOBS finished.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from job_scheduler import QUEUED, RUNNING, COMPLETE, ERROR
+from selector_cache import domain_of
+
+BULK_WORKER_PROCESSES = int(os.environ.get("BULK_WORKER_PROCESSES", 0)) or min(4, os.cpu_count() or 1)
+BULK_DOMAIN_CONCURRENCY = int(os.environ.get("BULK_DOMAIN_CONCURRENCY", 2))  # Jobs of one shop at the same time
+BULK_MAX_URLS = int(os.environ.get("BULK_MAX_URLS", 1000))  # URLs per request
+BULK_JOB_TTL = float(os.environ.get("BULK_JOB_TTL", 24 * 60 * 60))  # Seconds a finished job is kept
+BULK_MAX_FINISHED_JOBS = int(os.environ.get("BULK_MAX_FINISHED_JOBS", 10000))
+
+
+def run_bulk_job(url, result_order=None):
+    """Extract the reviews of one URL, runs in a worker process."""
+    # Imported here so that worker processes load the pipeline and app.py can import this module
+    from app import ReviewManager
+    from result_store import get_result_store
+
+    manager = ReviewManager(url=url, result_order=result_order)
+    success = manager.add_reviews()
+    manager.finish_run(COMPLETE if success else ERROR)
+    store = get_result_store()
+    if store:
+        # The writer thread dies with the worker, don't lose the last batch
+        store.flush()
+    if not success:
+        raise RuntimeError("Failed to process reviews")
+    result = {
+        "run_id": manager.run_id,
+        "reviews_count": manager.result["reviews_count"],
+        "stats": manager.job_stats()
+    }
+    if not store:
+        # Without a result store the reviews have to come back with the result
+        result["reviews"] = manager.result["reviews"]
+    return result
+
+
+def _init_worker():
+    import html_pool
+
+    logging.basicConfig(level=logging.INFO)
+    # The bulk workers already use the cores, each parses its pages itself
+    html_pool.HTML_PARSE_WORKERS = 0
+
+
+class BulkJob:
+    def __init__(self, url):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.domain = domain_of(url)
+        self.status = QUEUED
+        self.error = None
+        self.result = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "url": self.url,
+            "status": self.status,
+            "error": self.error,
+            "reviews_count": self.result["reviews_count"] if self.result else None,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "status_url": f"/api/bulk/{self.id}",
+            "result_url": f"/api/bulk/{self.id}/reviews"
+        }
+
+
+class BulkJobManager:
+    """
+    Runs bulk jobs in a process pool with a per-domain concurrency limit.
+
+    At most `processes` jobs are handed to the pool at a time, the others wait here, so a
+    large catalog of one shop doesn't hold up the URLs of other shops.
+    """
+
+    def __init__(self, processes=BULK_WORKER_PROCESSES, domain_concurrency=BULK_DOMAIN_CONCURRENCY, job_function=run_bulk_job,
+                 job_ttl=BULK_JOB_TTL, max_finished=BULK_MAX_FINISHED_JOBS):
+        self.processes = max(1, processes)
+        self.domain_concurrency = max(1, domain_concurrency)
+        self.job_function = job_function
+        self.job_ttl = job_ttl
+        self.max_finished = max_finished
+        self._lock = threading.Lock()
+        self._executor = None
+        self._jobs = {}
+        self._waiting = defaultdict(deque)  # domain -> queued jobs
+        self._domains = deque()  # domains with queued jobs, served round robin
+        self._running = defaultdict(int)  # domain -> running jobs
+        self._primed = set()  # domains with a finished job
+        self._in_flight = 0
+        self._finished = deque()  # ids of the finished jobs, oldest first
+        self.evicted = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Fresh interpreters instead of forks of a process running server and browser threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker
+                )
+            return self._executor
+
+    def submit(self, urls, result_order=None):
+        """Queue a job for every URL, returns the jobs."""
+        jobs = [BulkJob(url) for url in urls]
+        with self._lock:
+            for job in jobs:
+                job.result_order = result_order
+                self._jobs[job.id] = job
+                if not self._waiting[job.domain]:
+                    self._domains.append(job.domain)
+                self._waiting[job.domain].append(job)
+            to_start = self._next_jobs()
+        self._start(to_start)
+        return jobs
+
+    def _domain_limit(self, domain):
+        # Until one job of the shop finished its selector and widget are not cached yet
+        return self.domain_concurrency if domain in self._primed else 1
+
+    def _next_jobs(self):
+        """Pop the jobs that can start now, called with the lock held."""
+        to_start = []
+        for _ in range(len(self._domains)):
+            if self._in_flight >= self.processes:
+                break
+            domain = self._domains.popleft()
+            waiting = self._waiting[domain]
+            while waiting and self._in_flight < self.processes and self._running[domain] < self._domain_limit(domain):
+                job = waiting.popleft()
+                job.status = RUNNING
+                job.started = time.time()
+                self._running[domain] += 1
+                self._in_flight += 1
+                to_start.append(job)
+            if waiting:
+                self._domains.append(domain)
+            else:
+                del self._waiting[domain]
+        return to_start
+
+    def _start(self, jobs):
+        for job in jobs:
+            try:
+                executor = self._get_executor()
+                future = executor.submit(self.job_function, job.url, job.result_order)
+            except Exception as e:
+                self._finish(job, error=e)
+                continue
+            future.add_done_callback(lambda future, job=job, executor=executor: self._on_done(job, executor, future))
+
+    def _on_done(self, job, executor, future):
+        try:
+            self._finish(job, result=future.result())
+        except BrokenProcessPool as e:
+            # A worker died (e.g. Chrome exhausted its memory), later jobs get a new pool
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            self._finish(job, error=e)
+        except Exception as e:
+            self._finish(job, error=e)
+
+    def _finish(self, job, result=None, error=None):
+        with self._lock:
+            job.finished = time.time()
+            if error is None:
+                job.status = COMPLETE
+                job.result = result
+            else:
+                logging.error(f"Bulk job for {job.url} failed: {error}")
+                job.status = ERROR
+                job.error = str(error)
+            self._running[job.domain] -= 1
+            self._in_flight -= 1
+            self._primed.add(job.domain)
+            self._finished.append(job.id)
+            self._evict_finished()
+            to_start = self._next_jobs()
+        self._start(to_start)
+
+    def _evict_finished(self):
+        """Forget finished jobs past their TTL or beyond the limit, called with the lock held."""
+        expired = time.time() - self.job_ttl
+        while self._finished and (
+            len(self._finished) > self.max_finished or self._jobs[self._finished[0]].finished < expired
+        ):
+            del self._jobs[self._finished.popleft()]
+            self.evicted += 1
+
+    def get(self, job_id):
+        with self._lock:
+            self._evict_finished()
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            states = defaultdict(int)
+            for job in self._jobs.values():
+                states[job.status] += 1
+            return {
+                "processes": self.processes,
+                "domain_concurrency": self.domain_concurrency,
+                "in_flight": self._in_flight,
+                "jobs": len(self._jobs),
+                "evicted": self.evicted,
+                "states": dict(states),
+                "domains_waiting": len(self._waiting)
+            }
+
+
+_bulk_manager = None
+_bulk_manager_lock = threading.Lock()
+
+
+def get_bulk_manager():
+    """Return the process wide bulk job manager."""
+    global _bulk_manager
+    with _bulk_manager_lock:
+        if _bulk_manager is None:
+            _bulk_manager = BulkJobManager()
+        return _bulk_manager
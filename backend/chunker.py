@@ -0,0 +1,88 @@
+import math
+import os
+
+from bs4 import BeautifulSoup, NavigableString, Tag
+from html_extractor import HTML_PARSER, subtree_sizes
+
+LLM_CONTEXT_TOKENS = int(os.environ.get("LLM_CONTEXT_TOKENS", 9000))  # Context length the model is loaded with
+CHARS_PER_TOKEN = float(os.environ.get("CHARS_PER_TOKEN", 3.5))  # Markup tokenizes denser than prose
+
+
+def estimate_tokens(text):
+    """Rough token count of a text, used to keep prompts inside the context window."""
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def _split_text(text, max_chars):
+    """Split a text that is too large on its own at whitespace."""
+    pieces = []
+    while len(text) > max_chars:
+        cut = text.rfind(" ", 0, max_chars)
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(text[:cut])
+        text = text[cut:]
+    if text.strip():
+        pieces.append(text)
+    return pieces
+
+
+def _units(nodes, max_chars, markup_sizes, units):
+    """
+    Collect the largest subtrees that fit into max_chars, in document order.
+
+    A node that is too large is replaced by its children, so a review list is split
+    into its items and an item is only split further if it is too large by itself.
+    """
+    for node in nodes:
+        if isinstance(node, Tag):
+            # Sizes are estimates, only serialize nodes that are expected to fit
+            if markup_sizes.get(id(node), 0) <= max_chars:
+                markup = str(node)
+                if len(markup) <= max_chars:
+                    units.append(markup)
+                    continue
+            _units(node.contents, max_chars, markup_sizes, units)
+        elif isinstance(node, NavigableString):
+            text = str(node)
+            if len(text) <= max_chars:
+                if text.strip():
+                    units.append(text)
+            else:
+                units.extend(_split_text(text, max_chars))
+
+
+def chunk_review_html(html, token_budget):
+    """
+    Splits review HTML at review item boundaries into chunks of at most token_budget tokens.
+
+    Args:
+        html (str): Review section HTML
+        token_budget (int): Maximum estimated tokens per chunk
+
+    Returns:
+        list: HTML chunks in document order, the HTML itself if it fits
+    """
+    if not html or estimate_tokens(html) <= token_budget:
+        return [html]
+
+    max_chars = int(token_budget * CHARS_PER_TOKEN)
+    soup = BeautifulSoup(html, HTML_PARSER)
+    markup_sizes, _ = subtree_sizes(soup)
+    root = soup.body or soup
+    units = []
+    _units(root.contents, max_chars, markup_sizes, units)
+
+    # Pack consecutive units into as few chunks as possible
+    chunks = []
+    current = []
+    current_size = 0
+    for unit in units:
+        if current and current_size + len(unit) > max_chars:
+            chunks.append("".join(current))
+            current, current_size = [], 0
+        current.append(unit)
+        current_size += len(unit)
+    if current:
+        chunks.append("".join(current))
+    return chunks
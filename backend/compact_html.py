@@ -0,0 +1,220 @@
+"""
+Compact serialization of review sections for the LLM.
+
+Even after clean_html a review section is mostly markup: long class lists, ARIA and
+data attributes and wrapper elements. The serializer keeps the elements holding text,
+one shortened class name as a hint of what an element holds, and the rating signals
+(star icons, star characters, ARIA labels and rating attributes) as text, so a page is
+extracted from a fraction of the prompt tokens.
+"""
+import html
+import logging
+import os
+import re
+import threading
+
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import PreformattedString
+
+from chunker import estimate_tokens
+from html_extractor import HTML_PARSER
+from metrics import LLM_INPUT_TOKENS
+from widget_extractors import parse_rating
+
+LLM_INPUT_FORMAT = os.environ.get("LLM_INPUT_FORMAT", "compact")  # "compact" or "html"
+
+# Class names worth keeping as a hint, layout and state classes are dropped
+_semantic_class = re.compile(
+    r'review|rev\b|author|reviewer|name|user|customer|title|head|body|text|content|comment|rating|stars?\b|score|date|verified',
+    re.IGNORECASE
+)
+_rating_hint = re.compile(r'rating|stars?\b|score', re.IGNORECASE)
+_rating_label = re.compile(r'\d.*(star|out of|/\s*5)|(star|rated|rating).*\d', re.IGNORECASE)
+_rating_attrs = ("data-score", "data-rating", "data-rating-value", "data-value", "content")
+_label_attrs = ("aria-label", "title")
+_class_words = re.compile(r'[-_\s]+')
+_star_chars = re.compile(r'^[\s★☆✩✪⭐]+$')
+_whitespace = re.compile(r'\s+')
+_max_hint_length = 24
+
+
+def _hint(element):
+    """Shortened first semantic class name of an element, e.g. "author" for "jdgm-rev__author"."""
+    for name in element.attrs.get("class") or ():
+        if not _semantic_class.search(name):
+            continue
+        if "__" in name:
+            name = name.rsplit("__", 1)[1]
+        words = [word for word in _class_words.split(name) if word]
+        if len(words) > 2:
+            name = "-".join(words[-2:])
+        return name[:_max_hint_length]
+    return None
+
+
+def _star_count(element):
+    """Filled star icons of a rating element, None if it has none."""
+    stars = filled = 0
+    for icon in element.find_all(True):
+        words = _class_words.split(" ".join(icon.attrs.get("class") or ()).lower())
+        if not any(word.startswith("star") for word in words):
+            continue
+        stars += 1
+        if "half" in words:
+            filled += 0.5
+        elif not {"off", "empty", "0"} & set(words) and {"on", "full", "filled", "active", "selected", "checked"} & set(words):
+            filled += 1
+    if not stars:
+        return None
+    return int(filled) if float(filled).is_integer() else filled
+
+
+def _rating_text(element):
+    """The rating an element carries in its attributes or icons, as text, None if it carries none."""
+    for attr in _label_attrs:
+        label = element.attrs.get(attr)
+        if isinstance(label, str) and _rating_label.search(label):
+            return label.strip()
+    hint = " ".join(element.attrs.get("class") or ())
+    for attr in _rating_attrs:
+        rating = parse_rating(element.attrs.get(attr))
+        if rating is not None and (attr != "content" or _rating_hint.search(hint)):
+            return f"{rating} stars"
+    if _rating_hint.search(hint):
+        rating = _star_count(element)
+        if rating is not None:
+            return f"{rating} stars"
+    return None
+
+
+def _text(string):
+    text = _whitespace.sub(" ", string)
+    if _star_chars.match(text):
+        # "★★★★☆" reads as 4 stars
+        return f"{text.count('★') + text.count('⭐')} stars "
+    return html.escape(text, quote=False)
+
+
+class _Node:
+    __slots__ = ("name", "hint", "parts", "rated")
+
+    def __init__(self, name, hint, parts, rated=False):
+        self.name = name
+        self.hint = hint
+        self.parts = parts
+        self.rated = rated  # Whether the rating of the element's attributes or icons was added
+
+    def render(self):
+        inner = "".join(part if isinstance(part, str) else part.render() for part in self.parts)
+        attrs = f' class="{self.hint}"' if self.hint else ""
+        return f"<{self.name}{attrs}>{inner.strip()}</{self.name}>"
+
+
+def _has_digits(parts):
+    return any(
+        any(char.isdigit() for char in part) if isinstance(part, str) else _has_digits(part.parts)
+        for part in parts
+    )
+
+
+def _carries_rating(parts):
+    """Whether the direct text of an element, or a rating element inside it, already holds the rating."""
+    for part in parts:
+        if isinstance(part, str):
+            if any(char.isdigit() for char in part):
+                return True
+        elif part.rated or (part.hint and _rating_hint.search(part.hint) and _has_digits(part.parts)):
+            return True
+        elif _carries_rating(child for child in part.parts if not isinstance(child, str)):
+            return True
+    return False
+
+
+def _compact(element):
+    """Compact node of an element, None if it holds neither text nor a rating."""
+    parts = []
+    for child in element.children:
+        if isinstance(child, Tag):
+            node = _compact(child)
+            if node is not None:
+                parts.append(node)
+        elif isinstance(child, NavigableString) and not isinstance(child, PreformattedString):
+            if child.strip():
+                parts.append(_text(child))
+
+    # Numbers in the review text (e.g. "used 2 bottles") don't replace the rating of a review card
+    rating = None if _carries_rating(parts) else _rating_text(element)
+    if rating:
+        parts.insert(0, rating)
+    if not parts:
+        return None
+    has_text = any(isinstance(part, str) for part in parts)
+
+    hint = _hint(element)
+    if len(parts) == 1 and not has_text:
+        # A wrapper of a single element is replaced by the element, keeping the more telling hint
+        child = parts[0]
+        child.hint = child.hint or hint
+        return child
+    return _Node(element.name, hint, parts, rated=bool(rating))
+
+
+def compact_review_html(review_html):
+    """Compact serialization of a review section, the section itself if nothing of it is kept."""
+    soup = BeautifulSoup(review_html, HTML_PARSER)
+    root = soup.body or soup
+    parts = []
+    for child in root.children:
+        if isinstance(child, Tag):
+            node = _compact(child)
+            if node is not None:
+                parts.append(node.render())
+        elif isinstance(child, NavigableString) and not isinstance(child, PreformattedString) and child.strip():
+            parts.append(_text(child))
+    return "".join(parts) or review_html
+
+
+class CompactionStats:
+    """Estimated tokens of the review sections before and after compaction."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pages = 0
+        self.html_tokens = 0
+        self.compact_tokens = 0
+
+    def record(self, html_tokens, compact_tokens):
+        LLM_INPUT_TOKENS.labels("html").inc(html_tokens)
+        LLM_INPUT_TOKENS.labels("compact").inc(compact_tokens)
+        with self._lock:
+            self.pages += 1
+            self.html_tokens += html_tokens
+            self.compact_tokens += compact_tokens
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "format": LLM_INPUT_FORMAT,
+                "pages": self.pages,
+                "html_tokens": self.html_tokens,
+                "compact_tokens": self.compact_tokens,
+                "reduction": 1 - self.compact_tokens / self.html_tokens if self.html_tokens else None
+            }
+
+
+compaction_stats = CompactionStats()
+
+
+def llm_input(page_num, review_html, input_format=None):
+    """The review section of a page as sent to the LLM, the token reduction is logged and counted."""
+    if (input_format or LLM_INPUT_FORMAT) != "compact":
+        return review_html
+    compact = compact_review_html(review_html)
+    html_tokens, compact_tokens = estimate_tokens(review_html), estimate_tokens(compact)
+    compaction_stats.record(html_tokens, compact_tokens)
+    if html_tokens:
+        logging.info(
+            f"Page {page_num} compacted from {html_tokens} to {compact_tokens} tokens "
+            f"(-{100 * (1 - compact_tokens / html_tokens):.0f}%)"
+        )
+    return compact
@@ -1,28 +1,146 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import PreformattedString
 import time
 import re
+import os
+import hashlib
+from browser_pool import get_browser_pool
+from metrics import stage_timer
 
-def scroll_and_scrape(url, driver=None,scroll_pause_time=4):
+# "adaptive" ends each wait as soon as the page is quiet, "fixed" always sleeps the full pause
+SCROLL_WAIT_MODE = os.environ.get("SCROLL_WAIT_MODE", "adaptive")
+SCROLL_QUIET_TIME = float(os.environ.get("SCROLL_QUIET_TIME", 0.25))  # Seconds without DOM changes or requests
+MAX_SCROLL_PASSES = int(os.environ.get("MAX_SCROLL_PASSES", 30))
+
+# Installs an in-page monitor recording the time of the last DOM change and the number of in-flight requests
+_activity_monitor_js = """
+if (!window.__reviewActivityMonitor) {
+    const monitor = {lastChange: performance.now(), pending: 0};
+    const touch = () => { monitor.lastChange = performance.now(); };
+    const done = () => { monitor.pending = Math.max(0, monitor.pending - 1); touch(); };
+    new MutationObserver(touch).observe(document, {childList: true, subtree: true, characterData: true});
+    if (window.fetch) {
+        const originalFetch = window.fetch;
+        window.fetch = function() {
+            monitor.pending++;
+            touch();
+            return originalFetch.apply(this, arguments).finally(done);
+        };
+    }
+    const originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function() {
+        monitor.pending++;
+        touch();
+        this.addEventListener('loadend', done);
+        return originalSend.apply(this, arguments);
+    };
+    window.__reviewActivityMonitor = monitor;
+}
+const monitor = window.__reviewActivityMonitor;
+return {idle: performance.now() - monitor.lastChange, pending: monitor.pending};
+"""
+
+def wait_for_page_quiet(driver, max_wait, quiet_time=SCROLL_QUIET_TIME, poll_interval=0.05):
+    """
+    Waits until the DOM has not changed and no fetch/XHR request has been in flight
+    for `quiet_time` seconds, or until `max_wait` seconds have passed.
+
+    Returns:
+        bool: True if the page became quiet before the deadline
+    """
+    start = time.monotonic()
+    deadline = start + max_wait
+    while True:
+        try:
+            state = driver.execute_script(_activity_monitor_js)
+            # Quiet time is counted from the start of the wait too, so that requests
+            # triggered by the preceding scroll have a chance to begin
+            idle = min(state["idle"] / 1000, time.monotonic() - start)
+            if idle >= quiet_time and state["pending"] == 0:
+                return True
+        except Exception as e:
+            print(f"Activity monitor unavailable, waiting the full pause: {e}")
+            time.sleep(max(0, deadline - time.monotonic()))
+            return False
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(poll_interval)
+
+def _wait(driver, seconds, wait_mode, quiet_time=SCROLL_QUIET_TIME):
+    if wait_mode == "adaptive":
+        wait_for_page_quiet(driver, seconds, quiet_time=quiet_time)
+    else:
+        time.sleep(seconds)
+
+def _scroll_to_bottom(driver, scroll_pause_time, wait_mode, close_popups=False):
+    """
+    Scrolls down in small increments until the footer is reached or the page stops growing.
+    In adaptive mode scroll_pause_time is only the upper bound of every wait.
+    """
+    # Get initial scroll height
+    last_height = driver.execute_script("return document.body.scrollHeight")
+
+    for _ in range(MAX_SCROLL_PASSES):
+        # Scroll down smoothly in smaller increments
+        for i in range(10):
+            current_scroll = last_height * (i + 1) / 10
+            driver.execute_script(f"window.scrollTo(0, {current_scroll});")
+            _wait(driver, scroll_pause_time / 10, wait_mode, quiet_time=SCROLL_QUIET_TIME / 5)
+
+        # Wait for new content to load
+        _wait(driver, scroll_pause_time, wait_mode)
+
+        if close_popups:
+            try:
+                popup = driver.find_element(By.XPATH, "//div[@role='dialog'][contains(@aria-label, 'POPUP Form')]")
+                close_button = popup.find_element(By.XPATH, ".//button[@aria-label='Close dialog']")  # Assuming the button has aria-label 'Close'
+                close_button.click()
+                _wait(driver, 1, wait_mode)  # Wait for the popup to close
+            except Exception as e:
+                print(f"No popup found or error while closing: {e}")
+
+        # Calculate new scroll height
+        new_height = driver.execute_script("return document.body.scrollHeight")
+
+        # Check if the footer is rendered by looking for the footer's presence in the DOM
+        try:
+            footer = driver.find_element(By.TAG_NAME, "footer")
+            footer_position = footer.location['y']
+            current_position = driver.execute_script("return window.pageYOffset + window.innerHeight")
+
+            # Stop scrolling when we are just before the footer
+            if current_position + 100 >= footer_position:  # Adjust the '100' as needed
+                break
+        except:
+            # If footer not found, continue scrolling
+            pass
+
+        # Nothing was loaded by the last pass, so the bottom of the page has been reached
+        if new_height == last_height:
+            break
+
+        # Continue scrolling until we are near the footer
+        last_height = new_height
+
+@stage_timer("scroll")
+def scroll_and_scrape(url, driver=None,scroll_pause_time=4, wait_mode=None):
     """
-    Opens a URL, smoothly scrolls to the bottom, and saves the page source to a file.
+    Opens a URL, smoothly scrolls to the bottom, and returns the page source.
     
     Args:
         url (str): The URL to scrape
-        output_file (str): Path to save the HTML content
-        scroll_pause_time (float): Time to pause between scrolls in seconds
+        driver (WebDriver): Driver already showing the page, a pooled driver is used if not given
+        scroll_pause_time (float): Time to pause between scrolls in seconds (the upper bound in adaptive mode)
+        wait_mode (str): "adaptive" or "fixed" (default: SCROLL_WAIT_MODE)
     """
+    wait_mode = wait_mode or SCROLL_WAIT_MODE
     if not driver:
-        # Set up Chrome options
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")  # Run in headless mode (optional)
-        
-        # Initialize the driver
-        driver = webdriver.Chrome(options=chrome_options)
+        # Check a warm driver out of the shared pool instead of starting Chrome
+        pool = get_browser_pool()
+        driver = pool.acquire()
         try:
             # Navigate to the URL
             driver.get(url)
@@ -32,37 +150,7 @@ def scroll_and_scrape(url, driver=None,scroll_pause_time=4):
                 EC.presence_of_element_located((By.TAG_NAME, "body"))
             )
             
-            # Get initial scroll height
-            last_height = driver.execute_script("return document.body.scrollHeight")
-            
-            while True:
-                # Scroll down smoothly in smaller increments
-                for i in range(10):
-                    current_scroll = last_height * (i + 1) / 10
-                    driver.execute_script(f"window.scrollTo(0, {current_scroll});")
-                    time.sleep(scroll_pause_time / 10)
-                
-                # Wait for new content to load
-                time.sleep(scroll_pause_time)
-                
-                # Calculate new scroll height
-                new_height = driver.execute_script("return document.body.scrollHeight")
-                
-                # Check if the footer is rendered by looking for the footer's presence in the DOM
-                try:
-                    footer = driver.find_element(By.TAG_NAME, "footer")
-                    footer_position = footer.location['y']
-                    current_position = driver.execute_script("return window.pageYOffset + window.innerHeight")
-                    
-                    # Stop scrolling when we are just before the footer
-                    if current_position + 100 >= footer_position:  # Adjust the '100' as needed
-                        break
-                except:
-                    # If footer not found, continue scrolling
-                    pass
-                
-                # Continue scrolling until we are near the footer
-                last_height = new_height
+            _scroll_to_bottom(driver, scroll_pause_time, wait_mode)
             
             # Get the final page source
             page_source = driver.page_source
@@ -73,7 +161,7 @@ def scroll_and_scrape(url, driver=None,scroll_pause_time=4):
             print(f"An error occurred: {str(e)}")
         
         finally:
-            driver.quit()
+            pool.release(driver)
     else:
         try:
             driver.execute_script("window.scrollTo(0, 0);")
@@ -81,45 +169,7 @@ def scroll_and_scrape(url, driver=None,scroll_pause_time=4):
                 EC.presence_of_element_located((By.TAG_NAME, "body"))
             )
             
-            # Get initial scroll height
-            last_height = driver.execute_script("return document.body.scrollHeight")
-        
-            while True:
-                # Scroll down smoothly in smaller increments
-                for i in range(10):
-                    current_scroll = last_height * (i + 1) / 10
-                    driver.execute_script(f"window.scrollTo(0, {current_scroll});")
-                    time.sleep(scroll_pause_time / 10)
-                
-                # Wait for new content to load
-                time.sleep(scroll_pause_time)
-                
-                try:
-                    popup = driver.find_element(By.XPATH, "//div[@role='dialog'][contains(@aria-label, 'POPUP Form')]")
-                    close_button = popup.find_element(By.XPATH, ".//button[@aria-label='Close dialog']")  # Assuming the button has aria-label 'Close'
-                    close_button.click()
-                    time.sleep(1)  # Wait for the popup to close
-                except Exception as e:
-                    print(f"No popup found or error while closing: {e}")
-                
-                # Calculate new scroll height
-                new_height = driver.execute_script("return document.body.scrollHeight")
-                
-                # Check if the footer is rendered by looking for the footer's presence in the DOM
-                try:
-                    footer = driver.find_element(By.TAG_NAME, "footer")
-                    footer_position = footer.location['y']
-                    current_position = driver.execute_script("return window.pageYOffset + window.innerHeight")
-                    
-                    # Stop scrolling when we are just before the footer
-                    if current_position + 100 >= footer_position:  # Adjust the '100' as needed
-                        break
-                except:
-                    # If footer not found, continue scrolling
-                    pass
-                
-                # Continue scrolling until we are near the footer
-                last_height = new_height
+            _scroll_to_bottom(driver, scroll_pause_time, wait_mode, close_popups=True)
             
             # Get the final page source
             page_source = driver.page_source
@@ -131,187 +181,253 @@ def scroll_and_scrape(url, driver=None,scroll_pause_time=4):
             return None
         
 
+# lxml builds the tree several times faster than the pure Python html.parser
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
 
-def clean_html(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    #Remove all images and related elements
-    for element in soup.find_all(["script", "footer","style", "meta", "link", "header","img", "picture", "svg", "figure", "iframe"]):
-        element.decompose()
-        
-    #Remove elements with "overlay" in class name
-    for element in soup.find_all(True):
-        if element.attrs and 'class' in element.attrs:  # Check if attrs is not None and contains 'class'
-            class_names = element.attrs['class']
-            if any("overlay" in cls.lower() for cls in class_names):
-                element.decompose()
-        
-    unnecessary_attrs = [
-        'style',
-        'onclick',
-        'onload',  # accessibility attributes if not needed  # data attributes
-        'src',     # since we removed images
-        'href'    # remove links,      # usually not needed for extraction
-        'alt',
-        'tabindex',
-        'target',
-        'rel',
-        'width',
-        'height',
-        'data-type'
-    ]
-    
-    for tag in soup.find_all(True):
-        for attr in list(tag.attrs):
-            if any(attr.startswith(x.replace('*', '')) for x in unnecessary_attrs):
-                del tag[attr]
-    
-    #Remove empty elements
-    for element in soup.find_all():
-        if len(element.get_text(strip=True)) == 0 and not element.find_all():
+# Elements removed together with their content (images and related elements)
+REMOVED_TAGS = frozenset(["script", "footer","style", "meta", "link", "header","img", "picture", "svg", "figure", "iframe"])
+
+UNNECESSARY_ATTRS = (
+    'style',
+    'onclick',
+    'onload',  # accessibility attributes if not needed  # data attributes
+    'src',     # since we removed images
+    'href',    # remove links,      # usually not needed for extraction
+    'alt',
+    'tabindex',
+    'target',
+    'rel',
+    'width',
+    'height',
+    'data-type'
+)
+
+#Remove uneccessary classname containing the following substrings 
+TOOLTIP_PATTERNS = (
+    'tooltip', 
+    'popover', 
+    'hover-content',
+    'tippy',
+    'hint',
+    'bubble',
+    'popup-text',
+    'helptext',
+    'help-text',
+    'title-tip',
+    'slider',
+    'flex',
+    'media',
+    'image',
+    'margin',
+    'dropup',
+    'dropdown',
+    'dropupdown',
+    'padding',
+    'align'
+    'inline'
+)
+
+_whitespace = re.compile(r'\s+')
+
+def _is_removed(element):
+    """Check whether an element is dropped together with its content."""
+    if element.name in REMOVED_TAGS:
+        return True
+    class_names = element.attrs.get('class') if element.attrs else None
+    return bool(class_names) and any("overlay" in cls.lower() for cls in class_names)
+
+def _prune_attributes(element):
+    """Strip unnecessary and tooltip attributes, tooltip/layout class names and IDs."""
+    attrs = element.attrs
+    for attr in list(attrs):
+        if attr.startswith(UNNECESSARY_ATTRS) or 'tooltip' in attr.lower():
+            del attrs[attr]
+
+    # Handle multiple class names
+    classes = attrs.get('class')
+    if classes:
+        cleaned_classes = [
+            cls for cls in classes
+            if not any(tip in cls.lower() for tip in TOOLTIP_PATTERNS)
+        ]
+        if cleaned_classes:
+            attrs['class'] = cleaned_classes
+        else:
+            del attrs['class']
+
+    # Check for tooltip-related IDs
+    element_id = attrs.get('id')
+    if element_id and isinstance(element_id, str):
+        id_str = element_id.lower()
+        if any(tip in id_str for tip in TOOLTIP_PATTERNS):
+            del attrs['id']
+
+def clean_html(html_content, parser=None):
+    """
+    Removes images, scripts, overlays, empty elements and noisy attributes from a page.
+
+    All cleaning rules are applied in a single traversal of the tree: removed elements
+    are dropped when their parent is visited, so every remaining element is visited once.
+    An element is treated as empty only if it had no child elements to begin with,
+    children emptied by the cleaning itself do not cascade to their parents.
+
+    Args:
+        html_content (str): HTML source of the page
+        parser (str): BeautifulSoup parser backend (default: lxml when installed)
+
+    Returns:
+        str: Cleaned HTML collapsed to a single line
+    """
+    soup = BeautifulSoup(html_content, parser or HTML_PARSER)
+
+    stack = [soup]
+    while stack:
+        element = stack.pop()
+        if element is not soup:
+            _prune_attributes(element)
+
+        child_elements = []
+        for child in element.contents:
+            if isinstance(child, Tag):
+                child_elements.append(child)
+        remaining = []
+        for child in child_elements:
+            if _is_removed(child):
+                child.decompose()
+            else:
+                remaining.append(child)
+
+        if remaining:
+            stack.extend(remaining)
+        elif element is not soup and len(element.get_text(strip=True)) == 0:
+            #Remove empty elements
             element.decompose()
-    
-    #Remove uneccessary classname containing the following substrings 
-    tooltip_patterns = [
-        'tooltip', 
-        'popover', 
-        'hover-content',
-        'tippy',
-        'hint',
-        'bubble',
-        'popup-text',
-        'helptext',
-        'help-text',
-        'title-tip',
-        'slider',
-        'flex',
-        'media',
-        'image',
-        'margin',
-        'dropup',
-        'dropdown',
-        'dropupdown',
-        'padding',
-        'align'
-        'inline'
-    ]
-    
-    for element in soup.find_all(True):
-        try:
-            if hasattr(element, 'attrs') and element.attrs is not None:
-                # Remove all attributes that contain 'tooltip' in their name
-                attrs_to_remove = [
-                    attr for attr in element.attrs.keys()
-                    if 'tooltip' in attr.lower()
-                ]
-                for attr in attrs_to_remove:
-                    del element[attr]
-                
-                # Handle regular tooltip attributes
-                for attr in ['data-tooltip']:
-                    if attr in element.attrs:
-                        del element[attr]
-                
-                # Handle r-tooltip and related attributes
-                r_tooltip_attrs = [
-                    attr for attr in element.attrs.keys()
-                    if attr.startswith('r-tooltip')
-                ]
-                for attr in r_tooltip_attrs:
-                    del element[attr]
-                
-                # Handle multiple class names
-                if 'class' in element.attrs and element.attrs['class']:
-                    classes = element.attrs['class']
-                    cleaned_classes = [
-                        cls for cls in classes 
-                        if not any(tip in cls.lower() for tip in tooltip_patterns)
-                    ]
-                    
-                    if cleaned_classes:
-                        element.attrs['class'] = cleaned_classes
-                    else:
-                        del element.attrs['class']
-                        
-                # Check for tooltip-related IDs
-                if 'id' in element.attrs and element.attrs['id']:
-                    id_str = element.attrs['id'].lower()
-                    if any(tip in id_str for tip in tooltip_patterns):
-                        del element.attrs['id']
-                        
-        except (AttributeError, TypeError):
-            continue
-    
-    
-    html = str(soup)
-    html = re.sub(r'\n\s*\n', '\n', html)
-    html = re.sub(r'\s+', ' ', html)
-    
+
+    html = _whitespace.sub(' ', str(soup))
     return html.strip()
 
+REVIEW_IDENTIFIERS = ['Customer Reviews', 'Reviews', 'Product Reviews', 'Ratings & Reviews', 'product-reviews', 'customer-reviews', 'ratings', 'reviews-summary']
+_identifier_patterns = [re.compile(identifier, re.IGNORECASE) for identifier in REVIEW_IDENTIFIERS]
+_any_identifier = re.compile("|".join(REVIEW_IDENTIFIERS), re.IGNORECASE)
+_summary_pattern = re.compile(r'rating|reviews-summary', re.IGNORECASE)
+
+def _attr_string(value):
+    return " ".join(value) if isinstance(value, list) else (value or "")
+
+def subtree_sizes(soup):
+    """
+    Computes the markup and text length of every element in one bottom-up pass.
+    Markup lengths are estimated from tag names, attributes and strings, which avoids
+    serializing every candidate subtree.
+
+    Returns:
+        tuple: ({id(element): markup length}, {id(element): text length})
+    """
+    markup_sizes = {}
+    text_sizes = {}
+    # In reverse document order every node is visited after all of its descendants
+    for node in reversed(list(soup.descendants)):
+        key = id(node.parent)
+        if isinstance(node, Tag):
+            node_key = id(node)
+            markup = markup_sizes.get(node_key, 0) + 2 * len(node.name) + 5
+            for attr, value in node.attrs.items():
+                markup += len(attr) + len(_attr_string(value)) + 4
+            markup_sizes[node_key] = markup
+            text = text_sizes.get(node_key, 0)
+        elif isinstance(node, PreformattedString):
+            markup, text = len(node) + 7, 0
+        else:
+            markup = text = len(node)
+        markup_sizes[key] = markup_sizes.get(key, 0) + markup
+        text_sizes[key] = text_sizes.get(key, 0) + text
+    return markup_sizes, text_sizes
+
 def extract_reviews_section(html_content):
     """
     Extract HTML from the reviews section to the bottom of the page using dynamic heuristics.
+
+    Candidates are collected in a single pass over the tree and scored by the subtree
+    sizes computed once in subtree_sizes, so the page is never re-serialized per candidate.
     """
+    # html.parser keeps the section choice of the original implementation, lxml adds
+    # html/body wrappers and repairs markup differently, which changes the candidates
     soup = BeautifulSoup(html_content, 'html.parser')
+    markup_sizes, _ = subtree_sizes(soup)
 
-    # Look for review-related containers (divs, articles, etc.)
-    review_identifiers = ['Customer Reviews', 'Reviews', 'Product Reviews', 'Ratings & Reviews', 'product-reviews', 'customer-reviews', 'ratings', 'reviews-summary']
-    review_section = None
-
-    total_content_length = len(str(soup))
+    # Look for review-related containers (divs, articles, etc.) by class names or IDs
+    sections_by_class = [[] for _ in REVIEW_IDENTIFIERS]
+    sections_by_id = [[] for _ in REVIEW_IDENTIFIERS]
+    reviews_summary = None
+    for element in soup.find_all(True):
+        class_names = _attr_string(element.attrs.get('class'))
+        element_id = _attr_string(element.attrs.get('id'))
+        if class_names and reviews_summary is None and _summary_pattern.search(class_names):
+            reviews_summary = element
+        for value, sections in ((class_names, sections_by_class), (element_id, sections_by_id)):
+            if value and _any_identifier.search(value):
+                for index, pattern in enumerate(_identifier_patterns):
+                    if pattern.search(value):
+                        sections[index].append(element)
 
     # Define a minimum percentage of content that should be considered as the review section (e.g., 1% of total content length)
     min_content_percentage = 0.01
-    min_content_length = total_content_length * min_content_percentage
-
-    for identifier in review_identifiers:
-        # Find elements with class names or IDs related to reviews
-        sections_by_class = soup.find_all(attrs={'class': re.compile(identifier, re.IGNORECASE)})
-        sections_by_id = soup.find_all(attrs={'id': re.compile(identifier, re.IGNORECASE)})
-        sections = sections_by_class + sections_by_id
-        if sections:
-            print("Entered if sections")
-            for section in sections:
-                section_html = str(section)
-                # Only consider sections that are larger than the minimum content length
-                seclen=len(section_html)
-                if len(section_html) > min_content_length:
-                    if not review_section:
-                        review_section = section
-                    else:
-                        if seclen>=len(review_section):
-                            review_section = section
+    min_content_length = markup_sizes.get(id(soup), 0) * min_content_percentage
+
+    review_section = None
+    for index in range(len(REVIEW_IDENTIFIERS)):
+        best_size = None
+        for section in sections_by_class[index] + sections_by_id[index]:
+            size = markup_sizes[id(section)]
+            # Only consider sections that are larger than the minimum content length
+            if size > min_content_length and (best_size is None or size >= best_size):
+                review_section, best_size = section, size
         if review_section:
             break
 
     if not review_section:
         print("Entered if not review_section")
         # If no review section is found using class names, try finding the review summary (e.g., stars, rating count)
-        reviews_summary = soup.find(attrs={'class': re.compile(r'rating|reviews-summary', re.IGNORECASE)})
         if reviews_summary:
             # Capture content starting from the reviews summary section
             review_section = reviews_summary.find_parent()
 
     if review_section:
         # Capture all content from the review section and ignore anything after it
-        result = ""
-        current = review_section
+        parts = []
+        current, current_html = review_section, str(review_section)
         while current:
-            result += str(current)
+            parts.append(current_html)
             next_sibling = current.find_next_sibling()
-            if next_sibling:
-                # Stop if we reach a section unrelated to reviews
-                if 'footer' in str(next_sibling).lower() or 'related' in str(next_sibling).lower():
-                    break
-            current = next_sibling
+            if not next_sibling:
+                break
+            next_html = str(next_sibling)
+            lowered = next_html.lower()
+            # Stop if we reach a section unrelated to reviews
+            if 'footer' in lowered or 'related' in lowered:
+                break
+            current, current_html = next_sibling, next_html
 
-        return result
+        return "".join(parts)
     else:
         return None
-    
 
+_tag = re.compile(r'<[^>]*>')
+
+def page_fingerprint(review_html):
+    """
+    Hash of the visible text of a review section.
 
+    Markup is ignored so that a widget re-rendering the same reviews with different
+    attributes (active page class, timestamps in ids...) still maps to the same page.
+    """
+    text = _whitespace.sub(' ', _tag.sub(' ', review_html or '')).strip()
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+    
 
 def get_ancestors(element, levels=4):
     """
@@ -334,11 +450,25 @@ def has_text_content(element):
     """
     return bool(element.string and element.string.strip())
     
+def _is_innermost_text_element(element):
+    """
+    Check if an element has text content and none of its descendants has.
+    That is only the case when its single child is a non-empty string.
+    """
+    contents = element.contents
+    return len(contents) == 1 and isinstance(contents[0], NavigableString) and has_text_content(element)
+
+_content_marker = "\x00"
+
 def filter_reviews(html_content, levels=4):
     """
     Extracts the innermost four levels (or fewer if not available) of DOM elements 
     that contain text and returns them as a formatted HTML string.
     Only includes elements that have actual text content.
+
+    Innermost text elements are found in a single traversal and the markup of their
+    ancestor chain is emitted as strings, with the opening and closing tags of every
+    ancestor rendered only once.
     
     Args:
         html_content (str): HTML content to parse
@@ -348,70 +478,40 @@ def filter_reviews(html_content, levels=4):
         str: Formatted HTML string containing the extracted elements
     """
     soup = BeautifulSoup(html_content, 'html.parser')
-    results = []
-    
-    # Find all elements that contain direct text
-    text_containing_elements = []
+    renderer = BeautifulSoup(features='html.parser')
+    ancestor_tags = {}
+
+    def render_ancestor(ancestor):
+        # Render the tag around a marker once and split it into its opening and closing tags
+        key = id(ancestor)
+        if key not in ancestor_tags:
+            new_tag = renderer.new_tag(ancestor.name, attrs=ancestor.attrs)
+            new_tag.string = _content_marker
+            opening, _, closing = str(new_tag).rpartition(_content_marker)
+            ancestor_tags[key] = (opening, closing)
+        return ancestor_tags[key]
+
+    lines = []
     for elem in soup.find_all():
-        # Check if the element has direct text content
-        if has_text_content(elem):
-            # Check if any child elements also have text content
-            child_with_text = any(has_text_content(child) for child in elem.find_all())
-            # Only include if this is the innermost text-containing element
-            if not child_with_text:
-                text_containing_elements.append(elem)
-    
-    for elem in text_containing_elements:
+        if not _is_innermost_text_element(elem):
+            continue
+
         # Get ancestors up to specified levels
-        ancestors = get_ancestors(elem, levels)
-        
-        if ancestors:
-            # Create new soup object for the output
-            new_soup = BeautifulSoup(features='html.parser')
-            
-            # Start with the outermost ancestor we want to keep
-            current_new = new_soup.new_tag(
-                ancestors[0].name,
-                attrs=ancestors[0].attrs
-            )
-            root = current_new
-            
-            # Rebuild the nested structure
-            for ancestor in ancestors[1:]:
-                new_tag = new_soup.new_tag(
-                    ancestor.name,
-                    attrs=ancestor.attrs
-                )
-                current_new.append(new_tag)
-                current_new = new_tag
-            
-            # Add the text-containing element itself
-            new_elem = new_soup.new_tag(
-                elem.name,
-                attrs=elem.attrs
-            )
-            new_elem.string = elem.string.strip()
-            current_new.append(new_elem)
-            
-            results.append(str(root))
-        else:
-            # If no ancestors (single level), just add the element itself
-            new_soup = BeautifulSoup(features='html.parser')
-            new_elem = new_soup.new_tag(
-                elem.name,
-                attrs=elem.attrs
-            )
-            new_elem.string = elem.string.strip()
-            results.append(str(new_elem))
+        ancestors = [render_ancestor(ancestor) for ancestor in get_ancestors(elem, levels)]
+
+        # Add the text-containing element itself
+        new_elem = renderer.new_tag(elem.name, attrs=elem.attrs)
+        new_elem.string = elem.string.strip()
+
+        result = "".join(
+            [opening for opening, _ in ancestors]
+            + [str(new_elem)]
+            + [closing for _, closing in reversed(ancestors)]
+        )
+        lines.extend(line.strip() for line in result.split('\n'))
     
     # Join results with newlines
-    formatted_html = ""
-    for result in results:
-        lines = result.split('\n')
-        for line in lines:
-            formatted_html += line.strip() + '\n'
-    
-    return formatted_html.strip()
+    return "\n".join(lines).strip()
 
 # Example usage(testing purposes)
 # if __name__ == "__main__":
@@ -0,0 +1,153 @@
+"""
+Process pool for cleaning page sources and locating their review section.
+
+BeautifulSoup work is pure Python and holds the GIL, run in the scraper threads it
+slows down the API, the SSE streams and the threads consuming the LLM. Worker processes
+receive the page source as UTF-8 bytes and return the review section HTML. Pages above
+the size limit, a disabled pool and a broken pool fall back to parsing in-process.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from html_extractor import clean_html, extract_reviews_section, filter_reviews
+from metrics import STAGE_SECONDS
+
+# 0 parses in the calling thread; by default one core is left to the server
+HTML_PARSE_WORKERS = int(os.environ.get("HTML_PARSE_WORKERS", max(0, min(4, (os.cpu_count() or 1) - 1))))
+HTML_PARSE_MAX_BYTES = int(os.environ.get("HTML_PARSE_MAX_BYTES", 16 * 1024 * 1024))  # Larger sources are parsed in-process
+HTML_PARSE_MAX_PENDING = int(os.environ.get("HTML_PARSE_MAX_PENDING", 0))  # Pages queued or parsing, 0 is two per worker
+
+
+def review_section(source):
+    """Review section HTML of a page source (str or UTF-8 bytes)."""
+    if isinstance(source, bytes):
+        source = source.decode("utf-8", errors="replace")
+    return extract_reviews_section(clean_html(source))
+
+
+def fragment_section(source):
+    """Review section of a page fragment returned by a review endpoint, the whole cleaned fragment if none is located."""
+    if isinstance(source, bytes):
+        source = source.decode("utf-8", errors="replace")
+    cleaned = clean_html(source)
+    return extract_reviews_section(cleaned) or cleaned
+
+
+def pagination_sections(source, levels=2):
+    """Review section of a page source and its filtered version the pagination prompt is built from."""
+    section = review_section(source)
+    return section, filter_reviews(section, levels=levels)
+
+
+class HtmlPool:
+    """
+    Runs the parsing functions above in worker processes.
+
+    At most `max_pending` pages are queued or parsing at a time, callers beyond that
+    wait, so the page sources held for the workers stay bounded.
+    """
+
+    def __init__(self, workers=None, max_bytes=HTML_PARSE_MAX_BYTES, max_pending=HTML_PARSE_MAX_PENDING):
+        self.workers = HTML_PARSE_WORKERS if workers is None else workers
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending or 2 * max(1, self.workers)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self.pooled = 0
+        self.in_process = 0
+        self.fallbacks = 0
+        self.total_time = 0.0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Fresh interpreters instead of forks of a process running browser and server threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _discard_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, function, source, *args):
+        """function(source, *args) in a worker process, in-process when that is not possible."""
+        start = time.perf_counter()
+        data = source.encode("utf-8") if isinstance(source, str) else source
+        if self.workers > 0 and len(data) <= self.max_bytes:
+            with self._slots:
+                executor = self._get_executor()
+                try:
+                    result = executor.submit(function, data, *args).result()
+                    self._record(start, pooled=True)
+                    return result
+                except BrokenProcessPool as e:
+                    # A worker died, this page is parsed here and later pages get a new pool
+                    logging.warning(f"HTML parse pool broke, parsing in-process: {e}")
+                    self._discard_executor(executor)
+                    with self._lock:
+                        self.fallbacks += 1
+        result = function(source, *args)
+        self._record(start, pooled=False)
+        return result
+
+    def _record(self, start, pooled):
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels("parse").observe(elapsed)
+        with self._lock:
+            if pooled:
+                self.pooled += 1
+            else:
+                self.in_process += 1
+            self.total_time += elapsed
+
+    def review_section(self, source):
+        return self.run(review_section, source)
+
+    def fragment_section(self, source):
+        return self.run(fragment_section, source)
+
+    def pagination_sections(self, source, levels=2):
+        return self.run(pagination_sections, source, levels)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            pages = self.pooled + self.in_process
+            return {
+                "workers": self.workers,
+                "max_bytes": self.max_bytes,
+                "max_pending": self.max_pending,
+                "pooled": self.pooled,
+                "in_process": self.in_process,
+                "fallbacks": self.fallbacks,
+                "avg_time": self.total_time / pages if pages else None
+            }
+
+
+_html_pool = None
+_html_pool_lock = threading.Lock()
+
+
+def get_html_pool():
+    """Return the process wide HTML parse pool."""
+    global _html_pool
+    with _html_pool_lock:
+        if _html_pool is None:
+            _html_pool = HtmlPool()
+        return _html_pool
@@ -0,0 +1,204 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", 2))  # Jobs scraping at the same time
+JOB_IDLE_TIMEOUT = float(os.environ.get("JOB_IDLE_TIMEOUT", 300))  # Seconds a job is kept without subscribers
+JOB_REAP_INTERVAL = float(os.environ.get("JOB_REAP_INTERVAL", 30))
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETE = "complete"
+ERROR = "error"
+STOPPED = "stopped"
+FINISHED_STATES = (COMPLETE, ERROR, STOPPED)
+
+
+class JobScheduler:
+    """
+    Runs review jobs with bounded concurrency.
+
+    Jobs are identified by a key (the product URL) and created by `job_factory(key, **params)`.
+    A job needs `start()`, `stop(wait)` and a `status` attribute, and calls `on_finish(job)` once
+    it completed, failed or was stopped. `stop(wait=False)` only signals the job to stop. At most max_concurrent jobs run at a time, the
+    others wait in a priority queue (lower value first, FIFO within a priority).
+
+    Requests for a key that already has a job share it. Jobs without subscribers for
+    idle_timeout seconds are stopped and forgotten by a background reaper, except for
+    background jobs, which nobody watches and are only forgotten once they finished.
+    """
+
+    def __init__(self, job_factory, max_concurrent=MAX_CONCURRENT_JOBS, idle_timeout=JOB_IDLE_TIMEOUT,
+                 reap_interval=JOB_REAP_INTERVAL):
+        self.job_factory = job_factory
+        self.max_concurrent = max(1, max_concurrent)
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._queue = []  # (priority, sequence, key)
+        self._sequence = itertools.count()
+        self._running = set()
+        self._subscribers = {}
+        self._idle_since = {}
+        self._background = set()
+        self._reaper = None
+        self.submitted = 0
+        self.reaped = 0
+
+    def submit(self, key, priority=0, background=False, refresh=False, **params):
+        """
+        Return the job of key, creating and scheduling it if there is none (or it failed).
+        With refresh a completed job is replaced by a new one as well.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            restart = (ERROR, STOPPED, COMPLETE) if refresh else (ERROR, STOPPED)
+            if job is not None and job.status not in restart:
+                return job
+            job = self.job_factory(key, **params)
+            job.status = QUEUED
+            job.on_finish = self._on_finish
+            self._jobs[key] = job
+            self._subscribers.setdefault(key, 0)
+            self._idle_since[key] = time.monotonic()
+            if background:
+                self._background.add(key)
+            else:
+                self._background.discard(key)
+            heapq.heappush(self._queue, (priority, next(self._sequence), key))
+            self.submitted += 1
+            to_start = self._next_jobs()
+        self._start(to_start)
+        self._ensure_reaper()
+        return job
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def queue_position(self, key):
+        """1-based position of a queued job, None if it is not queued."""
+        with self._lock:
+            for position, (_, _, queued_key) in enumerate(sorted(self._queue), start=1):
+                if queued_key == key:
+                    return position
+        return None
+
+    def subscribe(self, key):
+        with self._lock:
+            self._subscribers[key] = self._subscribers.get(key, 0) + 1
+
+    def unsubscribe(self, key):
+        with self._lock:
+            self._subscribers[key] = max(0, self._subscribers.get(key, 0) - 1)
+            if not self._subscribers[key]:
+                self._idle_since[key] = time.monotonic()
+
+    def _next_jobs(self):
+        """Pop the jobs that can start now, called with the lock held."""
+        to_start = []
+        while self._queue and len(self._running) < self.max_concurrent:
+            _, _, key = heapq.heappop(self._queue)
+            job = self._jobs.get(key)
+            if job is None or job.status != QUEUED:
+                continue
+            job.status = RUNNING
+            self._running.add(job)
+            to_start.append(job)
+        return to_start
+
+    def _start(self, jobs):
+        for job in jobs:
+            try:
+                job.start()
+            except Exception as e:
+                logging.error(f"Could not start job: {e}")
+                job.status = ERROR
+                self._on_finish(job)
+
+    def _on_finish(self, job):
+        with self._lock:
+            self._running.discard(job)
+            to_start = self._next_jobs()
+        self._start(to_start)
+
+    def _remove(self, key, wait=True):
+        """
+        Stop and forget a job, called without the lock held. Without wait a running job is
+        only signalled to stop.
+        """
+        with self._lock:
+            job = self._jobs.pop(key, None)
+            self._subscribers.pop(key, None)
+            self._idle_since.pop(key, None)
+            self._background.discard(key)
+            self._queue = [entry for entry in self._queue if entry[2] != key]
+            heapq.heapify(self._queue)
+        if job is None:
+            return
+        if job.status == QUEUED:
+            job.status = STOPPED
+        elif job.status == RUNNING:
+            job.stop(wait=wait)
+        # Jobs stopped while running call _on_finish, which frees their slot
+
+    def reap_idle(self):
+        """Stop and forget the jobs that had no subscriber for idle_timeout seconds."""
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                key for key, job in self._jobs.items()
+                if not self._subscribers.get(key) and now - self._idle_since.get(key, now) >= self.idle_timeout
+                and (key not in self._background or job.status in FINISHED_STATES)
+            ]
+        for key in idle:
+            logging.info(f"Reclaiming idle job {key}")
+            # A job stuck in an LLM request must not hold up reclaiming the others
+            self._remove(key, wait=False)
+            self.reaped += 1
+        return idle
+
+    def _ensure_reaper(self):
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="job-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                self.reap_idle()
+            except Exception as e:
+                logging.error(f"Error reaping idle jobs: {e}")
+
+    def stop_all(self):
+        with self._lock:
+            keys = list(self._jobs)
+        for key in keys:
+            self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            states = {}
+            for job in self._jobs.values():
+                states[job.status] = states.get(job.status, 0) + 1
+            return {
+                "max_concurrent": self.max_concurrent,
+                "running": len(self._running),
+                "queued": len(self._queue),
+                "jobs": len(self._jobs),
+                "states": states,
+                "subscribers": sum(self._subscribers.values()),
+                "submitted": self.submitted,
+                "reaped": self.reaped
+            }
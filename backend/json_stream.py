@@ -0,0 +1,120 @@
+import json
+
+from metrics import JSON_DECODE_FAILURES
+
+
+class ReviewArrayParser:
+    """
+    Incremental parser of the JSON array of review objects the LLM generates.
+
+    Text is fed as it is generated and every object of the array is returned as soon as
+    its closing brace arrives. Anything before the array (code fences, explanations) is
+    skipped, the array starts at a "[" followed by "{" or "]" so that bracketed words like
+    "[JSON]" aren't taken for it. An object that is cut off or malformed is skipped too. A single object instead of an
+    array is accepted as well.
+    """
+
+    def __init__(self):
+        self._started = False
+        self._opened = False  # A "[" was read, the array starts if an object or "]" follows
+        self._bare = False  # The output is a single object instead of an array
+        self._done = False
+        self._depth = 0  # 1 inside the array, 2 and more inside one of its items
+        self._in_string = False
+        self._escape = False
+        self._current = []
+
+    def feed(self, text):
+        """Parse the next piece of text, returns the objects completed by it."""
+        objects = []
+        for char in text:
+            if self._done:
+                break
+            if self._opened:
+                if char.isspace():
+                    continue
+                self._opened = False
+                if char == "]":
+                    # An empty array
+                    self._done = True
+                    continue
+                if char == "{":
+                    # The brace opens the first item below
+                    self._started, self._depth = True, 1
+            if not self._started:
+                if char == "[":
+                    self._opened = True
+                    continue
+                if char != "{":
+                    continue
+                # Parse a bare object as the only item of an array
+                self._started, self._bare, self._depth = True, True, 1
+
+            if self._in_string:
+                self._current.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 2:
+                    self._current = []
+                self._current.append(char)
+            elif char in "}]":
+                if self._depth >= 2:
+                    self._current.append(char)
+                self._depth -= 1
+                if self._depth == 1:
+                    obj = self._parse("".join(self._current))
+                    if obj is not None:
+                        objects.append(obj)
+                    self._current = []
+                    self._done = self._bare
+                elif self._depth <= 0:
+                    self._done = True
+            else:
+                if char == '"':
+                    self._in_string = True
+                if self._depth >= 2:
+                    self._current.append(char)
+        return objects
+
+    def _parse(self, text):
+        try:
+            obj = json.loads(text)
+        except ValueError:
+            JSON_DECODE_FAILURES.labels("object").inc()
+            return None
+        return obj if isinstance(obj, dict) else None
+
+
+def is_review_json(text):
+    """Whether an LLM output is a complete JSON review array or object."""
+    try:
+        return isinstance(json.loads(text), (list, dict))
+    except ValueError:
+        return False
+
+
+def parse_review_array(text):
+    """
+    Reviews of an LLM output, a list of dicts.
+
+    Outputs that are not valid JSON (truncated by the token limit, trailing garbage) keep
+    every review object that was completed.
+    """
+    if not text:
+        return []
+    try:
+        data = json.loads(text)
+    except ValueError:
+        JSON_DECODE_FAILURES.labels("output").inc()
+        return ReviewArrayParser().feed(text)
+    if isinstance(data, dict):
+        return [data]
+    if isinstance(data, list):
+        return [item for item in data if isinstance(item, dict)]
+    return []
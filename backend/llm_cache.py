@@ -0,0 +1,238 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from llm_client import get_llm_client, SYSTEM_PROMPT
+from selector_cache import CACHE_DIR
+
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm_responses.sqlite3"))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+_whitespace = re.compile(r'\s+')
+
+
+def normalize(text):
+    """Collapse whitespace so that re-serialized but identical HTML maps to the same key."""
+    return _whitespace.sub(' ', text or '').strip()
+
+
+class LLMResponseCache:
+    """
+    Content addressed cache of LLM completions stored in SQLite.
+
+    Keys are hashes of the model id reported by the server, request parameters and the normalized prompt, which
+    contains both the static prompt and the HTML. When the stored responses exceed
+    max_bytes the least recently used ones are evicted.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._db.commit()
+
+    @staticmethod
+    def key(model, prompt, **params):
+        """Content address of a request."""
+        digest = hashlib.sha256()
+        digest.update(model.encode("utf-8"))
+        for name in sorted(params):
+            digest.update(f"\0{name}={params[name]}".encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(normalize(prompt).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached response or None."""
+        with self._lock:
+            try:
+                row = self._db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"LLM cache lookup failed: {e}")
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        if not response:
+            return
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, response, size, time.time())
+                )
+                self._evict()
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"LLM cache store failed: {e}")
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used responses until the cache fits again
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            try:
+                entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            except sqlite3.Error:
+                entries, size = None, None
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Return the process wide LLM response cache, or None if caching is disabled."""
+    global _llm_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMResponseCache()
+        return _llm_cache
+
+
+def _cacheable(response, finish_reason, cacheable):
+    """Whether a completion may be cached: not cut off at the token limit and accepted by cacheable."""
+    if not response:
+        return False
+    if finish_reason == "length":
+        logging.info("LLM response cut off at the token limit, not cached")
+        return False
+    if cacheable is not None and not cacheable(response):
+        logging.info("Malformed LLM response, not cached")
+        return False
+    return True
+
+
+def cached_chat(prompt, max_tokens, system_prompt=SYSTEM_PROMPT, cacheable=None):
+    """
+    LLMClient.chat that answers identical requests from the response cache. Responses cut
+    off at max_tokens, and those the cacheable predicate rejects, are not cached.
+    """
+    client = get_llm_client()
+    cache = get_llm_cache()
+    if cache is None:
+        return client.chat(prompt, max_tokens=max_tokens, system_prompt=system_prompt)
+
+    key = cache.key(client.model_id(), prompt, max_tokens=max_tokens, system_prompt=system_prompt)
+    response = cache.get(key)
+    if response is not None:
+        return response
+    response = client.chat(prompt, max_tokens=max_tokens, system_prompt=system_prompt)
+    if _cacheable(response, response.finish_reason, cacheable):
+        cache.put(key, str(response))
+    return response
+
+
+async def acached_chat(prompt, max_tokens, system_prompt=SYSTEM_PROMPT, cacheable=None):
+    """Async version of cached_chat using the async LLM client, SQLite is accessed in the default executor."""
+    loop = asyncio.get_running_loop()
+    client = get_llm_client()
+    cache = await loop.run_in_executor(None, get_llm_cache)
+    if cache is None:
+        return await client.achat(prompt, max_tokens=max_tokens, system_prompt=system_prompt)
+
+    model_id = await loop.run_in_executor(None, client.model_id)
+    key = cache.key(model_id, prompt, max_tokens=max_tokens, system_prompt=system_prompt)
+    response = await loop.run_in_executor(None, cache.get, key)
+    if response is not None:
+        return response
+    response = await client.achat(prompt, max_tokens=max_tokens, system_prompt=system_prompt)
+    if _cacheable(response, response.finish_reason, cacheable):
+        await loop.run_in_executor(None, cache.put, key, str(response))
+    return response
+
+
+def cached_stream_chat(prompt, max_tokens, system_prompt=SYSTEM_PROMPT, cacheable=None):
+    """
+    cached_chat yielding the completion as it is generated. A cached response is yielded
+    at once, a streamed one is cached once the stream completed.
+    """
+    client = get_llm_client()
+    cache = get_llm_cache()
+    key = cache.key(client.model_id(), prompt, max_tokens=max_tokens, system_prompt=system_prompt) if cache else None
+    if cache is not None:
+        response = cache.get(key)
+        if response is not None:
+            yield response
+            return
+
+    parts = []
+    finish_reasons = []
+    for text in client.stream_chat(prompt, max_tokens=max_tokens, system_prompt=system_prompt, on_finish=finish_reasons.append):
+        parts.append(text)
+        yield text
+    response = "".join(parts).strip()
+    if cache is not None and _cacheable(response, finish_reasons[0] if finish_reasons else None, cacheable):
+        cache.put(key, response)
+
+
+async def acached_stream_chat(prompt, max_tokens, system_prompt=SYSTEM_PROMPT, cacheable=None):
+    """Async version of cached_stream_chat, SQLite is accessed in the default executor."""
+    loop = asyncio.get_running_loop()
+    client = get_llm_client()
+    cache = await loop.run_in_executor(None, get_llm_cache)
+    key = None
+    if cache is not None:
+        model_id = await loop.run_in_executor(None, client.model_id)
+        key = cache.key(model_id, prompt, max_tokens=max_tokens, system_prompt=system_prompt)
+        response = await loop.run_in_executor(None, cache.get, key)
+        if response is not None:
+            yield response
+            return
+
+    parts = []
+    finish_reasons = []
+    async for text in client.astream_chat(prompt, max_tokens=max_tokens, system_prompt=system_prompt, on_finish=finish_reasons.append):
+        parts.append(text)
+        yield text
+    response = "".join(parts).strip()
+    if cache is not None and _cacheable(response, finish_reasons[0] if finish_reasons else None, cacheable):
+        await loop.run_in_executor(None, cache.put, key, response)
@@ -0,0 +1,334 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+
+from metrics import STAGE_SECONDS, record_usage
+
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL", "http://localhost:1234/v1")
+LLM_API_KEY = os.environ.get("LLM_API_KEY", "lm-studio")
+LLM_MODEL = os.environ.get("LLM_MODEL", "local_model")
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 600))  # Local models can take minutes per page
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 10))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+LLM_RETRY_BACKOFF = float(os.environ.get("LLM_RETRY_BACKOFF", 1.0))  # Seconds, doubled on every retry
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 16))
+LLM_MODEL_CHECK_INTERVAL = float(os.environ.get("LLM_MODEL_CHECK_INTERVAL", 60))  # Seconds between /models lookups
+# Ask llama.cpp compatible servers to keep the KV cache of the static prompt prefix between requests.
+# Off by default since the OpenAI API rejects unknown request fields.
+LLM_CACHE_PROMPT = os.environ.get("LLM_CACHE_PROMPT", "false").lower() in ("1", "true", "yes")
+# Ask for token counts at the end of streamed completions, turn off for servers rejecting stream_options
+LLM_STREAM_USAGE = os.environ.get("LLM_STREAM_USAGE", "true").lower() in ("1", "true", "yes")
+
+SYSTEM_PROMPT = "You are an assistant that performs tasks exactly as stated by the user."
+
+# Errors worth retrying, everything else (bad request, authentication...) fails immediately
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
+
+
+class Completion(str):
+    """Completion text carrying the finish reason reported by the server ("stop", "length"...)."""
+
+    def __new__(cls, text, finish_reason=None):
+        completion = super().__new__(cls, text)
+        completion.finish_reason = finish_reason
+        return completion
+
+
+class LLMStats:
+    """Thread safe request, latency and connection counters of an LLMClient."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.connections_opened = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record_request(self, latency):
+        STAGE_SECONDS.labels("llm").observe(latency)
+        with self._lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_connection(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def as_dict(self):
+        with self._lock:
+            attempts = self.requests + self.failures + self.retries
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "retries": self.retries,
+                "connections_opened": self.connections_opened,
+                "connections_reused": max(0, attempts - self.connections_opened),
+                "avg_latency": self.total_latency / self.requests if self.requests else 0.0,
+                "max_latency": self.max_latency
+            }
+
+
+class LLMClient:
+    """
+    Long-lived client for the OpenAI compatible LLM server.
+
+    A single HTTP connection pool with keep-alive is shared by all requests of the
+    process. Retryable errors are retried with exponential backoff and every request
+    is recorded in `stats`.
+    """
+
+    def __init__(self, base_url=LLM_BASE_URL, api_key=LLM_API_KEY, model=LLM_MODEL, timeout=LLM_TIMEOUT,
+                 connect_timeout=LLM_CONNECT_TIMEOUT, max_retries=LLM_MAX_RETRIES, retry_backoff=LLM_RETRY_BACKOFF,
+                 max_connections=LLM_MAX_CONNECTIONS, cache_prompt=LLM_CACHE_PROMPT, stream_usage=LLM_STREAM_USAGE,
+                 model_check_interval=LLM_MODEL_CHECK_INTERVAL):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.cache_prompt = cache_prompt
+        self.stream_usage = stream_usage
+        self.model_check_interval = model_check_interval
+        self._model_lock = threading.Lock()
+        self._model_id = None
+        self._model_checked = 0.0
+        self.stats = LLMStats()
+        self._timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._http_client = httpx.Client(
+            timeout=self._timeout,
+            limits=self._limits,
+            event_hooks={"request": [self._trace_request]}
+        )
+        # Retries are done here so that they are counted and share the backoff settings
+        self.client = OpenAI(base_url=base_url, api_key=api_key, http_client=self._http_client, max_retries=0)
+        self._async_client = None
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self.stats.record_connection()
+
+    async def _atrace(self, event_name, info):
+        self._trace(event_name, info)
+
+    def _trace_request(self, request):
+        request.extensions["trace"] = self._trace
+
+    async def _atrace_request(self, request):
+        request.extensions["trace"] = self._atrace
+
+    @property
+    def async_client(self):
+        """AsyncOpenAI client with its own connection pool, created on first use."""
+        if self._async_client is None:
+            http_client = httpx.AsyncClient(
+                timeout=self._timeout,
+                limits=self._limits,
+                event_hooks={"request": [self._atrace_request]}
+            )
+            self._async_client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, http_client=http_client, max_retries=0)
+        return self._async_client
+
+    def model_id(self):
+        """
+        Id of the model the server answers with under self.model. Local servers like LM Studio serve
+        whichever model is loaded under the configured name, so the ids of the served models are read
+        from /models, at most every model_check_interval seconds.
+        """
+        with self._model_lock:
+            if self._model_id is not None and time.monotonic() - self._model_checked < self.model_check_interval:
+                return self._model_id
+            try:
+                ids = sorted(model.id for model in self.client.models.list().data)
+            except Exception as e:
+                logging.warning(f"Could not list the models of the LLM server: {e}")
+                ids = []
+            if self.model in ids or not ids:
+                model_id = self.model
+            else:
+                # The configured name is an alias, any of the loaded models may answer it
+                model_id = f"{self.model}={','.join(ids)}"
+            if self._model_id is not None and model_id != self._model_id:
+                logging.info(f"LLM server model changed from {self._model_id} to {model_id}")
+            self._model_id = model_id
+            self._model_checked = time.monotonic()
+            return model_id
+
+    def _request(self, prompt, max_tokens, system_prompt, params):
+        request = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"{prompt}"}
+            ],
+            "temperature": 0.0,  # Set to 0 for most deterministic output
+            "max_tokens": max_tokens,
+            "presence_penalty": 0,
+            "frequency_penalty": 0
+        }
+        if self.cache_prompt:
+            request["extra_body"] = {"cache_prompt": True}
+        request.update(params)
+        return request
+
+    def _backoff(self, attempt, error):
+        delay = self.retry_backoff * (2 ** attempt)
+        logging.warning(f"LLM request failed ({error}), retrying in {delay:.1f}s")
+        self.stats.record_retry()
+        return delay
+
+    def chat(self, prompt, max_tokens, system_prompt=SYSTEM_PROMPT, **params):
+        """Send a single user prompt and return the stripped completion text as a Completion."""
+        request = self._request(prompt, max_tokens, system_prompt, params)
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                completion = self.client.chat.completions.create(**request)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    self.stats.record_failure()
+                    raise
+                time.sleep(self._backoff(attempt, e))
+                continue
+            except Exception:
+                self.stats.record_failure()
+                raise
+            self.stats.record_request(time.perf_counter() - start)
+            record_usage(completion.usage)
+            choice = completion.choices[0]
+            return Completion(choice.message.content.strip(), choice.finish_reason)
+
+    async def achat(self, prompt, max_tokens, system_prompt=SYSTEM_PROMPT, **params):
+        """Async version of chat."""
+        request = self._request(prompt, max_tokens, system_prompt, params)
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                completion = await self.async_client.chat.completions.create(**request)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    self.stats.record_failure()
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+                continue
+            except Exception:
+                self.stats.record_failure()
+                raise
+            self.stats.record_request(time.perf_counter() - start)
+            record_usage(completion.usage)
+            choice = completion.choices[0]
+            return Completion(choice.message.content.strip(), choice.finish_reason)
+
+    def _stream_text(self, stream, start, on_finish):
+        finish_reason = None
+        try:
+            for chunk in stream:
+                record_usage(chunk.usage)
+                if chunk.choices:
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+                    if chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+        except Exception:
+            self.stats.record_failure()
+            raise
+        finally:
+            # Closing the generator early releases the connection instead of leaving the response open
+            stream.close()
+        self.stats.record_request(time.perf_counter() - start)
+        if on_finish:
+            on_finish(finish_reason)
+
+    def stream_chat(self, prompt, max_tokens, system_prompt=SYSTEM_PROMPT, on_finish=None, **params):
+        """
+        Send a single user prompt and yield the completion text as it is generated.
+        Only opening the stream is retried, an interrupted stream raises. on_finish is
+        called with the finish reason once the stream completed.
+        """
+        request = self._request(prompt, max_tokens, system_prompt, params)
+        request["stream"] = True
+        if self.stream_usage:
+            request["stream_options"] = {"include_usage": True}
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                stream = self.client.chat.completions.create(**request)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    self.stats.record_failure()
+                    raise
+                time.sleep(self._backoff(attempt, e))
+                continue
+            except Exception:
+                self.stats.record_failure()
+                raise
+            yield from self._stream_text(stream, start, on_finish)
+            return
+
+    async def astream_chat(self, prompt, max_tokens, system_prompt=SYSTEM_PROMPT, on_finish=None, **params):
+        """Async version of stream_chat."""
+        request = self._request(prompt, max_tokens, system_prompt, params)
+        request["stream"] = True
+        if self.stream_usage:
+            request["stream_options"] = {"include_usage": True}
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                stream = await self.async_client.chat.completions.create(**request)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    self.stats.record_failure()
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+                continue
+            except Exception:
+                self.stats.record_failure()
+                raise
+            finish_reason = None
+            try:
+                async for chunk in stream:
+                    record_usage(chunk.usage)
+                    if chunk.choices:
+                        finish_reason = chunk.choices[0].finish_reason or finish_reason
+                        if chunk.choices[0].delta.content:
+                            yield chunk.choices[0].delta.content
+            except Exception:
+                self.stats.record_failure()
+                raise
+            finally:
+                await stream.close()
+            self.stats.record_request(time.perf_counter() - start)
+            if on_finish:
+                on_finish(finish_reason)
+            return
+
+    def close(self):
+        self._http_client.close()
+
+
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """Return the process wide LLM client."""
+    global _llm_client
+    with _llm_client_lock:
+        if _llm_client is None:
+            _llm_client = LLMClient()
+        return _llm_client
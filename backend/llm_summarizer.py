@@ -1,127 +1,321 @@
-from openai import OpenAI
-from langchain.prompts import PromptTemplate, FewShotPromptTemplate
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from queue import Empty
 from page_scraper import ReviewScraper, get_pagination_class
+from llm_client import SYSTEM_PROMPT
+from llm_cache import cached_chat, acached_chat, cached_stream_chat, acached_stream_chat
+from json_stream import ReviewArrayParser, parse_review_array, is_review_json
+from prompts import REVIEW_EXTRACTION_PROMPT
+from chunker import chunk_review_html, estimate_tokens, LLM_CONTEXT_TOKENS
+from widget_extractors import extract_with_templates, extraction_path_stats, TEMPLATE_EXTRACTION
+from compact_html import llm_input
+
+EXTRACTION_WORKERS = int(os.environ.get("LLM_EXTRACTION_WORKERS", 2))  # Concurrent LLM extraction requests per job
+MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", 0))  # Pages submitted but not yet yielded (0: one per worker)
+RESULT_ORDER = os.environ.get("REVIEW_RESULT_ORDER", "page")  # "page" or "completion"
+LLM_STREAMING = os.environ.get("LLM_STREAMING", "true").lower() in ("1", "true", "yes")  # Hand out reviews while they are generated
+REVIEW_MAX_TOKENS = int(os.environ.get("REVIEW_MAX_TOKENS", 1000))  # Completion tokens per extraction request
+# Review HTML tokens per request, by default what is left of the context after the prompt and completion
+CHUNK_TOKEN_BUDGET = int(os.environ.get("CHUNK_TOKEN_BUDGET", 0)) or (
+    LLM_CONTEXT_TOKENS
+    - estimate_tokens(REVIEW_EXTRACTION_PROMPT.prefix + REVIEW_EXTRACTION_PROMPT.suffix + SYSTEM_PROMPT)
+    - REVIEW_MAX_TOKENS
+)
 
 class OutputGenerator:
     
-    def __init__(self, url=None):
+    def __init__(self, url=None, extraction_workers=None, max_in_flight=None, result_order=None, chunk_token_budget=None, use_templates=None, streaming=None):
         self.url=url
         self.selector=None
-        # Define the prompt template
-        
-        # Define the example HTML and output
-        example_html = """
-        <div class="ElementsWidget__list" role="alert"><!--v-if--><!--v-if--><div class="R-ContentList-container">
-            <div class="R-ContentList">
-                <div class="R-ContentList__item u-textLeft--all">
-                    <div class="item__meta">
-                        <div class="c-meta__authorDetails">
-                            <div class="cssVar-authorName">David</div>
-                        </div>
-                    </div>
-                    <div class="item__review">
-                        <div class="R-TextHeading R-TextHeading--xxs u-textLeft--all">Essentials Nutrition Shake VANILLA</div>
-                        <div class="R-TextBody R-TextBody--xs u-textLeft--all u-whiteSpace--prewrap">
-                            Quality is good. My only issue is a bag should contain at least 30 level scoops to complete a month’s supply.
-                        </div>
-                    </div>
-                    <div class="R-RatingStars"><span>5</span></div>
-                </div>
-            </div>
-        </div>
-        """
+        self.extraction_workers = max(1, extraction_workers or EXTRACTION_WORKERS)
+        self.max_in_flight = max(1, max_in_flight or MAX_IN_FLIGHT or self.extraction_workers)
+        self.result_order = result_order or RESULT_ORDER
+        if self.result_order not in ("page", "completion"):
+            raise ValueError(f"Unknown result order: {self.result_order}")
+        self.chunk_token_budget = chunk_token_budget or CHUNK_TOKEN_BUDGET
+        self.use_templates = TEMPLATE_EXTRACTION if use_templates is None else use_templates
+        self.scraper = None
+        self.last_page = None
+        self.streaming = LLM_STREAMING if streaming is None else streaming
+        # on_reviews(page_num, reviews) receives streamed reviews as soon as they are parsed
+        self.on_reviews = None
+        self.stop_event = None  # Set when the job is stopped, pages still streaming are aborted
+        self._head_sequence = 0  # Sequence number of the next page to be yielded
 
-        example_output = """
-        {{
-            "title": "Essentials Nutrition Shake VANILLA",
-            "body": "Quality is good. My only issue is a bag should contain at least 30 level scoops to complete a month’s supply.",
-            "rating": 5,
-            "reviewer": "David"
-        }}
-        """
+    def getSelector(self):
+        self.selector = get_pagination_class(self.url)
+        print("Classname:" ,self.selector)
+    
+    def stop_scraping(self):
+        """Stops the scraper of the running job, it finishes the page it is on and releases its browser."""
+        scraper = self.scraper
+        if scraper is None:
+            return
+        scraper.is_scraping = False
+        # Unblock a scraper waiting for room in a full page queue
+        try:
+            while True:
+                scraper.review_queue.get_nowait()
+        except Empty:
+            pass
+
+    #Extracts reviews in the required format from each page    
+    def reviewExtractor(self, html_script):
+        formatted_prompt=REVIEW_EXTRACTION_PROMPT.render(html_script)
+        return cached_chat(formatted_prompt, max_tokens=REVIEW_MAX_TOKENS, cacheable=is_review_json)
 
-        # Define the example prompt for formatting examples
-        example_prompt = PromptTemplate(
-            input_variables=["example_html", "example_output"],
-            template="""
-        HTML Input:
-        {example_html}
+    async def areviewExtractor(self, html_script):
+        """Async version of reviewExtractor, the request goes through the async LLM client."""
+        formatted_prompt=REVIEW_EXTRACTION_PROMPT.render(html_script)
+        return await acached_chat(formatted_prompt, max_tokens=REVIEW_MAX_TOKENS, cacheable=is_review_json)
 
-        JSON Output:
-        {example_output}
+    def _merge_chunks(self, page_num, outputs):
+        """Merges the reviews extracted from every chunk of a page into one JSON list."""
+        reviews = []
+        for output in outputs:
+            # Reviews completed before a truncation are kept
+            reviews.extend(parse_review_array(output))
+        return json.dumps(reviews)
+
+    def _stopped(self):
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def _may_stream(self, sequence):
+        # In page order only the page that is yielded next may hand out its reviews early
+        return self.result_order == "completion" or sequence == self._head_sequence
+
+    def _stream_page(self, page_num, sequence, chunks):
         """
-        )
+        Extracts a page with streamed completions. Every review is passed to on_reviews as soon
+        as its JSON object is closed, reviews of a page that has to wait for earlier pages are
+        held back and returned as a JSON list. Once the job is stopped the stream is closed and
+        nothing more is passed on.
+        """
+        held = []
+        for chunk in chunks:
+            parser = ReviewArrayParser()
+            formatted_prompt = REVIEW_EXTRACTION_PROMPT.render(chunk)
+            stream = cached_stream_chat(formatted_prompt, max_tokens=REVIEW_MAX_TOKENS, cacheable=is_review_json)
+            try:
+                for text in stream:
+                    if self._stopped():
+                        return json.dumps([])
+                    held.extend(parser.feed(text))
+                    if held and self._may_stream(sequence):
+                        self.on_reviews(page_num, held)
+                        held = []
+            finally:
+                stream.close()
+        return json.dumps(held)
+
+    async def _astream_page(self, page_num, sequence, chunks):
+        """Async version of _stream_page."""
+        held = []
+        for chunk in chunks:
+            parser = ReviewArrayParser()
+            formatted_prompt = REVIEW_EXTRACTION_PROMPT.render(chunk)
+            stream = acached_stream_chat(formatted_prompt, max_tokens=REVIEW_MAX_TOKENS, cacheable=is_review_json)
+            try:
+                async for text in stream:
+                    if self._stopped():
+                        return json.dumps([])
+                    held.extend(parser.feed(text))
+                    if held and self._may_stream(sequence):
+                        self.on_reviews(page_num, held)
+                        held = []
+            finally:
+                await stream.aclose()
+        return json.dumps(held)
 
-        # Define the prefix (before examples) and suffix (after examples)
-        prefix = """
-        You are an expert at extracting reviews from HTML scripts. Your task is to extract all reviews from the provided HTML input and return them in JSON format. 
-        Make sure to extract the reviewer's full name (first name and last name). If the full name isn't available, return only the available name. The JSON output must include:
+    def _template_reviews(self, page_num, review_html):
+        """Reviews of a known review widget as JSON, None if the page needs the LLM."""
+        if self.use_templates:
+            match = extract_with_templates(review_html)
+            if match:
+                extractor_name, reviews = match
+                extraction_path_stats.record(extractor_name)
+                logging.info(f"Page {page_num} extracted by the {extractor_name} template ({len(reviews)} reviews)")
+                return json.dumps(reviews)
+        extraction_path_stats.record("llm")
+        return None
 
-        - "title": The title of the review, if available.
-        - "body": The full text of the review body.
-        - "rating": The reviewer's rating as a number.
-        - "reviewer": The reviewer's name.
+    def _chunks(self, page_num, review_html):
+        """The compacted page, split at review item boundaries if it is larger than the context."""
+        chunks = chunk_review_html(llm_input(page_num, review_html), self.chunk_token_budget)
+        if len(chunks) > 1:
+            logging.info(f"Page {page_num} split into {len(chunks)} chunks of at most {self.chunk_token_budget} tokens")
+        return chunks
 
-        Please Note that there can be multiple reviews in a single html source code so return a list of reviews following the example template enclosed by []
-        If any information is missing in the HTML input, leave the corresponding JSON field blank. Return only the required output. DO NOT generate additional text and return it only as string and DO NOT enclose it within ```json ```.
+    def _extract_page(self, page_num, review_html, sequence=None):
+        try:
+            # Known review widgets are read without the LLM
+            reviews = self._template_reviews(page_num, review_html)
+            if reviews is not None:
+                return reviews
+            chunks = self._chunks(page_num, review_html)
+            if self.streaming and self.on_reviews:
+                return self._stream_page(page_num, sequence, chunks)
+            if len(chunks) == 1:
+                return self.reviewExtractor(chunks[0])
+            return self._merge_chunks(page_num, [self.reviewExtractor(chunk) for chunk in chunks])
+        except Exception as e:
+            logging.error(f"Error extracting reviews from page {page_num}: {e}")
+            return None
 
-        ### Examples
+    async def _aextract_page(self, page_num, review_html, sequence=None):
+        """Async version of _extract_page, HTML parsing runs in the default executor."""
+        loop = asyncio.get_running_loop()
+        try:
+            reviews = await loop.run_in_executor(None, self._template_reviews, page_num, review_html)
+            if reviews is not None:
+                return reviews
+            chunks = await loop.run_in_executor(None, self._chunks, page_num, review_html)
+            if self.streaming and self.on_reviews:
+                return await self._astream_page(page_num, sequence, chunks)
+            if len(chunks) == 1:
+                return await self.areviewExtractor(chunks[0])
+            return self._merge_chunks(page_num, [await self.areviewExtractor(chunk) for chunk in chunks])
+        except Exception as e:
+            logging.error(f"Error extracting reviews from page {page_num}: {e}")
+            return None
+
+    #Generator which yields a string of reviews from each page
+    def generateReviews(self):
         """
+        Pipelines the scraped pages through a pool of LLM extraction workers.
+
+        Up to max_in_flight pages are extracted or waiting to be yielded at any time.
+        Results are yielded in page order or, with result_order="completion", as soon as
+        they are ready. Pages whose extraction failed yield None. The page number of the
+        result last yielded is kept in last_page.
+        """
+        scraper = ReviewScraper(url=self.url, pag_class=self.selector, check_widget=True)
+        self.scraper = scraper
+        scraper.start_scraping()
 
-        suffix = """
-        ---
+        executor = ThreadPoolExecutor(max_workers=self.extraction_workers, thread_name_prefix="review-extractor")
+        pending = {}  # future -> (sequence number, page number)
+        finished = {}  # sequence number -> result, waiting for earlier pages
+        submitted = 0
+        next_sequence = 0
+        self._head_sequence = 0
+        scraping_done = False
 
-        Here is the actual HTML input:
+        try:
+            while not scraping_done or pending:
+                has_room = len(pending) + len(finished) < self.max_in_flight
+                if not scraping_done and has_room:
+                    try:
+                        # Block only while there is nothing else to wait for
+                        item = scraper.review_queue.get(timeout=0.05 if pending else None)
+                    except Empty:
+                        item = ()
+                    if item is None:  # Check for completion signal
+                        scraping_done = True
+                    elif item:
+                        page_num, review_html = item
+                        pending[executor.submit(self._extract_page, page_num, review_html, submitted)] = (submitted, page_num)
+                        submitted += 1
+                        continue
 
-        HTML Input:
-        {html_script}
+                if not pending:
+                    continue
+                done, _ = wait(
+                    pending,
+                    timeout=0 if has_room and not scraping_done else None,
+                    return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    sequence, page_num = pending.pop(future)
+                    if self.result_order == "completion":
+                        self.last_page = page_num
+                        yield future.result()
+                    else:
+                        finished[sequence] = (page_num, future.result())
 
-        JSON Output:
+                while next_sequence in finished:
+                    self.last_page, result = finished.pop(next_sequence)
+                    yield result
+                    next_sequence += 1
+                    self._head_sequence = next_sequence
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _next_page(self, scraper, timeout):
+        """Next item of the scraper queue, () if none arrived within timeout."""
+        try:
+            return scraper.review_queue.get(timeout=timeout)
+        except Empty:
+            return ()
+
+    async def agenerateReviews(self):
         """
-        # Instantiate the few-shot prompt template
-        self.promptTemp = FewShotPromptTemplate(
-            examples=[{"example_html": example_html, "example_output": example_output}],
-            example_prompt=example_prompt,
-            prefix=prefix,
-            suffix=suffix,
-            input_variables=["html_script"],
-        )
-    
-    def getSelector(self):
-        self.selector = get_pagination_class(self.url)
-        print("Classname:" ,self.selector)
-    
-    #Extracts reviews in the required format from each page    
-    def reviewExtractor(self, html_script):
-        formatted_prompt=self.promptTemp.format(html_script=html_script)
-        client = OpenAI(base_url="http://localhost:1234/v1", api_key="lm-studio")
-        messages = [
-                {"role": "system", "content": "You are an assistant that performs tasks exactly as stated by the user."},
-                {"role": "user", "content": f"{formatted_prompt}"}
-            ]
-        completion = client.chat.completions.create(
-            model="local_model",
-            messages=messages,
-            temperature=0.0,  # Set to 0 for most deterministic output
-            max_tokens=1000,  # Limit response length since we only need the selector
-            presence_penalty=0,
-            frequency_penalty=0,
-        )
-        return completion.choices[0].message.content.strip() 
-    
-    #Generator which yields a string of reviews from each page            
-    def generateReviews(self):
-        scraper = ReviewScraper(url=self.url, pag_class=self.selector)
+        Async version of generateReviews for the asyncio server.
+
+        The scraper keeps its own thread since Selenium blocks, pages are read from its
+        queue in the default executor and extracted by at most extraction_workers
+        concurrent tasks using the async LLM client.
+        """
+        loop = asyncio.get_running_loop()
+        scraper = ReviewScraper(url=self.url, pag_class=self.selector, check_widget=True)
+        self.scraper = scraper
         scraper.start_scraping()
-        
-        while True:
-            item = scraper.review_queue.get()
-            if item is None:  # Check for completion signal
-                break
-            page_num, review_html = item
-            # Your LLM processing logic here
-            jsoncontent = self.reviewExtractor(review_html)
-            yield jsoncontent
+
+        workers = asyncio.Semaphore(self.extraction_workers)
+
+        async def extract(page_num, review_html, sequence):
+            async with workers:
+                return await self._aextract_page(page_num, review_html, sequence)
+
+        pending = {}  # task -> (sequence number, page number)
+        finished = {}  # sequence number -> result, waiting for earlier pages
+        submitted = 0
+        next_sequence = 0
+        self._head_sequence = 0
+        scraping_done = False
+        next_page = None
+
+        try:
+            while not scraping_done or pending:
+                waiting = set(pending)
+                if not scraping_done and len(pending) + len(finished) < self.max_in_flight:
+                    if next_page is None:
+                        # Time out regularly so that no executor thread stays blocked on a stopped job
+                        next_page = loop.run_in_executor(None, self._next_page, scraper, 1)
+                    waiting.add(next_page)
+                done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+                if next_page in done:
+                    item = next_page.result()
+                    next_page = None
+                    if item is None:  # Check for completion signal
+                        scraping_done = True
+                    elif item:
+                        page_num, review_html = item
+                        pending[asyncio.ensure_future(extract(page_num, review_html, submitted))] = (submitted, page_num)
+                        submitted += 1
+
+                for task in done:
+                    if task not in pending:
+                        continue
+                    sequence, page_num = pending.pop(task)
+                    if self.result_order == "completion":
+                        self.last_page = page_num
+                        yield task.result()
+                    else:
+                        finished[sequence] = (page_num, task.result())
+
+                while next_sequence in finished:
+                    self.last_page, result = finished.pop(next_sequence)
+                    yield result
+                    next_sequence += 1
+                    self._head_sequence = next_sequence
+        finally:
+            for task in pending:
+                task.cancel()
         
 if __name__=="__main__":
     generator1=OutputGenerator(url="https://lyfefuel.com/products/essentials-nutrition-shake")
@@ -0,0 +1,57 @@
+"""
+Prometheus metrics of the extraction pipeline, served on /metrics.
+
+Stage latencies share one histogram labelled by stage:
+    scroll              loading and scrolling a page in Chrome, including the scroll pauses
+    parse               cleaning a page source and locating its review section
+    pagination_selector finding the pagination selector of a URL (cache hits included)
+    queue_wait          time a scraped page waits in the scraper queue for extraction
+    llm                 one LLM request, until the last token of a streamed completion
+
+Gauges of values owned by other modules (queue depth, jobs, browsers) are registered by
+those modules with `set_function`. Worker processes of bulk jobs keep their own metrics,
+they are not part of this endpoint.
+"""
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Local models take minutes per page, the buckets go up to 10 minutes
+_buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram("review_stage_seconds", "Latency of the extraction pipeline stages", ["stage"], buckets=_buckets)
+
+PAGES = Counter("review_pages_total", "Review pages queued for extraction", ["source"])
+REVIEWS = Counter("reviews_total", "Reviews added to jobs after deduplication")
+JSON_DECODE_FAILURES = Counter(
+    "review_json_decode_failures_total",
+    "LLM outputs that were not valid JSON (output) and review objects that could not be salvaged (object)",
+    ["kind"]
+)
+PAGINATION_CLICKS = Counter("pagination_clicks_total", "Pagination clicks by the strategy that found the element", ["strategy"])
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the LLM server", ["type"])
+LLM_INPUT_TOKENS = Counter(
+    "llm_input_tokens_total",
+    "Estimated tokens of the review sections sent to the LLM, as HTML and after compaction",
+    ["format"]
+)
+
+REVIEW_QUEUE_DEPTH = Gauge("review_queue_depth", "Scraped pages waiting for extraction in all jobs")
+ACTIVE_JOBS = Gauge("review_active_jobs", "Jobs currently running")
+LIVE_BROWSERS = Gauge("browser_pool_live", "Live Chrome instances of the browser pool")
+
+
+def stage_timer(stage):
+    """Context manager and decorator observing the duration of a stage."""
+    return STAGE_SECONDS.labels(stage).time()
+
+
+def record_usage(usage):
+    """Count the tokens of the usage object of an LLM response, if the server sent one."""
+    if usage is None:
+        return
+    LLM_TOKENS.labels("prompt").inc(usage.prompt_tokens or 0)
+    LLM_TOKENS.labels("completion").inc(usage.completion_tokens or 0)
+
+
+def metrics_response():
+    """Body and content type of the /metrics endpoint."""
+    return generate_latest(), CONTENT_TYPE_LATEST
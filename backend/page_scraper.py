@@ -1,136 +1,194 @@
-from html_extractor import scroll_and_scrape, clean_html, extract_reviews_section, filter_reviews
+from html_extractor import scroll_and_scrape, page_fingerprint
+from html_pool import get_html_pool
 import time
+import weakref
+from collections import deque
 from queue import Queue
 import threading
-from openai import OpenAI
-from langchain.prompts import PromptTemplate, FewShotPromptTemplate
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
+from browser_pool import get_browser_pool
+from llm_client import get_llm_client
+from prompts import PAGINATION_PROMPT
+from selector_cache import get_selector_cache, widget_fingerprint
+from xhr_pagination import XHR_PAGINATION, discover_review_endpoint, fetch_pages
+from metrics import PAGES, PAGINATION_CLICKS, REVIEW_QUEUE_DEPTH, STAGE_SECONDS, stage_timer
 
 def llm_function(prompt):
-    client = OpenAI(base_url="http://localhost:1234/v1", api_key="lm-studio")
-    messages = [
-            {"role": "system", "content": "You are an assistant that performs tasks exactly as stated by the user."},
-            {"role": "user", "content": f"{prompt}"}
-        ]
-    completion = client.chat.completions.create(
-        model="local_model",
-        messages=messages,
-        temperature=0.0,  # Set to 0 for most deterministic output
-        max_tokens=50,  # Limit response length since we only need the selector
-        presence_penalty=0,
-        frequency_penalty=0
-    )
-    return completion.choices[0].message.content.strip()
-
-def get_pagination_class(url):
+    # Selectors are cached per domain by the selector cache, not by the LLM response cache: a selector
+    # invalidated there must be asked for again instead of being answered with the same wrong one.
+    # Limit response length since we only need the selector
+    return get_llm_client().chat(prompt, max_tokens=50)
+
+@stage_timer("pagination_selector")
+def get_pagination_class(url, use_cache=True):
+    # Most product pages of a shop use the same review widget, so the domain's newest selector is the
+    # first guess; ReviewScraper checks it against the widget on the first page (widget_selector)
+    selector_cache = get_selector_cache()
+    if use_cache:
+        cached_selector = selector_cache.get(url)
+        if cached_selector:
+            print(f"Using cached pagination selector for {url}: {cached_selector}")
+            return cached_selector
+
     html_source=scroll_and_scrape(url)
-    cleaned_html=clean_html(html_source)
-    reviews=extract_reviews_section(cleaned_html)
-    reviews=filter_reviews(reviews, levels=2) 
-    page_number="1"
-    examples = [
-        {
-            "input": "HTML source code:\n<div class='pagination'>\n  <a class='jdgm-paginate__page jdgm-curt' data-page='1' aria-label='Page 1' tabindex='0' role='button'>1</a>\n  <a class='jdgm-paginate__page' data-page='2' aria-label='Page 2' tabindex='0' role='button'>2</a>\n</div>\n\nPage number: 1",
-            "output": "Class name: jdgm-paginate__page"
-        },
-        {
-            "input": "HTML source code:\n<nav>\n  <ul class='pagination'>\n    <li><a class='paginate-item' href='/reviews?page=1' role='button'>1</a></li>\n    <li><a class='paginate-item' href='/reviews?page=2' role='button'>2</a></li>\n  </ul>\n</nav>\n\nPage number: 2",
-            "output": "Class name: paginate-active"
-        },
-        {
-            "input": "HTML source code:\n<div class='R-PaginationControls__item' role='button' tabindex='0' data-type='link'><div class='R-TextHeading R-TextHeading--xxxs'>3</div></div>\n\nPage number: 3",
-            "output": "Class name: R-PaginationControls__item"
-        },
-        {
-            "input": "HTML source code:\n<div class='pagination-container'>\n  <button class='prev-page'>Previous</button>\n  <button class='next-page'>Next</button>\n  <span class='page-number'>1</span>\n  <span class='page-number'>2</span>\n</div>\n\nPage number: 2",
-            "output": "Class name: page-number"
-        },
-        {
-            "input": "HTML source code:\n<div class='pagination_wrapper'>\n  <a class='page-link' href='/page=1' data-page='1' aria-label='Page 1'>1</a>\n  <a class='page-link' href='/page=2' data-page='2' aria-label='Page 2'>2</a>\n  <a class='page-link' href='/page=3' data-page='3' aria-label='Page 3'>3</a>\n</div>\n\nPage number: 2",
-            "output": "Class name: page-link"
-        },
-        {
-            "input": "HTML source code:\n<div class='pagination_control'>\n  <a class='pagination_btn' data-page='1' href='#'>1</a>\n  <a class='pagination_btn' data-page='2' href='#'>2</a>\n  <a class='pagination_btn' data-page='3' href='#'>3</a>\n</div>\n\nPage number: 3",
-            "output": "Class name: pagination_btn"
-        },
-        {
-            "input": "HTML source code:\n<ul class='page-nav-list'>\n  <li><a href='/page/1' class='page-item'>1</a></li>\n  <li><a href='/page/2' class='page-item'>2</a></li>\n  <li><a href='/page/3' class='page-item'>3</a></li>\n</ul>\n\nPage number: 1",
-            "output": "Class name: page-item"
-        },
-        {
-            "input": "HTML source code:\n<div class='pagination_wrapper'>\n  <button class='page-btn' data-page='1' role='button'>1</button>\n  <button class='page-btn' data-page='2' role='button'>2</button>\n  <button class='page-btn' data-page='3' role='button'>3</button>\n</div>\n\nPage number: 2",
-            "output": "Class name: page-btn"
-        },
-        {
-            "input": "HTML source code:\n<div class='pagination__controls'>\n  <a href='/page=1' class='page-button' data-page='1'>1</a>\n  <a href='/page=2' class='page-button' data-page='2'>2</a>\n</div>\n\nPage number: 2",
-            "output": "Class name: page-button"
-        },
-        {
-            "input": "HTML source code:\n<div class='pagination'><a href='/page-1' class='pagination__link' data-page='1'>1</a><a href='/page-2' class='pagination__link' data-page='2'>2</a></div>\n\nPage number: 1",
-            "output": "Class name: pagination__link"
-        }
-    ]
-    
-    # Define the prompt template
-    template = FewShotPromptTemplate(
-        examples=examples,
-        example_prompt=PromptTemplate(
-            input_variables=["input", "output"],
-            template="{input}\n{output}"
-        ),
-        prefix=(
-            "Your task is to extract the class name of the pagination element  which contains the page number in the atrributes or inner text (element which when clicked navigates to a new page or renders new content) from the provided HTML source "
-            "for a given page number. The pagination element can often be identified by: "
-            "1) the 'role' attribute (e.g., role='button'), "
-            "2) attributes containing the substring 'paginate' or 'pagination',"
-            "3) any other contextual indicators that match the concept of a pagination button.,"
-            "4) Do not just copy the examples given analyze the html source code and return the output based on it"
-            "Even if the exact attribute names differ from the examples, use logical reasoning to find the correct element. "
-            "If the class name atrribute contains multiple names seperated by a blank space then return the first name"
-            "Below are examples to guide you:"
-        ),
-        suffix="HTML source code:\n{reviews}\n\nPage number: {page_number}\n\nReturn only the class name DO NOT generate additional text:",
-        input_variables=["reviews", "page_number"],
-        example_separator="\n---\n"
-    )
-    formatted_prompt = template.format(reviews=reviews, page_number=page_number)
+    reviews_section, reviews = get_html_pool().pagination_sections(html_source, levels=2)
+    formatted_prompt = PAGINATION_PROMPT.render(reviews)
     response=llm_function(formatted_prompt)
+    if use_cache:
+        selector_cache.put(url, response, widget_fingerprint(reviews_section))
     return response
+
+
+def widget_selector(url, src_code, review_html):
+    """
+    Pagination selector for the review widget of an already scraped page. A shop can use more than
+    one widget, so a selector cached for another widget of the domain isn't trusted: it's asked for
+    from this page and cached under the widget's fingerprint.
+    """
+    selector_cache = get_selector_cache()
+    fingerprint = widget_fingerprint(review_html)
+    selector = selector_cache.get(url, fingerprint)
+    if selector:
+        return selector
+    _, reviews = get_html_pool().pagination_sections(src_code, levels=2)
+    selector = llm_function(PAGINATION_PROMPT.render(reviews))
+    selector_cache.put(url, selector, fingerprint)
+    return selector
  
+class _TimedQueue(Queue):
+    """Queue observing how long every page waited in it."""
+
+    def _init(self, maxsize):
+        self.queue = deque()
+
+    def _put(self, item):
+        self.queue.append((time.perf_counter(), item))
+
+    def _get(self):
+        queued_at, item = self.queue.popleft()
+        if item is not None:
+            STAGE_SECONDS.labels("queue_wait").observe(time.perf_counter() - queued_at)
+        return item
+
+
+# Scrapers of the running jobs, for the queue depth gauge
+_live_scrapers = weakref.WeakSet()
+REVIEW_QUEUE_DEPTH.set_function(lambda: sum(scraper.review_queue.qsize() for scraper in list(_live_scrapers)))
+
+
 class ReviewScraper:
-    def __init__(self, url, pag_class, max_pages=None):
+    def __init__(self, url, pag_class, max_pages=None, use_xhr=None, check_widget=False):
         self.url = url
         self.pag_class = pag_class
+        self.check_widget = check_widget  # Check pag_class against the widget on the first page
         self.max_pages = max_pages
-        self.review_queue = Queue(maxsize=10)  # Buffer size of 10 pages
+        self.use_xhr = XHR_PAGINATION if use_xhr is None else use_xhr
+        self.endpoint = None  # Review endpoint the pages were fetched from
+        self.review_queue = _TimedQueue(maxsize=10)  # Buffer size of 10 pages
         self.is_scraping = True
         self.scraper_thread = None
+        self.seen_pages = set()  # Fingerprints of the pages queued in this job
+        self.duplicate_pages = 0
+        _live_scrapers.add(self)
+
+    def _queue_page(self, page_num, review, source="browser"):
+        """Queue a page unless it repeats an earlier one, returns whether it was new"""
+        fingerprint = page_fingerprint(review)
+        if fingerprint in self.seen_pages:
+            self.duplicate_pages += 1
+            return False
+        self.seen_pages.add(fingerprint)
+        self.review_queue.put((page_num, review))
+        PAGES.labels(source).inc()
+        return True
+
+    def _fetch_endpoint_pages(self, endpoint, cookies, on_first_page=None):
+        """
+        Fetch the pages after the first one directly from the review endpoint, returns the number
+        of pages queued. on_first_page is called once the endpoint delivered a new page.
+        """
+        queued = 0
+        for page, content in fetch_pages(endpoint, endpoint.page + 1, cookies=cookies):
+            if not self.is_scraping:
+                break
+            # The first page was read from the browser
+            page_num = 1 + page - endpoint.page
+            if self.max_pages and page_num > self.max_pages:
+                break
+            # Endpoint pages are cleaned and located like the pages read in the browser
+            review = get_html_pool().fragment_section(content)
+            if not self._queue_page(page_num, review, source="endpoint"):
+                print(f"Page {page_num} repeats an earlier page, stopping pagination")
+                break
+            queued += 1
+            if queued == 1 and on_first_page:
+                on_first_page()
+            print(f"Fetched page {page_num} from the review endpoint")
+        return queued
 
     def _scrape_reviews(self):
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        driver = webdriver.Chrome(options=chrome_options)
-        driver.get(self.url)
+        pool = get_browser_pool()
+        driver = None
         current_page = 1
         page_num = 2
         max_attempts = 3
+        clicked = False  # Whether the current content was reached by a pagination click
+        try_endpoint = self.use_xhr  # The review endpoint is looked for once, on the first page
+        selector_matched = False  # Whether any element matched the pagination selector
+
+        def release_driver():
+            # Later pages of a working review endpoint need no browser
+            nonlocal driver
+            pool.release(driver)
+            driver = None
 
         try:
+            driver = pool.acquire()
+            if self.use_xhr:
+                try:
+                    # Drop requests an earlier job left in the performance log
+                    driver.get_log("performance")
+                except Exception:
+                    pass
+            driver.get(self.url)
             while self.is_scraping:
                 if self.max_pages and current_page > self.max_pages:
                     break
 
                 # Get current page content
                 src_code = scroll_and_scrape(self.url, driver=driver, scroll_pause_time=2)
-                cleaned_html = clean_html(src_code)
-                review = extract_reviews_section(cleaned_html)
+                review = get_html_pool().review_section(src_code)
                 # review=filter_reviews(review, levels=4)
-                
-                # Put the review in the queue
-                self.review_queue.put((current_page, review))
-                print(f"Extracted content from page {current_page}")
+
+                if not self._queue_page(current_page, review):
+                    if clicked:
+                        # The click "worked" but the widget shows a page we already have
+                        print(f"Page {current_page} repeats an earlier page, stopping pagination")
+                        break
+                    # Retry after a failed click, the page is already queued
+                    print(f"Page {current_page} unchanged, not queued again")
+                else:
+                    print(f"Extracted content from page {current_page}")
+
+                if self.check_widget:
+                    self.check_widget = False
+                    selector = widget_selector(self.url, src_code, review)
+                    if selector != self.pag_class:
+                        print(f"Pagination selector {self.pag_class} belongs to another widget, using {selector}")
+                        self.pag_class = selector
+
+                if try_endpoint:
+                    try_endpoint = False
+                    endpoint = discover_review_endpoint(driver)
+                    if endpoint:
+                        print(f"Paginating through the review endpoint {endpoint.url}")
+                        cookies = {cookie["name"]: cookie["value"] for cookie in driver.get_cookies()}
+                        # The driver is kept until the endpoint proved to work, it may need headers or
+                        # cookies we can't replay or not be the review endpoint at all
+                        if self._fetch_endpoint_pages(endpoint, cookies, on_first_page=release_driver):
+                            self.endpoint = endpoint
+                            break
+                        print("The review endpoint returned no pages, paginating in the browser")
 
                 if max_attempts <= 0:
                     break
@@ -142,12 +200,14 @@ class ReviewScraper:
                     # Strategy 1: Direct class and number match
                     try:
                         elements = driver.find_elements(By.CLASS_NAME, self.pag_class)
+                        selector_matched = selector_matched or bool(elements)
                         for element in elements:
                             if element.text.strip() == str(page_num):
                                 driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", element)
                                 time.sleep(1)
                                 element.click()
                                 pagination_found = True
+                                PAGINATION_CLICKS.labels("1").inc()
                                 break
                     except Exception as e:
                         print(f"Strategy 1 failed: {e}")
@@ -156,12 +216,14 @@ class ReviewScraper:
                     if not pagination_found:
                         try:
                             elements = driver.find_elements(By.CSS_SELECTOR, f"[class*='{self.pag_class}']")
+                            selector_matched = selector_matched or bool(elements)
                             for element in elements:
                                 if element.text.strip() == str(page_num):
                                     driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", element)
                                     time.sleep(1)
                                     driver.execute_script("arguments[0].click();", element)
                                     pagination_found = True
+                                    PAGINATION_CLICKS.labels("2").inc()
                                     break
                         except Exception as e:
                             print(f"Strategy 2 failed: {e}")
@@ -171,12 +233,14 @@ class ReviewScraper:
                         try:
                             xpath_query = f"//*[contains(@class, '{self.pag_class}')]|//*[contains(@class, '{self.pag_class}')]//*"
                             elements = driver.find_elements(By.XPATH, xpath_query)
+                            selector_matched = selector_matched or bool(elements)
                             for element in elements:
                                 if element.text.strip() == str(page_num):
                                     driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", element)
                                     time.sleep(1)
                                     driver.execute_script("arguments[0].click();", element)
                                     pagination_found = True
+                                    PAGINATION_CLICKS.labels("3").inc()
                                     break
                         except Exception as e:
                             print(f"Strategy 3 failed: {e}")
@@ -188,15 +252,22 @@ class ReviewScraper:
                     current_page += 1
                     page_num += 1
                     max_attempts = 3
+                    clicked = True
 
                 except Exception as e:
                     print(f"Error during pagination: {str(e)}")
+                    clicked = False
                     max_attempts -= 1
                     if max_attempts <= 0:
+                        if not selector_matched:
+                            # The selector matched nothing on this widget, don't reuse it for the domain. A
+                            # widget with a single page of reviews has the pagination but no page 2 to click.
+                            get_selector_cache().invalidate(self.url, selector=self.pag_class)
                         break
 
         finally:
-            driver.quit()
+            if driver:
+                pool.release(driver)
             self.review_queue.put(None)  # Signal completion
 
     def start_scraping(self):
@@ -0,0 +1,185 @@
+"""
+Prompt templates compiled once at import time.
+
+The langchain few-shot templates are formatted a single time around a marker, which
+splits every prompt into a static prefix and suffix. Rendering a prompt is then a plain
+string concatenation, and since the static part is byte-identical for every page, LLM
+servers with prompt (KV) caching can reuse the few-shot tokens across requests.
+"""
+from langchain.prompts import PromptTemplate, FewShotPromptTemplate
+
+from compact_html import LLM_INPUT_FORMAT, compact_review_html
+
+_marker = "\x00CONTENT\x00"
+
+
+class CompiledPrompt:
+    """A prompt whose only variable part is the HTML placed between prefix and suffix."""
+
+    def __init__(self, template, variable, **fixed_values):
+        rendered = template.format(**{variable: _marker}, **fixed_values)
+        if rendered.count(_marker) != 1:
+            raise ValueError(f"Template variable {variable} must appear exactly once")
+        self.prefix, self.suffix = rendered.split(_marker)
+
+    def render(self, content):
+        return f"{self.prefix}{content}{self.suffix}"
+
+
+def _review_extraction_template():
+    # Define the example HTML and output
+    example_html = """
+        <div class="ElementsWidget__list" role="alert"><!--v-if--><!--v-if--><div class="R-ContentList-container">
+            <div class="R-ContentList">
+                <div class="R-ContentList__item u-textLeft--all">
+                    <div class="item__meta">
+                        <div class="c-meta__authorDetails">
+                            <div class="cssVar-authorName">David</div>
+                        </div>
+                    </div>
+                    <div class="item__review">
+                        <div class="R-TextHeading R-TextHeading--xxs u-textLeft--all">Essentials Nutrition Shake VANILLA</div>
+                        <div class="R-TextBody R-TextBody--xs u-textLeft--all u-whiteSpace--prewrap">
+                            Quality is good. My only issue is a bag should contain at least 30 level scoops to complete a month’s supply.
+                        </div>
+                    </div>
+                    <div class="R-RatingStars"><span>5</span></div>
+                </div>
+            </div>
+        </div>
+        """
+    if LLM_INPUT_FORMAT == "compact":
+        # Show the example in the form the pages are sent in (compact_html.llm_input)
+        example_html = compact_review_html(example_html)
+
+    example_output = """
+        {{
+            "title": "Essentials Nutrition Shake VANILLA",
+            "body": "Quality is good. My only issue is a bag should contain at least 30 level scoops to complete a month’s supply.",
+            "rating": 5,
+            "reviewer": "David"
+        }}
+        """
+
+    # Define the example prompt for formatting examples
+    example_prompt = PromptTemplate(
+        input_variables=["example_html", "example_output"],
+        template="""
+        HTML Input:
+        {example_html}
+
+        JSON Output:
+        {example_output}
+        """
+    )
+
+    # Define the prefix (before examples) and suffix (after examples)
+    prefix = """
+        You are an expert at extracting reviews from HTML scripts. Your task is to extract all reviews from the provided HTML input and return them in JSON format. 
+        Make sure to extract the reviewer's full name (first name and last name). If the full name isn't available, return only the available name. The JSON output must include:
+
+        - "title": The title of the review, if available.
+        - "body": The full text of the review body.
+        - "rating": The reviewer's rating as a number.
+        - "reviewer": The reviewer's name.
+
+        Please Note that there can be multiple reviews in a single html source code so return a list of reviews following the example template enclosed by []
+        If any information is missing in the HTML input, leave the corresponding JSON field blank. Return only the required output. DO NOT generate additional text and return it only as string and DO NOT enclose it within ```json ```.
+
+        ### Examples
+        """
+
+    suffix = """
+        ---
+
+        Here is the actual HTML input:
+
+        HTML Input:
+        {html_script}
+
+        JSON Output:
+        """
+    # Instantiate the few-shot prompt template
+    return FewShotPromptTemplate(
+        examples=[{"example_html": example_html, "example_output": example_output}],
+        example_prompt=example_prompt,
+        prefix=prefix,
+        suffix=suffix,
+        input_variables=["html_script"],
+    )
+
+
+def _pagination_template():
+    examples = [
+        {
+            "input": "HTML source code:\n<div class='pagination'>\n  <a class='jdgm-paginate__page jdgm-curt' data-page='1' aria-label='Page 1' tabindex='0' role='button'>1</a>\n  <a class='jdgm-paginate__page' data-page='2' aria-label='Page 2' tabindex='0' role='button'>2</a>\n</div>\n\nPage number: 1",
+            "output": "Class name: jdgm-paginate__page"
+        },
+        {
+            "input": "HTML source code:\n<nav>\n  <ul class='pagination'>\n    <li><a class='paginate-item' href='/reviews?page=1' role='button'>1</a></li>\n    <li><a class='paginate-item' href='/reviews?page=2' role='button'>2</a></li>\n  </ul>\n</nav>\n\nPage number: 2",
+            "output": "Class name: paginate-active"
+        },
+        {
+            "input": "HTML source code:\n<div class='R-PaginationControls__item' role='button' tabindex='0' data-type='link'><div class='R-TextHeading R-TextHeading--xxxs'>3</div></div>\n\nPage number: 3",
+            "output": "Class name: R-PaginationControls__item"
+        },
+        {
+            "input": "HTML source code:\n<div class='pagination-container'>\n  <button class='prev-page'>Previous</button>\n  <button class='next-page'>Next</button>\n  <span class='page-number'>1</span>\n  <span class='page-number'>2</span>\n</div>\n\nPage number: 2",
+            "output": "Class name: page-number"
+        },
+        {
+            "input": "HTML source code:\n<div class='pagination_wrapper'>\n  <a class='page-link' href='/page=1' data-page='1' aria-label='Page 1'>1</a>\n  <a class='page-link' href='/page=2' data-page='2' aria-label='Page 2'>2</a>\n  <a class='page-link' href='/page=3' data-page='3' aria-label='Page 3'>3</a>\n</div>\n\nPage number: 2",
+            "output": "Class name: page-link"
+        },
+        {
+            "input": "HTML source code:\n<div class='pagination_control'>\n  <a class='pagination_btn' data-page='1' href='#'>1</a>\n  <a class='pagination_btn' data-page='2' href='#'>2</a>\n  <a class='pagination_btn' data-page='3' href='#'>3</a>\n</div>\n\nPage number: 3",
+            "output": "Class name: pagination_btn"
+        },
+        {
+            "input": "HTML source code:\n<ul class='page-nav-list'>\n  <li><a href='/page/1' class='page-item'>1</a></li>\n  <li><a href='/page/2' class='page-item'>2</a></li>\n  <li><a href='/page/3' class='page-item'>3</a></li>\n</ul>\n\nPage number: 1",
+            "output": "Class name: page-item"
+        },
+        {
+            "input": "HTML source code:\n<div class='pagination_wrapper'>\n  <button class='page-btn' data-page='1' role='button'>1</button>\n  <button class='page-btn' data-page='2' role='button'>2</button>\n  <button class='page-btn' data-page='3' role='button'>3</button>\n</div>\n\nPage number: 2",
+            "output": "Class name: page-btn"
+        },
+        {
+            "input": "HTML source code:\n<div class='pagination__controls'>\n  <a href='/page=1' class='page-button' data-page='1'>1</a>\n  <a href='/page=2' class='page-button' data-page='2'>2</a>\n</div>\n\nPage number: 2",
+            "output": "Class name: page-button"
+        },
+        {
+            "input": "HTML source code:\n<div class='pagination'><a href='/page-1' class='pagination__link' data-page='1'>1</a><a href='/page-2' class='pagination__link' data-page='2'>2</a></div>\n\nPage number: 1",
+            "output": "Class name: pagination__link"
+        }
+    ]
+
+    # Define the prompt template
+    template = FewShotPromptTemplate(
+        examples=examples,
+        example_prompt=PromptTemplate(
+            input_variables=["input", "output"],
+            template="{input}\n{output}"
+        ),
+        prefix=(
+            "Your task is to extract the class name of the pagination element  which contains the page number in the atrributes or inner text (element which when clicked navigates to a new page or renders new content) from the provided HTML source "
+            "for a given page number. The pagination element can often be identified by: "
+            "1) the 'role' attribute (e.g., role='button'), "
+            "2) attributes containing the substring 'paginate' or 'pagination',"
+            "3) any other contextual indicators that match the concept of a pagination button.,"
+            "4) Do not just copy the examples given analyze the html source code and return the output based on it"
+            "Even if the exact attribute names differ from the examples, use logical reasoning to find the correct element. "
+            "If the class name atrribute contains multiple names seperated by a blank space then return the first name"
+            "Below are examples to guide you:"
+        ),
+        suffix="HTML source code:\n{reviews}\n\nPage number: {page_number}\n\nReturn only the class name DO NOT generate additional text:",
+        input_variables=["reviews", "page_number"],
+        example_separator="\n---\n"
+    )
+    return template
+
+
+# Reviews are extracted from the HTML of one page
+REVIEW_EXTRACTION_PROMPT = CompiledPrompt(_review_extraction_template(), "html_script")
+
+# The pagination selector is inferred from page one, so the page number is fixed as well
+PAGINATION_PROMPT = CompiledPrompt(_pagination_template(), "reviews", page_number="1")
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from queue import Queue, Empty
+
+from selector_cache import CACHE_DIR
+
+RESULT_STORE_ENABLED = os.environ.get("RESULT_STORE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESULT_STORE_PATH = os.environ.get("RESULT_STORE_PATH", os.path.join(CACHE_DIR, "results.sqlite3"))
+RESULT_TTL = float(os.environ.get("RESULT_TTL", 24 * 60 * 60))  # Seconds stored reviews are served without a refresh
+RESULT_FLUSH_INTERVAL = float(os.environ.get("RESULT_FLUSH_INTERVAL", 1.0))  # Seconds writes are batched for
+RESULT_BATCH_SIZE = int(os.environ.get("RESULT_BATCH_SIZE", 500))
+
+_schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    started REAL NOT NULL,
+    completed REAL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_url ON runs (url, completed);
+CREATE TABLE IF NOT EXISTS reviews (
+    run_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    page INTEGER,
+    fetched REAL NOT NULL,
+    review TEXT NOT NULL,
+    PRIMARY KEY (run_id, position)
+);
+"""
+
+
+class StoredResult:
+    """Reviews of the last completed run of a URL."""
+
+    def __init__(self, url, completed, reviews, ttl):
+        self.url = url
+        self.completed = completed
+        self.reviews = reviews
+        self.age = time.time() - completed
+        self.fresh = self.age < ttl
+
+
+class ResultStore:
+    """
+    SQLite store of the extracted reviews of every URL.
+
+    Each job writes a run; the reviews of a run carry the page they were extracted from
+    and the time they were fetched. Lookups return the last completed run, earlier runs
+    are deleted once a newer one completes and unfinished runs are deleted when their job
+    stops or fails.
+
+    Writes are queued and applied by a writer thread in one transaction per batch, so the
+    extraction loop never waits for the disk.
+    """
+
+    def __init__(self, path=RESULT_STORE_PATH, ttl=RESULT_TTL, flush_interval=RESULT_FLUSH_INTERVAL,
+                 batch_size=RESULT_BATCH_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._writes = Queue()
+        self._positions = {}  # run id -> number of reviews queued
+        self.served_fresh = 0
+        self.served_stale = 0
+        self.batches = 0
+        self.rows_written = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = self._connect()
+        self._db.executescript(_schema)
+        self._db.commit()
+        self._writer = threading.Thread(target=self._write_loop, name="result-store-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def begin(self, run_id, url):
+        """Queue the start of a job run for url."""
+        with self._lock:
+            self._positions[run_id] = 0
+        self._writes.put(("begin", (run_id, url, time.time())))
+
+    def add(self, run_id, page, reviews):
+        """Queue the reviews extracted from a page of a run."""
+        fetched = time.time()
+        with self._lock:
+            position = self._positions.get(run_id, 0)
+            self._positions[run_id] = position + len(reviews)
+        rows = [
+            (run_id, position + index, page, fetched, json.dumps(review))
+            for index, review in enumerate(reviews)
+        ]
+        self._writes.put(("add", rows))
+
+    def finish(self, run_id, url, status):
+        """Mark a run as finished, only completed runs are served."""
+        with self._lock:
+            self._positions.pop(run_id, None)
+        self._writes.put(("finish", (run_id, url, status, time.time())))
+
+    def flush(self, timeout=None):
+        """Wait until every queued write is on disk."""
+        done = threading.Event()
+        self._writes.put(("flush", done))
+        return done.wait(timeout)
+
+    def _apply(self, db, operation, args):
+        if operation == "begin":
+            db.execute("INSERT OR REPLACE INTO runs (id, url, started, status) VALUES (?, ?, ?, 'running')", args)
+        elif operation == "add":
+            db.executemany(
+                "INSERT OR REPLACE INTO reviews (run_id, position, page, fetched, review) VALUES (?, ?, ?, ?, ?)",
+                args
+            )
+            self.rows_written += len(args)
+        elif operation == "finish":
+            run_id, url, status, completed = args
+            if status == "complete":
+                db.execute("UPDATE runs SET status = ?, completed = ? WHERE id = ?", (status, completed, run_id))
+                # The new run supersedes the earlier ones of the URL
+                old_runs = "SELECT id FROM runs WHERE url = ? AND id != ?"
+                db.execute(f"DELETE FROM reviews WHERE run_id IN ({old_runs})", (url, run_id))
+                db.execute("DELETE FROM runs WHERE url = ? AND id != ?", (url, run_id))
+            else:
+                db.execute("DELETE FROM reviews WHERE run_id = ?", (run_id,))
+                db.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            batch = [self._writes.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # Collect writes until the batch is full, the interval passed or a flush is requested
+            while len(batch) < self.batch_size and batch[-1][0] != "flush":
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._writes.get(timeout=remaining))
+                except Empty:
+                    break
+
+            flushes = [args for operation, args in batch if operation == "flush"]
+            try:
+                with db:
+                    for operation, args in batch:
+                        if operation != "flush":
+                            self._apply(db, operation, args)
+                self.batches += 1
+            except sqlite3.Error as e:
+                logging.error(f"Result store write failed: {e}")
+            for done in flushes:
+                done.set()
+
+    def latest(self, url):
+        """Reviews of the last completed run of url, None if there is none."""
+        with self._lock:
+            try:
+                run = self._db.execute(
+                    "SELECT id, completed FROM runs WHERE url = ? AND status = 'complete' ORDER BY completed DESC LIMIT 1",
+                    (url,)
+                ).fetchone()
+                if run is None:
+                    return None
+                rows = self._db.execute(
+                    "SELECT review FROM reviews WHERE run_id = ? ORDER BY position", (run[0],)
+                ).fetchall()
+            except sqlite3.Error as e:
+                logging.warning(f"Result store lookup failed: {e}")
+                return None
+        result = StoredResult(url, run[1], [json.loads(row[0]) for row in rows], self.ttl)
+        if result.fresh:
+            self.served_fresh += 1
+        else:
+            self.served_stale += 1
+        return result
+
+    def run(self, run_id):
+        """Reviews of a completed run, None if it is unknown or was superseded by a newer run of its URL."""
+        with self._lock:
+            try:
+                run = self._db.execute(
+                    "SELECT url, completed FROM runs WHERE id = ? AND status = 'complete'", (run_id,)
+                ).fetchone()
+                if run is None:
+                    return None
+                rows = self._db.execute(
+                    "SELECT review FROM reviews WHERE run_id = ? ORDER BY position", (run_id,)
+                ).fetchall()
+            except sqlite3.Error as e:
+                logging.warning(f"Result store lookup failed: {e}")
+                return None
+        return StoredResult(run[0], run[1], [json.loads(row[0]) for row in rows], self.ttl)
+
+    def stats(self):
+        with self._lock:
+            try:
+                runs, reviews = self._db.execute(
+                    "SELECT (SELECT COUNT(*) FROM runs WHERE status = 'complete'), (SELECT COUNT(*) FROM reviews)"
+                ).fetchone()
+            except sqlite3.Error:
+                runs, reviews = None, None
+        return {
+            "urls": runs,
+            "reviews": reviews,
+            "ttl": self.ttl,
+            "served_fresh": self.served_fresh,
+            "served_stale": self.served_stale,
+            "pending_writes": self._writes.qsize(),
+            "batches": self.batches,
+            "rows_written": self.rows_written
+        }
+
+
+_result_store = None
+_result_store_lock = threading.Lock()
+
+
+def get_result_store():
+    """Return the process wide result store, or None if it is disabled."""
+    global _result_store
+    if not RESULT_STORE_ENABLED:
+        return None
+    with _result_store_lock:
+        if _result_store is None:
+            _result_store = ResultStore()
+        return _result_store
@@ -0,0 +1,70 @@
+import hashlib
+import os
+import re
+import threading
+
+from widget_extractors import parse_rating
+
+# "exact" drops reviews whose fields are identical, "near" also ignores whitespace and case
+# differences in the body, "off" keeps every review
+REVIEW_DEDUP_MODE = os.environ.get("REVIEW_DEDUP_MODE", "exact")
+
+_whitespace = re.compile(r'\s+')
+
+
+def _field(value):
+    return "" if value is None else str(value).strip()
+
+
+def _rating(value):
+    # 5, 5.0 and "5" are the same rating, values parse_rating doesn't read are compared as text
+    rating = parse_rating(value)
+    return _field(value if rating is None else rating)
+
+
+class ReviewDedupIndex:
+    """
+    Set of review digests used to drop reviews a job already returned.
+
+    Overlapping pages, retried pages and chunk boundaries make the extractors return
+    the same review more than once. Every review is reduced to a digest of its
+    (reviewer, title, body, rating) so membership is a single set lookup.
+    """
+
+    def __init__(self, mode=REVIEW_DEDUP_MODE):
+        if mode not in ("exact", "near", "off"):
+            raise ValueError(f"Unknown dedup mode: {mode}")
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._digests = set()
+        self.duplicates = 0
+
+    def digest(self, review):
+        reviewer = _field(review.get("reviewer"))
+        title = _field(review.get("title"))
+        body = _field(review.get("body"))
+        rating = _rating(review.get("rating"))
+        if self.mode == "near":
+            body = _whitespace.sub(" ", body).casefold()
+            title = _whitespace.sub(" ", title).casefold()
+        key = "\0".join((reviewer, title, body, rating))
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+
+    def add(self, review):
+        """Record a review, returns False if it is a duplicate of an earlier one."""
+        if self.mode == "off":
+            return True
+        digest = self.digest(review)
+        with self._lock:
+            if digest in self._digests:
+                self.duplicates += 1
+                return False
+            self._digests.add(digest)
+            return True
+
+    def filter(self, reviews):
+        """Return the reviews that were not seen before, in order."""
+        return [review for review in reviews if self.add(review)]
+
+    def __len__(self):
+        return len(self._digests)
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+CACHE_DIR = os.environ.get("REVIEW_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
+SELECTOR_CACHE_PATH = os.environ.get("SELECTOR_CACHE_PATH", os.path.join(CACHE_DIR, "selectors.json"))
+SELECTOR_CACHE_TTL = float(os.environ.get("SELECTOR_CACHE_TTL", 7 * 24 * 3600))  # One week
+
+_class_attr = re.compile(r'class\s*=\s*["\']([^"\']*)["\']', re.IGNORECASE)
+
+
+def domain_of(url):
+    """Return the cache key domain for a URL ("www." is ignored)."""
+    if "://" not in url:
+        url = "https://" + url
+    netloc = urlparse(url).netloc.lower()
+    if netloc.startswith("www."):
+        netloc = netloc[4:]
+    return netloc
+
+
+def widget_fingerprint(review_html, top_n=20):
+    """
+    Fingerprint the review widget of a review section.
+
+    The most frequent class "blocks" (the part before a BEM "__" or "--"
+    suffix) identify the widget independently of the reviews themselves, so
+    all product pages rendering the same widget share the fingerprint.
+    """
+    if not review_html:
+        return None
+    blocks = Counter()
+    for class_value in _class_attr.findall(review_html):
+        for cls in class_value.split():
+            blocks[cls.split("__")[0].split("--")[0].lower()] += 1
+    if not blocks:
+        return None
+    signature = " ".join(sorted(block for block, _ in blocks.most_common(top_n)))
+    return hashlib.sha1(signature.encode("utf-8")).hexdigest()[:16]
+
+
+class SelectorCache:
+    """
+    Persistent cache of pagination selectors keyed by domain and widget fingerprint.
+
+    Entries are stored as {domain: {fingerprint: {"selector", "created"}}}
+    in a JSON file so that the cache survives restarts and is shared between processes.
+    """
+
+    def __init__(self, path=SELECTOR_CACHE_PATH, ttl=SELECTOR_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load selector cache from {self.path}: {e}")
+            self._entries = {}
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Could not save selector cache to {self.path}: {e}")
+
+    def _is_fresh(self, entry, now):
+        return self.ttl is None or now - entry["created"] <= self.ttl
+
+    def get(self, url, fingerprint=None):
+        """
+        Return the cached selector for the URL's domain, or None on a miss.
+        Without a fingerprint the most recently stored fresh entry of the domain is returned.
+        """
+        domain = domain_of(url)
+        now = time.time()
+        with self._lock:
+            # Re-read so that entries written by other processes are picked up
+            self._load()
+            widgets = self._entries.get(domain, {})
+            candidates = [(fp, entry) for fp, entry in widgets.items() if fingerprint is None or fp == fingerprint]
+            fresh = [(fp, entry) for fp, entry in candidates if self._is_fresh(entry, now)]
+            if len(fresh) < len(candidates):
+                self.expired += len(candidates) - len(fresh)
+                for fp, entry in candidates:
+                    if not self._is_fresh(entry, now):
+                        del widgets[fp]
+                if not widgets:
+                    self._entries.pop(domain, None)
+                self._save()
+            if not fresh:
+                self.misses += 1
+                return None
+            fp, entry = max(fresh, key=lambda item: item[1]["created"])
+            self.hits += 1
+            return entry["selector"]
+
+    def put(self, url, selector, fingerprint=None):
+        """Store the selector inferred for the URL's domain and review widget."""
+        if not selector:
+            return
+        with self._lock:
+            self._load()
+            self._entries.setdefault(domain_of(url), {})[fingerprint or ""] = {
+                "selector": selector,
+                "created": time.time()
+            }
+            self._save()
+
+    def invalidate(self, url, selector=None, fingerprint=None):
+        """
+        Drop the cached entries of the URL's domain, restricted to the given selector
+        and/or fingerprint when provided. Returns the number of entries removed.
+        """
+        domain = domain_of(url)
+        with self._lock:
+            self._load()
+            widgets = self._entries.get(domain, {})
+            stale = [
+                fp for fp, entry in widgets.items()
+                if (selector is None or entry["selector"] == selector)
+                and (fingerprint is None or fp == fingerprint)
+            ]
+            for fp in stale:
+                del widgets[fp]
+            if not widgets:
+                self._entries.pop(domain, None)
+            if stale:
+                self.invalidations += len(stale)
+                self._save()
+                logging.info(f"Invalidated {len(stale)} cached selector(s) for {domain}")
+            return len(stale)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": sum(len(widgets) for widgets in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+_selector_cache = None
+_selector_cache_lock = threading.Lock()
+
+
+def get_selector_cache():
+    """Return the process wide selector cache."""
+    global _selector_cache
+    with _selector_cache_lock:
+        if _selector_cache is None:
+            _selector_cache = SelectorCache()
+        return _selector_cache
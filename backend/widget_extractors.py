@@ -0,0 +1,293 @@
+"""
+Deterministic review extraction for known review widgets.
+
+Most shops use one of a few review widgets whose markup is stable, so their reviews
+can be read with CSS rules instead of a multi-second LLM call. Unknown layouts are
+tried with a generic detector of repeated review items, and a page goes to the LLM
+only when no extractor recognizes it.
+"""
+import logging
+import os
+import re
+import threading
+from collections import defaultdict
+
+from bs4 import BeautifulSoup
+from html_extractor import HTML_PARSER
+
+TEMPLATE_EXTRACTION = os.environ.get("TEMPLATE_EXTRACTION", "true").lower() in ("1", "true", "yes")
+
+_number = re.compile(r'\d+(?:[.,]\d+)?')
+
+
+def parse_rating(value):
+    """Read a rating such as "5", "4.0 star rating" or "Rated 4 out of 5 stars" as a number."""
+    if value is None:
+        return None
+    match = _number.search(str(value))
+    if not match:
+        return None
+    rating = float(match.group().replace(",", "."))
+    if not 0 <= rating <= 5:
+        return None
+    return int(rating) if rating.is_integer() else rating
+
+
+def _text(element):
+    return " ".join(element.get_text(" ", strip=True).split()) if element else ""
+
+
+class WidgetExtractor:
+    """
+    Extraction rules of one review widget.
+
+    Every field is a CSS selector evaluated inside a review item; the rating is read
+    from `rating_attr` of the matched element when given, from its text otherwise.
+    """
+
+    def __init__(self, name, item, body, title=None, rating=None, reviewer=None, rating_attr=None):
+        self.name = name
+        self.item = item
+        self.body = body
+        self.title = title
+        self.rating = rating
+        self.reviewer = reviewer
+        self.rating_attr = rating_attr
+
+    def _rating(self, item):
+        if not self.rating:
+            return None
+        element = item.select_one(self.rating)
+        if element is None:
+            return None
+        if self.rating_attr:
+            return parse_rating(element.get(self.rating_attr))
+        return parse_rating(_text(element))
+
+    def extract(self, soup):
+        """Return the reviews of the page, or None if the widget is not present."""
+        reviews = []
+        for item in soup.select(self.item):
+            body = _text(item.select_one(self.body))
+            if not body:
+                continue
+            review = {"body": body}
+            if self.title:
+                title = _text(item.select_one(self.title))
+                if title:
+                    review["title"] = title
+            rating = self._rating(item)
+            if rating is not None:
+                review["rating"] = rating
+            if self.reviewer:
+                reviewer = _text(item.select_one(self.reviewer))
+                if reviewer:
+                    review["reviewer"] = reviewer
+            reviews.append(review)
+        return reviews or None
+
+
+_item_min_count = 3
+_item_min_text = 20
+# Only names scoped to a review or its author, product and variant names (product-card__name) are no reviewers
+_reviewer_class = re.compile(r'author|reviewer|nickname|(?:review|customer|user)(?:[-_]{1,2})?name', re.IGNORECASE)
+_title_class = re.compile(r'title|heading|headline|subject', re.IGNORECASE)
+_body_class = re.compile(r'body|content|review-?text|message|comment|description', re.IGNORECASE)
+_rating_class = re.compile(r'rating|stars?\b|score', re.IGNORECASE)
+_rating_attrs = ("data-score", "data-rating", "aria-label", "title", "content")
+_heading_tags = {"h1", "h2", "h3", "h4", "h5", "h6"}
+
+
+def _class_string(element):
+    classes = element.get("class") or []
+    return " ".join(classes) if isinstance(classes, list) else classes
+
+
+def _signature(element):
+    classes = element.get("class") or []
+    return element.name, classes[0] if classes else None
+
+
+class RepeatedItemExtractor:
+    """
+    Generic detector for review lists: a container with at least three children of the
+    same tag and class that each hold text. Fields are then located by class name hints.
+    Only confident results are returned, everything else is left to the LLM.
+    """
+
+    name = "repeated-items"
+
+    def _find_items(self, soup):
+        best_items, best_text = None, 0
+        for container in soup.find_all(True):
+            groups = defaultdict(list)
+            for child in container.find_all(True, recursive=False):
+                groups[_signature(child)].append(child)
+            for (name, first_class), items in groups.items():
+                if len(items) < _item_min_count or first_class is None:
+                    continue
+                lengths = [len(item.get_text(strip=True)) for item in items]
+                if min(lengths) < _item_min_text:
+                    continue
+                if sum(lengths) > best_text:
+                    best_items, best_text = items, sum(lengths)
+        return best_items
+
+    def _field(self, item, pattern):
+        for element in item.find_all(True):
+            if pattern.search(_class_string(element)):
+                text = _text(element)
+                if text:
+                    return text
+        return ""
+
+    def _title(self, item):
+        for element in item.find_all(True):
+            if element.name in _heading_tags or _title_class.search(_class_string(element)):
+                text = _text(element)
+                if text:
+                    return text
+        return ""
+
+    def _body(self, item, exclude):
+        is_body = lambda element: bool(_body_class.search(_class_string(element)))
+        # Innermost matches only, wrappers named "content" would include the whole item
+        candidates = [_text(element) for element in item.find_all(is_body) if not element.find(is_body)]
+        if not candidates:
+            # Fall back to the longest text leaf of the item
+            candidates = [_text(element) for element in item.find_all(True) if not element.find(True)]
+        candidates = [text for text in candidates if text and text not in exclude]
+        return max(candidates, key=len) if candidates else ""
+
+    def _rating(self, item):
+        for element in [item] + item.find_all(True):
+            if not _rating_class.search(_class_string(element)):
+                continue
+            for attr in _rating_attrs:
+                rating = parse_rating(element.get(attr))
+                if rating is not None:
+                    return rating
+            rating = parse_rating(_text(element))
+            if rating is not None:
+                return rating
+        return None
+
+    def extract(self, soup):
+        items = self._find_items(soup)
+        if not items:
+            return None
+        reviews = []
+        for item in items:
+            reviewer = self._field(item, _reviewer_class)
+            title = self._title(item)
+            body = self._body(item, exclude={reviewer, title})
+            if not body:
+                return None
+            review = {"body": body}
+            if title:
+                review["title"] = title
+            rating = self._rating(item)
+            if rating is not None:
+                review["rating"] = rating
+            if reviewer:
+                review["reviewer"] = reviewer
+            reviews.append(review)
+        # Review items carry a rating or a reviewer, other repeated blocks (menus, product cards) don't
+        identified = sum(1 for review in reviews if "rating" in review or "reviewer" in review)
+        if identified * 2 < len(reviews):
+            return None
+        return reviews
+
+
+_extractors = []
+_extractors_lock = threading.Lock()
+
+
+def register_extractor(extractor, first=False):
+    """
+    Add an extractor to the registry. Extractors are tried in registration order and need
+    a `name` and an `extract(soup)` method returning a list of reviews or None.
+    """
+    with _extractors_lock:
+        if first:
+            _extractors.insert(0, extractor)
+        else:
+            _extractors.append(extractor)
+
+
+def get_extractors():
+    with _extractors_lock:
+        return list(_extractors)
+
+
+register_extractor(WidgetExtractor(
+    name="judge.me",
+    item=".jdgm-rev",
+    title=".jdgm-rev__title",
+    body=".jdgm-rev__body",
+    rating=".jdgm-rev__rating",
+    rating_attr="data-score",
+    reviewer=".jdgm-rev__author"
+))
+register_extractor(WidgetExtractor(
+    name="reviews.io",
+    item=".R-ContentList__item",
+    title=".R-TextHeading",
+    body=".R-TextBody",
+    rating=".R-RatingStars",
+    reviewer=".cssVar-authorName"
+))
+register_extractor(WidgetExtractor(
+    name="yotpo",
+    item=".yotpo-review",
+    title=".yotpo-review-title, .content-title",
+    body=".yotpo-read-more-text, .content-review",
+    rating=".yotpo-review-stars .sr-only, .yotpo-review-stars",
+    reviewer=".yotpo-reviewer-name, .yotpo-user-name"
+))
+# Generic detection is the last resort before the LLM
+register_extractor(RepeatedItemExtractor())
+
+
+def extract_with_templates(review_html):
+    """
+    Try every registered extractor on the review HTML.
+
+    Returns:
+        tuple: (extractor name, list of reviews) or None if no extractor recognized the page
+    """
+    if not review_html:
+        return None
+    soup = BeautifulSoup(review_html, HTML_PARSER)
+    for extractor in get_extractors():
+        try:
+            reviews = extractor.extract(soup)
+        except Exception as e:
+            logging.error(f"Extractor {extractor.name} failed: {e}")
+            continue
+        if reviews:
+            return extractor.name, reviews
+    return None
+
+
+class ExtractionPathStats:
+    """Counts the pages handled by each extractor and by the LLM."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pages = defaultdict(int)
+
+    def record(self, path):
+        with self._lock:
+            self._pages[path] += 1
+
+    def as_dict(self):
+        with self._lock:
+            total = sum(self._pages.values())
+            return {
+                path: {"pages": pages, "share": pages / total}
+                for path, pages in sorted(self._pages.items())
+            }
+
+
+extraction_path_stats = ExtractionPathStats()
@@ -0,0 +1,282 @@
+"""
+Pagination through the review widget's own XHR endpoint.
+
+Review widgets load their pages from a JSON or HTML endpoint with a page parameter.
+While the first page is scrolled, Chrome's performance log records these requests; the
+endpoint is identified from it and later pages are fetched directly over a pooled HTTP
+client, several at a time and without a browser. Endpoints returning JSON data instead of
+rendered HTML have their review records rendered as HTML, so every page reaches the
+extraction pipeline as markup.
+"""
+import html
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import httpx
+
+XHR_PAGINATION = os.environ.get("XHR_PAGINATION", "true").lower() in ("1", "true", "yes")
+XHR_FETCH_WORKERS = int(os.environ.get("XHR_FETCH_WORKERS", 4))  # Pages fetched at the same time
+XHR_MAX_PAGES = int(os.environ.get("XHR_MAX_PAGES", 200))
+XHR_TIMEOUT = float(os.environ.get("XHR_TIMEOUT", 30))
+
+# Query parameters holding a page number (offset style parameters need the page size and are not supported)
+PAGE_PARAMS = ("page", "pagenumber", "page_number", "pagenum", "page_num", "pg", "currentpage", "current_page", "p")
+_review_hint = re.compile(r'review|rating|testimonial|feedback', re.IGNORECASE)
+# Request headers worth replaying, the rest is set by the HTTP client
+_replayed_headers = ("accept", "x-requested-with", "referer", "origin", "authorization")
+_tag = re.compile(r'<[^>]*>')
+_class_name = re.compile(r'[^\w-]+')
+
+
+class ReviewEndpoint:
+    """A paginated review endpoint and the request that loaded one of its pages."""
+
+    def __init__(self, url, page_param, page, headers=None):
+        self.url = url
+        self.page_param = page_param
+        self.page = page
+        self.headers = headers or {}
+
+    def page_url(self, page):
+        parts = urlsplit(self.url)
+        query = [
+            (name, str(page) if name == self.page_param else value)
+            for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        ]
+        return urlunsplit(parts._replace(query=urlencode(query)))
+
+    def __repr__(self):
+        return f"ReviewEndpoint({self.url!r}, page_param={self.page_param!r})"
+
+
+def network_requests(performance_log):
+    """
+    XHR and fetch requests of a Chrome performance log.
+
+    Returns:
+        list: dicts with url, method, headers, status and mime_type, in request order
+    """
+    requests = {}
+    for entry in performance_log:
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, TypeError, ValueError):
+            continue
+        params = message.get("params", {})
+        if message.get("method") == "Network.requestWillBeSent" and params.get("type") in ("XHR", "Fetch"):
+            request = params.get("request", {})
+            requests[params.get("requestId")] = {
+                "url": request.get("url", ""),
+                "method": request.get("method", "GET"),
+                "headers": request.get("headers", {}),
+                "status": None,
+                "mime_type": None
+            }
+        elif message.get("method") == "Network.responseReceived" and params.get("requestId") in requests:
+            response = params.get("response", {})
+            requests[params["requestId"]]["status"] = response.get("status")
+            requests[params["requestId"]]["mime_type"] = response.get("mimeType")
+    return list(requests.values())
+
+
+def _page_param(url):
+    """Name and value of the page number parameter of url, None if it has none."""
+    for name, value in parse_qsl(urlsplit(url).query, keep_blank_values=True):
+        if name.lower() in PAGE_PARAMS and value.isdigit():
+            return name, int(value)
+    return None
+
+
+def find_review_endpoint(requests):
+    """
+    Pick the paginated review endpoint among the captured requests.
+
+    Candidates are successful GET requests with a page number parameter whose URL
+    mentions reviews or ratings; JSON and HTML responses are preferred.
+    """
+    best, best_score = None, 0
+    for request in requests:
+        if request["method"] != "GET" or request["status"] not in (None, 200):
+            continue
+        page = _page_param(request["url"])
+        if page is None or not _review_hint.search(request["url"]):
+            continue
+        score = 2
+        mime_type = request["mime_type"] or ""
+        if "json" in mime_type or "html" in mime_type or "javascript" in mime_type:
+            score += 1
+        if score > best_score:
+            headers = {
+                name: value for name, value in request["headers"].items()
+                if name.lower() in _replayed_headers
+            }
+            best, best_score = ReviewEndpoint(request["url"], page[0], page[1], headers), score
+    return best
+
+
+def discover_review_endpoint(driver):
+    """Review endpoint requested by the page loaded in driver, None if there is none or no log was recorded."""
+    try:
+        performance_log = driver.get_log("performance")
+    except Exception as e:
+        logging.info(f"No performance log available: {e}")
+        return None
+    return find_review_endpoint(network_requests(performance_log))
+
+
+def _markup(data):
+    """The longest string holding markup in a JSON document, widgets often return rendered HTML."""
+    best = ""
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            if len(value) > len(best) and _tag.search(value):
+                best = value
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return best
+
+
+def _records(data):
+    """The longest list of objects in a JSON document, the review records of a data endpoint."""
+    best = []
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, list):
+            if len(value) > len(best) and all(isinstance(item, dict) for item in value):
+                best = value
+            stack.extend(value)
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+    return best
+
+
+def _text_value(value):
+    """A scalar field as text, None for empty values and links."""
+    if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+        return None
+    value = str(value).strip()
+    # Image and product links carry nothing to extract
+    if not value or value.startswith(("http://", "https://", "//")):
+        return None
+    return value
+
+
+def _fields(record, prefix=""):
+    """(name, value) of the text fields of a record, nested objects flattened into prefixed names."""
+    for key, value in record.items():
+        name = _class_name.sub("-", f"{prefix}{key}")
+        if name.lower() == "id" or name.lower().endswith(("_id", "-id")):
+            continue
+        if isinstance(value, dict):
+            yield from _fields(value, f"{name}-")
+        elif isinstance(value, list):
+            values = [text for text in map(_text_value, value) if text]
+            if values:
+                yield name, ", ".join(values)
+        else:
+            value = _text_value(value)
+            if value:
+                yield name, value
+
+
+def records_html(records):
+    """
+    Render JSON review records as HTML for the extraction pipeline.
+
+    Every record becomes a "review" element holding one element per field, classed by
+    the field name, so the section locator, the compact serialization and the LLM see
+    the same shape as a rendered widget. Markup inside fields is kept, it is cleaned
+    with the rest of the page.
+    """
+    items = []
+    for record in records:
+        fields = "".join(
+            f'<p class="{name}">{value if _tag.search(value) else html.escape(value, quote=False)}</p>'
+            for name, value in _fields(record)
+        )
+        if fields:
+            items.append(f'<div class="review">{fields}</div>')
+    return f'<div class="reviews">{"".join(items)}</div>' if items else ""
+
+
+def _text_length(markup):
+    return len(_tag.sub("", markup).strip())
+
+
+def page_content(response):
+    """
+    Review markup of an endpoint response, None for an empty page.
+
+    Rendered HTML is returned as is, also when wrapped in JSON; JSON review records are
+    rendered by records_html, whichever of the two holds more text is used.
+    """
+    if response.status_code != 200:
+        return None
+    content_type = response.headers.get("content-type", "")
+    text = response.text
+    if "json" in content_type or text.lstrip().startswith(("{", "[")):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        if data is not None:
+            text = max((_markup(data), records_html(_records(data))), key=_text_length)
+    return text if _text_length(text) else None
+
+
+def fetch_pages(endpoint, start_page, cookies=None, max_pages=XHR_MAX_PAGES, workers=XHR_FETCH_WORKERS, client=None):
+    """
+    Fetch the pages of an endpoint from start_page on, `workers` pages at a time.
+
+    Yields (page number, content) in page order and stops at the first failed or empty
+    page, the pages after it in the same batch are discarded.
+    """
+    client = client or get_http_client()
+    last_page = start_page + max_pages - 1
+
+    def fetch(page):
+        try:
+            return page_content(client.get(endpoint.page_url(page), headers=endpoint.headers, cookies=cookies))
+        except httpx.HTTPError as e:
+            logging.warning(f"Fetching review page {page} failed: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="xhr-pages") as executor:
+        page = start_page
+        while page <= last_page:
+            pages = list(range(page, min(page + workers, last_page + 1)))
+            for page_num, content in zip(pages, executor.map(fetch, pages)):
+                if content is None:
+                    return
+                yield page_num, content
+            page = pages[-1] + 1
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """Return the process wide HTTP client used for review endpoints."""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                timeout=XHR_TIMEOUT,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+                headers={
+                    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+                }
+            )
+        return _http_client
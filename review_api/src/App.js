@@ -71,6 +71,7 @@ const App = () => {
   const [reviewDict, setReviewDict] = useState({ reviews_count: 0, reviews: [] });
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  const [stopped, setStopped] = useState(false);
 
   useEffect(() => {
     console.log('reviewDict has been updated:', reviewDict);
@@ -81,6 +82,7 @@ const App = () => {
     setReviewDict({ reviews_count: 0, reviews: [] });
     setLoading(true);
     setError('');
+    setStopped(false);
   };
 
   useEffect(() => {
@@ -88,38 +90,63 @@ const App = () => {
 
     const eventSource = new EventSource(`http://localhost:5000/api/reviews?page=${encodeURIComponent(url)}`);
 
-    eventSource.onmessage = (event) => {
-      console.log('Incoming SSE data:', event.data);
+    const parse = (event) => {
       try {
-        const data = JSON.parse(event.data);
-
-        if (data.error) {
-          setError(data.error);
-          setLoading(false);
-          eventSource.close();
-        } else if (data.status === 'complete') {
-          console.log('Processing complete:', data);
-          setLoading(false);
-          eventSource.close();
-        } else {
-          console.log('Update received:', data);
-          setReviewDict((prevReviews) => ({
-            reviews_count: data.reviews_count || prevReviews.reviews_count,
-            reviews: data.reviews || prevReviews.reviews,
-          }));
-        }
+        return JSON.parse(event.data);
       } catch (e) {
         console.error('Error parsing SSE data:', e, event.data);
         setError('Error processing incoming data.');
         setLoading(false);
         eventSource.close();
+        return null;
       }
     };
 
+    // All reviews collected so far, sent when the stream opens
+    eventSource.addEventListener('snapshot', (event) => {
+      const data = parse(event);
+      if (!data) return;
+      console.log('Snapshot received:', data);
+      setReviewDict({ reviews_count: data.reviews_count, reviews: data.reviews });
+    });
+
+    // Only the reviews added since the previous event
+    eventSource.addEventListener('reviews', (event) => {
+      const data = parse(event);
+      if (!data) return;
+      console.log('Update received:', data);
+      setReviewDict((prevReviews) => ({
+        reviews_count: data.reviews_count,
+        reviews: prevReviews.reviews.concat(data.reviews),
+      }));
+    });
+
+    eventSource.addEventListener('status', (event) => {
+      const data = parse(event);
+      if (!data) return;
+      if (data.status === 'error') {
+        setError(data.error);
+        setLoading(false);
+        eventSource.close();
+      } else if (data.status === 'complete') {
+        console.log('Processing complete:', data);
+        setLoading(false);
+        eventSource.close();
+      } else if (data.status === 'stopped') {
+        // Reconnecting would start the job again
+        console.log('Processing stopped:', data);
+        setStopped(true);
+        setLoading(false);
+        eventSource.close();
+      }
+    });
+
     eventSource.onerror = () => {
-      setError('Connection error. Please try again.');
-      setLoading(false);
-      eventSource.close();
+      // The browser reconnects on its own and resumes after the last event id it received
+      if (eventSource.readyState === EventSource.CLOSED) {
+        setError('Connection error. Please try again.');
+        setLoading(false);
+      }
     };
 
     return () => {
@@ -150,6 +177,8 @@ const App = () => {
       
       {error && <p style={{ color: 'red' }}>{error}</p>}
 
+      {stopped && <p className="loading_bar">Extraction was stopped, showing the reviews collected so far.</p>}
+
       {!error && reviewDict.reviews_count > 0 && (
         <ReviewsDisplay 
           reviews_count={reviewDict.reviews_count} 